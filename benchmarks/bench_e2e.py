@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+"""
+End-to-end benchmark for the scan path
+
+Runs the whole service against the PN532 emulator and a stub Home Assistant
+HTTP server, all in one process:
+
+    emulated tag arrival -> PN532Reader -> SpottyService -> HomeAssistantClient
+    -> stub /api/events/tag_scanned
+
+Each scan presents a tag with a fresh UID and measures the time until its
+tag_scanned event reaches the stub server. After the scans the service polls
+an empty field for --soak seconds, which is used to measure polls per second
+and CPU time per poll; memory growth covers the whole run. CPU time is
+that of the whole process, so it includes the emulator and the stub server;
+it is meant for comparing runs of this benchmark, not as an absolute number.
+
+Results are printed as JSON and optionally written to --output. They are
+compared against the stored run in --baseline, benchmarks/baseline_e2e.json
+by default, and the script exits with status 1 if an event was missed or
+any metric regressed by more than --tolerance. A baseline taken with another
+--read-mode, --scan-interval or --latency is not compared against. Use
+--save-baseline to store the current run as the new baseline.
+
+Usage: python benchmarks/bench_e2e.py [--scans N] [--soak SECONDS]
+           [--baseline FILE] [--save-baseline] [--output FILE]
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from pn532.emulator import PN532Emulator, Tag  # noqa: E402
+from spotty.main import SpottyService  # noqa: E402
+
+_COMMAND_INLISTPASSIVETARGET = 0x4A
+_COMMAND_INAUTOPOLL = 0x60
+
+# Baseline the results are compared against unless --baseline says otherwise
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline_e2e.json")
+
+# Settings a baseline must have been taken with to be compared against
+_BASELINE_CONFIG = ("read_mode", "scan_interval", "latency")
+
+# Seconds the service ignores the reader after a scan, see SpottyService._poll_reader
+_SCAN_HOLDOFF = 2.0
+
+# Metrics compared against the baseline, and whether higher values are better
+_COMPARED = {
+    "latency_p50_ms": False,
+    "latency_p95_ms": False,
+    "latency_p99_ms": False,
+    "polls_per_second": True,
+    "cpu_ms_per_poll": False,
+    "rss_growth_kb": False,
+}
+
+# Absolute slack below which differences are noise, in the metric's unit
+_NOISE_FLOOR = {
+    "latency_p50_ms": 1.0,
+    "latency_p95_ms": 2.0,
+    "latency_p99_ms": 5.0,
+    "polls_per_second": 0.5,
+    "cpu_ms_per_poll": 0.05,
+    "rss_growth_kb": 512,
+}
+
+
+class StubHomeAssistant(ThreadingHTTPServer):
+    """Minimal Home Assistant REST API that records when events arrive"""
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), _StubHandler)
+        self.events = {}
+        self.arrived = threading.Condition()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _reply(self, body):
+        payload = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        self._reply({"message": "API running."})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        if self.path == "/api/events/tag_scanned":
+            with self.server.arrived:
+                self.server.events[body.get("tag_id")] = time.monotonic()
+                self.server.arrived.notify_all()
+        self._reply({"message": "Event tag_scanned fired."})
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _rss_kb():
+    """Current resident set size in kB"""
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+
+
+def _percentile(values, percent):
+    """Nearest-rank percentile"""
+    ordered = sorted(values)
+    rank = max(int(round(percent / 100 * len(ordered))) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def _tag_id(uid):
+    """Tag id as sent by SpottyService"""
+    return "nfc_" + "_".join(hex(i) for i in uid)
+
+
+def run(args):
+    """Run the benchmark and return the results"""
+    stub = StubHomeAssistant()
+    threading.Thread(target=stub.serve_forever, name="stub-ha", daemon=True).start()
+    emulator = PN532Emulator(response_latency=args.latency, seed=args.seed)
+    emulator.start()
+
+    workdir = tempfile.mkdtemp(prefix="spotty-bench-")
+    token_file = os.path.join(workdir, "token.txt")
+    with open(token_file, "w") as f:
+        f.write("benchmark")
+    config_file = os.path.join(workdir, "config.yaml")
+    with open(config_file, "w") as f:
+        json.dump({
+            "device": emulator.port,
+            "ha_url": stub.url,
+            "token_file": token_file,
+            "scan_interval": args.scan_interval,
+            "read_mode": args.read_mode,
+            "log_level": "WARNING",
+        }, f)
+
+    # The add-on token would redirect the client to the supervisor
+    os.environ.pop("SUPERVISOR_TOKEN", None)
+    os.environ.pop("HASSIO_TOKEN", None)
+    service = SpottyService(config_file)
+    thread = threading.Thread(target=service.run, name="spotty", daemon=True)
+    thread.start()
+    deadline = time.monotonic() + 10
+    while not service.running:
+        if not thread.is_alive() or time.monotonic() > deadline:
+            raise RuntimeError("Spotty service failed to start")
+        time.sleep(0.01)
+
+    rng = random.Random(args.seed)
+    latencies = []
+    missed = 0
+    rss_start = _rss_kb()
+    wall_start = time.monotonic()
+    try:
+        for scan in range(args.scans):
+            # Arrive at a random point of the poll cycle
+            time.sleep(rng.uniform(0, args.scan_interval))
+            uid = bytes([0x04]) + scan.to_bytes(6, "big")
+            tag_id = _tag_id(uid)
+            presented = time.monotonic()
+            emulator.present(Tag(uid))
+            with stub.arrived:
+                stub.arrived.wait_for(lambda: tag_id in stub.events, args.event_timeout)
+            emulator.remove()
+            arrived = stub.events.get(tag_id)
+            if arrived is None:
+                missed += 1
+            else:
+                latencies.append((arrived - presented) * 1000)
+            # Wait out the hold-off so the next tag is not ignored
+            time.sleep(_SCAN_HOLDOFF + 0.1)
+
+        # Idle polling of an empty field
+        polls_start = _polls(emulator)
+        cpu_start = time.process_time()
+        soak_start = time.monotonic()
+        soak_end = soak_start + args.soak
+        while time.monotonic() < soak_end:
+            time.sleep(min(1.0, max(soak_end - time.monotonic(), 0)))
+        soak = time.monotonic() - soak_start
+        cpu = time.process_time() - cpu_start
+        polls = _polls(emulator) - polls_start
+    finally:
+        wall = time.monotonic() - wall_start
+        rss_end = _rss_kb()
+        service.running = False
+        thread.join(10)
+        emulator.stop()
+        stub.shutdown()
+
+    results = {
+        "scans": args.scans,
+        "missed": missed,
+        "duration_s": round(wall, 3),
+        "soak_s": round(soak, 3),
+        "polls": polls,
+        "polls_per_second": round(polls / soak, 3) if soak else None,
+        "cpu_ms_per_poll": round(cpu * 1000 / polls, 4) if polls else None,
+        "rss_start_kb": rss_start,
+        "rss_end_kb": rss_end,
+        "rss_growth_kb": rss_end - rss_start,
+        "rss_max_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "config": {
+            "read_mode": args.read_mode,
+            "scan_interval": args.scan_interval,
+            "latency": args.latency,
+            "python": platform.python_version(),
+        },
+    }
+    if latencies:
+        results.update({
+            "latency_mean_ms": round(statistics.mean(latencies), 3),
+            "latency_p50_ms": round(_percentile(latencies, 50), 3),
+            "latency_p95_ms": round(_percentile(latencies, 95), 3),
+            "latency_p99_ms": round(_percentile(latencies, 99), 3),
+            "latency_max_ms": round(max(latencies), 3),
+        })
+    return results
+
+
+def _polls(emulator):
+    """Number of poll commands the emulator has answered"""
+    return (emulator.commands.get(_COMMAND_INLISTPASSIVETARGET, 0)
+            + emulator.commands.get(_COMMAND_INAUTOPOLL, 0))
+
+
+def compare(results, baseline, tolerance):
+    """Return a list of regressions of `results` against `baseline`"""
+    regressions = []
+    for metric, higher_is_better in _COMPARED.items():
+        current, previous = results.get(metric), baseline.get(metric)
+        if current is None or previous is None:
+            continue
+        change = previous - current if higher_is_better else current - previous
+        if change > max(abs(previous) * tolerance, _NOISE_FLOOR[metric]):
+            regressions.append(f"{metric}: {previous} -> {current}")
+    if results["missed"] > baseline.get("missed", 0):
+        regressions.append(f"missed: {baseline.get('missed', 0)} -> {results['missed']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scans", type=int, default=20, help="Number of tag arrivals")
+    parser.add_argument("--soak", type=float, default=10.0,
+                        help="Seconds of idle polling after the scans")
+    parser.add_argument("--scan-interval", type=float, default=0.5,
+                        help="scan_interval of the service")
+    parser.add_argument("--read-mode", default="poll", choices=("poll", "autopoll", "listen"))
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="Emulated PN532 response latency in seconds")
+    parser.add_argument("--event-timeout", type=float, default=5.0,
+                        help="Seconds to wait for an event before counting it as missed")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE,
+                        help="Compare against the results in this JSON file")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="Store the results as the new baseline instead of comparing")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Allowed relative regression against the baseline")
+    args = parser.parse_args()
+
+    logging.getLogger("spotty").setLevel(logging.WARNING)
+    results = run(args)
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+            f.write("\n")
+        print(f"Saved baseline to {args.baseline}", file=sys.stderr)
+        return 0
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}, run with --save-baseline first", file=sys.stderr)
+        return 1
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    mismatched = [key for key in _BASELINE_CONFIG
+                  if baseline.get("config", {}).get(key) != results["config"][key]]
+    if mismatched:
+        print(f"Baseline {args.baseline} was taken with other {', '.join(mismatched)}, "
+              "not comparing", file=sys.stderr)
+        return 1 if results["missed"] else 0
+    regressions = compare(results, baseline, args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
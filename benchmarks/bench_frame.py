@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark for the PN532 frame codec
+
+Runs the InListPassiveTarget poll cycle (encode command, check ACK, decode
+response, extract UID) against an in-memory transport, once with the frame
+codec and once with the original byte-by-byte implementation, and reports the
+time and transient memory allocated per cycle.
+
+Usage: python benchmarks/bench_frame.py [--cycles N]
+"""
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from pn532.frame import FrameEncoder  # noqa: E402
+from pn532.pn532 import PN532, _ACK, _COMMAND_INLISTPASSIVETARGET  # noqa: E402
+
+# Response to InListPassiveTarget with one MIFARE card with a 7 byte UID
+_RESPONSE_DATA = bytes([0xD5, 0x4B, 0x01, 0x01, 0x00, 0x44, 0x00, 0x07,
+                        0x04, 0x11, 0x22, 0x33, 0x44, 0x55, 0x66])
+_RESPONSE = (bytes([0x00, 0x00, 0xFF, len(_RESPONSE_DATA), (-len(_RESPONSE_DATA)) & 0xFF])
+             + _RESPONSE_DATA
+             + bytes([(-sum(_RESPONSE_DATA)) & 0xFF, 0x00]))
+
+
+class MemoryPN532(PN532):
+    """PN532 on an in-memory transport that always answers with a card"""
+    def __init__(self):  # pylint: disable=super-init-not-called
+        # Skip the wakeup handshake, there is no chip to talk to
+        self.debug = False
+        self._encoder = FrameEncoder()
+        self._replies = []
+
+    def _write_data(self, framebytes):
+        self._replies = [_ACK, _RESPONSE]
+
+    def _wait_ready(self, timeout):
+        return True
+
+    def _read_data(self, count):
+        return self._replies.pop(0)
+
+
+def legacy_cycle(pn532):
+    """The original call_function/_write_frame/_read_frame code path"""
+    params = [0x01, 0x00]
+    data = bytearray(2+len(params))
+    data[0] = 0xD4
+    data[1] = _COMMAND_INLISTPASSIVETARGET & 0xFF
+    for i, val in enumerate(params):
+        data[2+i] = val
+    length = len(data)
+    frame = bytearray(length+7)
+    frame[0] = 0x00
+    frame[1] = 0x00
+    frame[2] = 0xFF
+    checksum = sum(frame[0:3])
+    frame[3] = length & 0xFF
+    frame[4] = (~length + 1) & 0xFF
+    frame[5:-2] = data
+    checksum += sum(data)
+    frame[-2] = ~checksum & 0xFF
+    frame[-1] = 0x00
+    pn532._write_data(bytes(frame))
+    if not _ACK == pn532._read_data(len(_ACK)):
+        raise RuntimeError('Did not receive expected ACK from PN532!')
+    response = pn532._read_data(19+2+7)
+    offset = 0
+    while response[offset] == 0x00:
+        offset += 1
+    offset += 1
+    frame_len = response[offset]
+    if (frame_len + response[offset+1]) & 0xFF != 0:
+        raise RuntimeError('Response length checksum did not match length!')
+    checksum = sum(response[offset+2:offset+2+frame_len+1]) & 0xFF
+    if checksum != 0:
+        raise RuntimeError('Response checksum did not match expected value: ', checksum)
+    response = response[offset+2:offset+2+frame_len]
+    response = response[2:]
+    return response[6:6+response[5]]
+
+
+def codec_cycle(pn532):
+    """The current read_passive_target code path"""
+    return pn532.read_passive_target()
+
+
+def measure(name, cycle, pn532, cycles):
+    """Time `cycles` runs of `cycle` and measure transient allocations"""
+    assert bytes(cycle(pn532)) == _RESPONSE_DATA[8:], 'cycle returned the wrong UID'
+    for _ in range(1000):
+        cycle(pn532)
+
+    start = time.perf_counter()
+    for _ in range(cycles):
+        cycle(pn532)
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    peaks = 0
+    samples = min(cycles, 10000)
+    for _ in range(samples):
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        cycle(pn532)
+        peaks += tracemalloc.get_traced_memory()[1] - current
+    tracemalloc.stop()
+
+    print(f"{name:8} {elapsed / cycles * 1e6:8.2f} us/cycle  {peaks / samples:8.1f} bytes/cycle peak")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PN532 frame codec microbenchmark")
+    parser.add_argument("--cycles", type=int, default=100000, help="Poll cycles to run")
+    args = parser.parse_args()
+
+    pn532 = MemoryPN532()
+    measure("legacy", legacy_cycle, pn532, args.cycles)
+    measure("codec", codec_cycle, pn532, args.cycles)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Import time and memory budget for the reader
+
+For each transport, starts a fresh interpreter that imports spotty.nfc_reader
+and loads the transport's driver with get_transport(), and reports the import
+time, the resident set size and which optional modules got loaded. Drivers
+are imported lazily, so a UART reader must not load spidev, gpiozero or the
+I2C and SPI drivers.
+
+Measure before and after a change: the numbers depend on the machine.
+
+Exits with status 1 if a transport exceeds --max-import-ms or --max-rss-kb,
+or loads a module it should not.
+
+Usage: python benchmarks/bench_import.py [--max-import-ms MS] [--max-rss-kb KB]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+
+# Modules only some transports need, and the transports allowed to load them
+_OPTIONAL = {
+    "spidev": ("spi",),
+    "gpiozero": (),
+    "pn532.uart": ("uart",),
+    "pn532.i2c": ("i2c",),
+    "pn532.spi": ("spi",),
+}
+
+# Runs in the fresh interpreter, prints the measurements as JSON
+_PROBE = """
+import json, os, sys, time
+start = time.perf_counter()
+import spotty.nfc_reader
+from pn532 import get_transport
+get_transport(sys.argv[1])
+elapsed = time.perf_counter() - start
+with open("/proc/self/statm") as f:
+    rss = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+print(json.dumps({"import_ms": elapsed * 1000, "rss_kb": rss,
+                  "modules": [m for m in sys.argv[2:] if m in sys.modules]}))
+"""
+
+
+def measure(transport, runs):
+    """Best import time and RSS of `runs` fresh interpreters"""
+    results = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", _PROBE, transport, *_OPTIONAL],
+            cwd=ROOT, check=True, capture_output=True, text=True,
+            env=dict(os.environ, PYTHONPATH=ROOT)).stdout
+        results.append(json.loads(output))
+    return {
+        "import_ms": round(min(r["import_ms"] for r in results), 2),
+        "rss_kb": min(r["rss_kb"] for r in results),
+        "modules": results[0]["modules"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reader import time and memory budget")
+    parser.add_argument("--runs", type=int, default=5, help="Interpreters to start per transport")
+    parser.add_argument("--max-import-ms", type=float, default=500.0,
+                        help="Import time budget per transport")
+    parser.add_argument("--max-rss-kb", type=int, default=40000,
+                        help="Resident set size budget after the imports")
+    args = parser.parse_args()
+
+    from pn532 import TRANSPORTS
+
+    failures = []
+    results = {}
+    for transport in TRANSPORTS:
+        result = results[transport] = measure(transport, args.runs)
+        if result["import_ms"] > args.max_import_ms:
+            failures.append(f"{transport}: import took {result['import_ms']} ms")
+        if result["rss_kb"] > args.max_rss_kb:
+            failures.append(f"{transport}: RSS is {result['rss_kb']} kB")
+        for module in result["modules"]:
+            if transport not in _OPTIONAL[module]:
+                failures.append(f"{transport}: loaded {module}")
+    print(json.dumps(results, indent=2))
+    for failure in failures:
+        print(f"OVER BUDGET {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, ROOT)
+    sys.exit(main())
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the PN532 SPI transport
+
+Runs the InListPassiveTarget poll cycle over a simulated PN532 on SPI, once
+with the current transport and once with the original one (per byte bit
+reversal loop, list rebuilding and fixed sleeps around every transfer), and
+reports wall time, CPU time and SPI transactions per cycle.
+
+The simulated chip answers on the SPI protocol level (status read, data
+write, data read, all LSB first) and takes --chip-latency seconds to prepare
+each ACK and response, like the real chip needs time to process a command.
+Time on the wire is not simulated. Chip select is a mock GPIO pin, as with
+the Waveshare HAT.
+
+Usage: python benchmarks/bench_spi.py [--cycles N] [--chip-latency SECONDS]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from gpiozero import Device, DigitalOutputDevice  # noqa: E402
+from gpiozero.pins.mock import MockFactory  # noqa: E402
+
+Device.pin_factory = MockFactory()
+
+import pn532.spi as spi  # noqa: E402
+from pn532.frame import FrameEncoder  # noqa: E402
+from pn532.pn532 import PN532, _ACK, _COMMAND_INLISTPASSIVETARGET  # noqa: E402
+
+_CS_PIN = 4
+
+# Response to InListPassiveTarget with one MIFARE card with a 7 byte UID
+_RESPONSE_DATA = bytes([0xD5, 0x4B, 0x01, 0x01, 0x00, 0x44, 0x00, 0x07,
+                        0x04, 0x11, 0x22, 0x33, 0x44, 0x55, 0x66])
+_RESPONSE = (bytes([0x00, 0x00, 0xFF, len(_RESPONSE_DATA), (-len(_RESPONSE_DATA)) & 0xFF])
+             + _RESPONSE_DATA
+             + bytes([(-sum(_RESPONSE_DATA)) & 0xFF, 0x00]))
+_UID = _RESPONSE_DATA[8:]
+
+
+def _reverse(data):
+    return bytes(data).translate(spi._REVERSE)
+
+
+class FakeSpiDev:
+    """spidev.SpiDev stand-in behaving like a PN532 that always sees a card"""
+    def __init__(self, latency):
+        self.latency = latency
+        self.max_speed_hz = 0
+        self.mode = 0
+        self.transactions = 0
+        self._frames = []
+        self._ready_at = 0.0
+
+    def _transfer(self, buf):
+        self.transactions += 1
+        data = _reverse(buf)
+        if data[0] == spi._SPI_STATREAD:
+            ready = self._frames and time.monotonic() >= self._ready_at
+            return list(_reverse([0, spi._SPI_READY if ready else 0]))
+        if data[0] == spi._SPI_DATAWRITE:
+            if data[6:8] == bytes([0xD4, _COMMAND_INLISTPASSIVETARGET]):
+                self._frames = [_ACK, _RESPONSE]
+                self._ready_at = time.monotonic() + self.latency
+            return [0] * len(buf)
+        if data[0] == spi._SPI_DATAREAD:
+            frame = self._frames.pop(0) if self._frames else b''
+            self._ready_at = time.monotonic() + self.latency
+            reply = (b'\x00' + frame + bytes(len(buf)))[:len(buf)]
+            return list(_reverse(reply))
+        return [0] * len(buf)
+
+    def xfer(self, buf):
+        return self._transfer(buf)
+
+    def xfer2(self, buf):
+        return self._transfer(buf)
+
+    def writebytes(self, buf):
+        self._transfer(buf)
+
+    def readbytes(self, count):
+        return self._transfer([0] * count)
+
+    def close(self):
+        pass
+
+
+class LegacySPIDevice:
+    """The original SPIDevice"""
+    def __init__(self, chip, cs=None):
+        self.spi = chip
+        self._cs = cs
+        if cs:
+            self._cs_pin = DigitalOutputDevice(cs)
+            self._cs_pin.on()
+        self.spi.max_speed_hz = 1000000
+        self.spi.mode = 0b10
+
+    def writebytes(self, buf):
+        if self._cs:
+            self._cs_pin.off()
+            time.sleep(0.001)
+        ret = self.spi.writebytes(list(buf))
+        if self._cs:
+            time.sleep(0.001)
+            self._cs_pin.on()
+        return ret
+
+    def xfer(self, buf):
+        if self._cs:
+            self._cs_pin.off()
+            time.sleep(0.001)
+        buf = bytearray(self.spi.xfer(buf))
+        if self._cs:
+            time.sleep(0.001)
+            self._cs_pin.on()
+        return buf
+
+
+def legacy_reverse_bit(num):
+    """The original bit reversal loop"""
+    result = 0
+    for _ in range(8):
+        result <<= 1
+        result += (num & 1)
+        num >>= 1
+    return result
+
+
+class LegacySPI(PN532):
+    """The original PN532_SPI transfer methods"""
+    def __init__(self, chip):  # pylint: disable=super-init-not-called
+        self.debug = False
+        self._encoder = FrameEncoder()
+        self._spi = LegacySPIDevice(chip, _CS_PIN)
+
+    def _wait_ready(self, timeout=1):
+        status = bytearray([legacy_reverse_bit(spi._SPI_STATREAD), 0])
+        timestamp = time.monotonic()
+        while (time.monotonic() - timestamp) < timeout:
+            time.sleep(0.01)
+            status = self._spi.xfer(status)
+            if legacy_reverse_bit(status[1]) == spi._SPI_READY:
+                return True
+            else:
+                time.sleep(0.005)
+        return False
+
+    def _read_data(self, count):
+        frame = bytearray(count+1)
+        frame[0] = legacy_reverse_bit(spi._SPI_DATAREAD)
+        time.sleep(0.005)
+        frame = self._spi.xfer(frame)
+        for i, val in enumerate(frame):
+            frame[i] = legacy_reverse_bit(val)
+        return frame[1:]
+
+    def _write_data(self, framebytes):
+        rev_frame = [legacy_reverse_bit(x) for x in bytes([spi._SPI_DATAWRITE]) + framebytes]
+        time.sleep(0.02)
+        self._spi.writebytes(bytes(rev_frame))
+
+
+def current_spi(chip):
+    """PN532_SPI on `chip`, without the wakeup handshake"""
+    spi.spidev.SpiDev = lambda bus, device: chip
+    pn532 = spi.PN532_SPI.__new__(spi.PN532_SPI)
+    pn532.debug = False
+    pn532._encoder = FrameEncoder()
+    pn532._spi = spi.SPIDevice(_CS_PIN + 1)
+    return pn532
+
+
+def measure(name, pn532, chip, cycles):
+    """Run `cycles` poll cycles and print the cost per cycle"""
+    assert bytes(pn532.read_passive_target()) == _UID, 'cycle returned the wrong UID'
+    chip.transactions = 0
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    for _ in range(cycles):
+        pn532.read_passive_target()
+    wall = time.perf_counter() - wall
+    cpu = time.process_time() - cpu
+    print(f"{name:8} {wall / cycles * 1e3:8.3f} ms/cycle  {cpu / cycles * 1e6:8.1f} us CPU/cycle"
+          f"  {chip.transactions / cycles:5.1f} transactions/cycle")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PN532 SPI transport benchmark")
+    parser.add_argument("--cycles", type=int, default=200, help="Poll cycles to run")
+    parser.add_argument("--chip-latency", type=float, default=0.002,
+                        help="Seconds the simulated PN532 takes to prepare each frame")
+    args = parser.parse_args()
+
+    chip = FakeSpiDev(args.chip_latency)
+    measure("legacy", LegacySPI(chip), chip, args.cycles)
+    chip = FakeSpiDev(args.chip_latency)
+    measure("current", current_spi(chip), chip, args.cycles)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+"""
+Benchmark and checks for the Home Assistant WebSocket client
+
+Runs HomeAssistantWebSocketClient against StubWebSocketServer, a local
+stand-in for the Home Assistant WebSocket API that speaks the auth,
+ping/pong, fire_event and result exchange over plain sockets. The
+following cases are checked:
+
+    out_of_order   results sent back in reverse order reach the right futures
+    dropped        a dropped connection fails the requests still waiting
+    reconnect      the client connects again and delivers events afterwards
+
+It also measures the round trip of one tag_scanned event and the rate of
+pipelined fire_event requests. Results are printed as JSON, and the script
+exits with status 1 if a check failed.
+
+Usage: python benchmarks/bench_websocket.py [--events N] [--output FILE]
+"""
+
+import argparse
+import base64
+import hashlib
+import json
+import logging
+import os
+import socket
+import socketserver
+import statistics
+import struct
+import sys
+import threading
+import time
+from concurrent.futures import wait
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from spotty.ha_websocket import HomeAssistantWebSocketClient  # noqa: E402
+
+_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+_OPCODE_TEXT = 0x1
+_OPCODE_CLOSE = 0x8
+_OPCODE_PING = 0x9
+_OPCODE_PONG = 0xA
+
+TOKEN = "benchmark"
+
+
+class StubWebSocketServer(socketserver.ThreadingTCPServer):
+    """Minimal Home Assistant WebSocket API
+
+    Every connection is authenticated against TOKEN, then pings are answered
+    with pongs and fire_event with a successful result. With `reverse_batch`
+    set to n, results are held back until n of them are due and then sent
+    newest first. With `hold_results`, results are not sent at all.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), _StubWebSocketHandler)
+        self.reverse_batch = 0
+        self.hold_results = False
+        self.connections = 0
+        self.events = []
+        self._handlers = set()
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"ws://127.0.0.1:{self.server_address[1]}/api/websocket"
+
+    def drop_connections(self):
+        """Close every open connection without a close frame"""
+        with self._lock:
+            handlers = list(self._handlers)
+        for handler in handlers:
+            handler.drop()
+
+    def serve_in_background(self):
+        threading.Thread(target=self.serve_forever, name="stub-ha-websocket",
+                         daemon=True).start()
+
+
+class _StubWebSocketHandler(socketserver.BaseRequestHandler):
+
+    def setup(self):
+        self._send_lock = threading.Lock()
+        self._held = []
+
+    def drop(self):
+        try:
+            self.request.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def handle(self):
+        if not self._handshake():
+            return
+        server = self.server
+        with server._lock:
+            server.connections += 1
+            server._handlers.add(self)
+        try:
+            self._send_json({"type": "auth_required", "ha_version": "2024.1.0"})
+            auth = self._recv_json()
+            if auth is None:
+                return
+            if auth.get("type") != "auth" or auth.get("access_token") != TOKEN:
+                self._send_json({"type": "auth_invalid", "message": "Invalid access token"})
+                return
+            self._send_json({"type": "auth_ok", "ha_version": "2024.1.0"})
+            while True:
+                message = self._recv_json()
+                if message is None:
+                    return
+                self._handle_message(message)
+        except OSError:
+            pass
+        finally:
+            with server._lock:
+                server._handlers.discard(self)
+
+    def _handle_message(self, message):
+        server = self.server
+        if message.get("type") == "ping":
+            self._send_json({"id": message["id"], "type": "pong"})
+            return
+        if message.get("type") == "fire_event":
+            with server._lock:
+                server.events.append(message)
+            result = {"id": message["id"], "type": "result", "success": True,
+                      "result": {"context": {"id": str(message["id"])}}}
+        else:
+            result = {"id": message.get("id"), "type": "result", "success": False,
+                      "error": {"code": "unknown_command", "message": "Unknown command."}}
+        if server.hold_results:
+            return
+        if server.reverse_batch:
+            self._held.append(result)
+            if len(self._held) >= server.reverse_batch:
+                for held in reversed(self._held):
+                    self._send_json(held)
+                self._held = []
+            return
+        self._send_json(result)
+
+    def _handshake(self):
+        request = b""
+        while b"\r\n\r\n" not in request:
+            chunk = self.request.recv(4096)
+            if not chunk:
+                return False
+            request += chunk
+        headers = {}
+        for line in request.decode("latin-1").split("\r\n")[1:]:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+        key = headers.get("sec-websocket-key")
+        if not key:
+            self.request.sendall(b"HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\n\r\n")
+            return False
+        accept = base64.b64encode(hashlib.sha1((key + _GUID).encode()).digest()).decode()
+        self.request.sendall(("HTTP/1.1 101 Switching Protocols\r\n"
+                              "Upgrade: websocket\r\n"
+                              "Connection: Upgrade\r\n"
+                              f"Sec-WebSocket-Accept: {accept}\r\n\r\n").encode())
+        return True
+
+    def _recv_exactly(self, count):
+        data = b""
+        while len(data) < count:
+            chunk = self.request.recv(count - len(data))
+            if not chunk:
+                raise ConnectionError("Connection closed")
+            data += chunk
+        return data
+
+    def _recv_frame(self):
+        """Read one frame from the client, returns (opcode, payload)"""
+        first, second = self._recv_exactly(2)
+        length = second & 0x7F
+        if length == 126:
+            length, = struct.unpack("!H", self._recv_exactly(2))
+        elif length == 127:
+            length, = struct.unpack("!Q", self._recv_exactly(8))
+        # Frames from clients are always masked
+        mask = self._recv_exactly(4) if second & 0x80 else b"\x00" * 4
+        payload = bytes(b ^ mask[i % 4] for i, b in enumerate(self._recv_exactly(length)))
+        return first & 0x0F, payload
+
+    def _send_frame(self, opcode, payload):
+        header = bytearray([0x80 | opcode])
+        if len(payload) < 126:
+            header.append(len(payload))
+        elif len(payload) < 0x10000:
+            header.append(126)
+            header += struct.pack("!H", len(payload))
+        else:
+            header.append(127)
+            header += struct.pack("!Q", len(payload))
+        with self._send_lock:
+            self.request.sendall(bytes(header) + payload)
+
+    def _recv_json(self):
+        """Next text message as JSON, None once the client closes"""
+        while True:
+            try:
+                opcode, payload = self._recv_frame()
+            except ConnectionError:
+                return None
+            if opcode == _OPCODE_TEXT:
+                return json.loads(payload)
+            if opcode == _OPCODE_PING:
+                self._send_frame(_OPCODE_PONG, payload)
+            elif opcode == _OPCODE_CLOSE:
+                self._send_frame(_OPCODE_CLOSE, payload[:2])
+                return None
+
+    def _send_json(self, message):
+        self._send_frame(_OPCODE_TEXT, json.dumps(message).encode())
+
+
+def _wait_for(condition, timeout):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.005)
+    return True
+
+
+def check_out_of_order(server, client, count=8):
+    """Results sent back newest first still resolve the right futures"""
+    server.reverse_batch = count
+    try:
+        futures = [client.fire_event("tag_scanned", {"tag_id": f"tag_{i}"}) for i in range(count)]
+        done, _ = wait(futures, client.timeout)
+        if len(done) != count:
+            return False
+        sent = {message["id"]: message["event_data"]["tag_id"] for message in server.events}
+        return all(future.result()["success"]
+                   and sent[future.result()["id"]] == f"tag_{i}"
+                   for i, future in enumerate(futures))
+    finally:
+        server.reverse_batch = 0
+
+
+def check_dropped(server, client, count=4):
+    """Requests waiting for a result fail once the connection drops"""
+    server.hold_results = True
+    try:
+        futures = [client.fire_event("tag_scanned", {"tag_id": f"held_{i}"}) for i in range(count)]
+        server.drop_connections()
+        done, _ = wait(futures, client.timeout)
+        return (len(done) == count
+                and all(isinstance(future.exception(), ConnectionError) for future in futures))
+    finally:
+        server.hold_results = False
+
+
+def check_reconnect(server, client, connections):
+    """The client connects again by itself and delivers events afterwards"""
+    if not _wait_for(lambda: server.connections > connections, client.timeout):
+        return False
+    return client.tag_scanned("after_reconnect")
+
+
+def run(args):
+    """Run the checks and the benchmark and return the results"""
+    server = StubWebSocketServer()
+    server.serve_in_background()
+    client = HomeAssistantWebSocketClient(None, TOKEN, timeout=5, reconnect_delay=0.05,
+                                          url=server.url)
+    try:
+        if not client.test_connection():
+            raise RuntimeError("Could not connect to the stub WebSocket server")
+
+        round_trips = []
+        for i in range(args.events):
+            start = time.perf_counter()
+            client.tag_scanned(f"sequential_{i}")
+            round_trips.append((time.perf_counter() - start) * 1000)
+
+        start = time.perf_counter()
+        futures = [client.fire_event("tag_scanned", {"tag_id": f"pipelined_{i}"})
+                   for i in range(args.events)]
+        wait(futures, client.timeout)
+        pipelined = time.perf_counter() - start
+
+        checks = {"out_of_order": check_out_of_order(server, client)}
+        connections = server.connections
+        checks["dropped"] = check_dropped(server, client)
+        checks["reconnect"] = check_reconnect(server, client, connections)
+    finally:
+        client.close()
+        server.shutdown()
+        server.server_close()
+
+    return {
+        "events": args.events,
+        "round_trip_p50_ms": round(statistics.median(round_trips), 3),
+        "round_trip_max_ms": round(max(round_trips), 3),
+        "pipelined_events_per_second": round(args.events / pipelined, 1) if pipelined else None,
+        "connections": server.connections,
+        "checks": checks,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--events", type=int, default=200,
+                        help="Number of events for the round trip and pipelining runs")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    logging.getLogger("spotty").setLevel(logging.CRITICAL)
+    results = run(args)
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    failed = [name for name, passed in results["checks"].items() if not passed]
+    for name in failed:
+        print(f"FAILED {name}", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -5,9 +5,36 @@ __all__ = [
     'uart',
     'PN532_I2C',
     'PN532_SPI',
-    'PN532_UART'
+    'PN532_UART',
+    'TRANSPORTS',
+    'get_transport'
 ]
+import importlib
+
 from . import pn532
-from .i2c import PN532_I2C
-from .spi import PN532_SPI
-from .uart import PN532_UART
+
+# Transport name: (module, driver class). Drivers are only imported once they
+# are used, so a UART reader doesn't load spidev, fcntl or the I2C/SPI code.
+TRANSPORTS = {
+    'uart': ('uart', 'PN532_UART'),
+    'i2c': ('i2c', 'PN532_I2C'),
+    'spi': ('spi', 'PN532_SPI'),
+}
+_DRIVERS = {driver: module for module, driver in TRANSPORTS.values()}
+
+
+def get_transport(name):
+    """PN532 driver class for the transport called `name` (see TRANSPORTS)"""
+    if name not in TRANSPORTS:
+        raise ValueError('Unknown transport: {0}'.format(name))
+    module, driver = TRANSPORTS[name]
+    return getattr(importlib.import_module('.' + module, __name__), driver)
+
+
+def __getattr__(name):
+    # Import drivers and their modules on first access
+    if name in _DRIVERS:
+        return getattr(importlib.import_module('.' + _DRIVERS[name], __name__), name)
+    if name in TRANSPORTS:
+        return importlib.import_module('.' + name, __name__)
+    raise AttributeError('module {0!r} has no attribute {1!r}'.format(__name__, name))
@@ -0,0 +1,494 @@
+r"""
+Software PN532 that speaks the HSU (UART) protocol on a pseudo-terminal.
+
+This lets PN532_UART, and everything built on it, run on a plain Linux box
+without a reader attached:
+
+    emulator = PN532Emulator()
+    emulator.start()
+    pn532 = PN532_UART(emulator.port)
+    emulator.present(Tag(b'\x04\x11\x22\x33\x44\x55\x66'))
+    print(pn532.read_passive_target())
+
+It answers GetFirmwareVersion, SAMConfiguration, SetSerialBaudRate,
+PowerDown, RFConfiguration, InListPassiveTarget, InDataExchange,
+InCommunicateThru (READ and FAST_READ) and InAutoPoll with ACK and response
+frames the way the chip does, and tags can be presented and removed at any
+time. Latency and faults (dropped ACKs, dropped or corrupted responses,
+fragmented writes, baud rates the link cannot sustain) can be injected to
+exercise the driver's error handling.
+
+The emulated chip has a baud rate of its own, and garbles everything it
+exchanges with a host whose serial port is set to a different rate.
+
+Run ``python -m pn532.emulator`` to get a pty with a tag coming and going.
+"""
+
+import os
+import pty
+import random
+import select
+import termios
+import threading
+import time
+import tty
+
+from .frame import (FrameDecoder, FRAME_ACK, FRAME_DATA, FRAME_OVERHEAD, ERRORFRAME_TFI,
+                    HOSTTOPN532, PN532TOHOST, PREAMBLE, STARTCODE1, STARTCODE2, POSTAMBLE,
+                    encode_command)
+from .pn532 import (_ACK, _COMMAND_GETFIRMWAREVERSION, _COMMAND_SETSERIALBAUDRATE,
+                    _COMMAND_SAMCONFIGURATION, _COMMAND_POWERDOWN, _COMMAND_RFCONFIGURATION,
+                    _COMMAND_INDATAEXCHANGE, _COMMAND_INCOMMUNICATETHRU,
+                    _COMMAND_INLISTPASSIVETARGET, _COMMAND_INAUTOPOLL,
+                    AUTOPOLL_GENERIC_106KBPS, AUTOPOLL_MIFARE, AUTOPOLL_ISO14443_4A,
+                    AUTOPOLL_PERIOD_UNIT, RF_CONFIG_MAX_RETRIES, RF_RETRY_FOREVER,
+                    MIFARE_CMD_AUTH_A, MIFARE_CMD_AUTH_B, MIFARE_CMD_READ, MIFARE_CMD_WRITE,
+                    MIFARE_ULTRALIGHT_CMD_WRITE, NTAG_CMD_FAST_READ)
+from .uart import BAUD_RATE, BAUD_RATES
+
+# pylint: disable=bad-whitespace
+_STATUS_OK                     = 0x00
+_STATUS_TIMEOUT                = 0x01
+_STATUS_MIFARE_AUTH            = 0x14
+_STATUS_INVAL                  = 0x10
+
+# Application level error frame, a TFI of its own and no command code
+_ERROR_FRAME                   = bytes([PREAMBLE, STARTCODE1, STARTCODE2, 0x01, 0xFF,
+                                        ERRORFRAME_TFI, -ERRORFRAME_TFI & 0xFF, POSTAMBLE])
+
+# InAutoPoll target types that an ISO14443A tag answers to
+_AUTOPOLL_ISO14443A            = (AUTOPOLL_GENERIC_106KBPS, AUTOPOLL_MIFARE,
+                                  AUTOPOLL_ISO14443_4A)
+
+# Time taken by one passive activation attempt without a tag
+_ACTIVATION_ATTEMPT            = 0.005
+# pylint: enable=bad-whitespace
+
+# SetSerialBaudRate codes to baud rates
+_BAUD_RATES = {code: rate for rate, code in BAUD_RATES.items()}
+
+# termios speed constants to baud rates
+_TERMIOS_SPEEDS = {getattr(termios, 'B{}'.format(rate)): rate
+                   for rate in BAUD_RATES if hasattr(termios, 'B{}'.format(rate))}
+
+
+def _sector(block):
+    """MIFARE Classic sector of `block`"""
+    return block // 4 if block < 128 else 32 + (block - 128) // 16
+
+
+class Tag:
+    """A simulated ISO14443A tag. `memory` is the tag's content: 4 byte pages
+    for Ultralight/NTAG tags (SEL_RES 0x00), 16 byte blocks for MIFARE
+    Classic tags. `keys` maps MIFARE Classic sectors to the (key type, key)
+    pairs that authenticate them, sectors not listed accept any key. A
+    failed authentication halts a Classic tag until it is selected again,
+    and its blocks can only be read after authenticating their sector.
+    `fast_read` is False for tags that NAK FAST_READ, like the original
+    MIFARE Ultralight.
+    """
+    def __init__(self, uid, sens_res=b'\x00\x44', sel_res=0x00, memory=None, keys=None,
+                 fast_read=True):
+        self.uid = bytes(uid)
+        self.sens_res = bytes(sens_res)
+        self.sel_res = sel_res
+        self.memory = bytearray(memory if memory is not None else 64)
+        self.keys = keys or {}
+        self.fast_read = fast_read
+        self.authenticated = None
+
+    @property
+    def is_classic(self):
+        """MIFARE Classic tags address memory in 16 byte blocks"""
+        return bool(self.sel_res & 0x08)
+
+    def target_data(self, number):
+        """The target data reported by InListPassiveTarget"""
+        return (bytes([number]) + self.sens_res + bytes([self.sel_res, len(self.uid)])
+                + self.uid)
+
+
+class PN532Emulator:
+    """PN532 protocol emulator serving a pseudo-terminal"""
+
+    def __init__(self, firmware=(0x32, 0x01, 0x06, 0x07), ack_latency=0.0,
+                 response_latency=0.0, drop_ack_rate=0.0, drop_response_rate=0.0,
+                 corrupt_rate=0.0, chunk_size=None, byte_delay=0.0, max_baudrate=None,
+                 seed=None):
+        """Create the emulator.
+        :params firmware: IC, Ver, Rev and Support returned by GetFirmwareVersion
+        :params ack_latency: seconds between receiving a command and the ACK
+        :params response_latency: seconds between the ACK and the response
+        :params drop_ack_rate: probability of not acknowledging a command
+        :params drop_response_rate: probability of not answering a command
+        :params corrupt_rate: probability of flipping a bit in a response
+        :params chunk_size: write frames in chunks of this many bytes
+        :params byte_delay: pause between chunks, to split frames across reads
+        :params max_baudrate: fastest reliable rate, half of the responses are
+                              corrupted above it
+        :params seed: seed for the fault injection random generator
+        """
+        self.firmware = bytes(firmware)
+        self.ack_latency = ack_latency
+        self.response_latency = response_latency
+        self.drop_ack_rate = drop_ack_rate
+        self.drop_response_rate = drop_response_rate
+        self.corrupt_rate = corrupt_rate
+        self.chunk_size = chunk_size
+        self.byte_delay = byte_delay
+        self.max_baudrate = max_baudrate
+        self.baudrate = BAUD_RATE
+        # Rate to switch to once the host acknowledges SetSerialBaudRate
+        self._next_baudrate = None
+        self._random = random.Random(seed)
+
+        self.port = None
+        self._master = None
+        self._slave = None
+        self._wake_r = None
+        self._wake_w = None
+        self._thread = None
+        self._running = False
+        self._lock = threading.Lock()
+        self._tags = []
+        self._decoder = FrameDecoder()
+        # Command waiting for a tag: (command, handler, deadline)
+        self._pending = None
+        self._selected = []
+        self._max_targets = 1
+        # MxRtyPassiveActivation, and when InListPassiveTarget gives up
+        self.activation_retries = RF_RETRY_FOREVER
+        self._list_deadline = None
+        # Last configuration data of each RFConfiguration item
+        self.rf_config = {}
+        self._auto_poll_types = b''
+        self._auto_poll_deadline = None
+
+        # Counters
+        self.commands = {}
+        self.frames_written = 0
+        # In PowerDown, the next bytes from the host only wake the chip up
+        self.powered_down = False
+        self.power_downs = 0
+
+    def start(self):
+        """Open the pseudo-terminal and start answering. Returns the path of
+        the serial port to hand to PN532_UART."""
+        self._master, self._slave = pty.openpty()
+        tty.setraw(self._master)
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+        self._wake_r, self._wake_w = os.pipe()
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="pn532-emulator", daemon=True)
+        self._thread.start()
+        return self.port
+
+    def stop(self):
+        """Stop answering and close the pseudo-terminal"""
+        self._running = False
+        self._wake()
+        if self._thread:
+            self._thread.join(1)
+            self._thread = None
+        for fd in (self._master, self._slave, self._wake_r, self._wake_w):
+            if fd is not None:
+                os.close(fd)
+        self._master = self._slave = self._wake_r = self._wake_w = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def present(self, tag):
+        """Bring a tag into the field"""
+        with self._lock:
+            self._tags.append(tag)
+        self._wake()
+
+    def remove(self, tag=None):
+        """Take a tag, or all tags, out of the field"""
+        with self._lock:
+            if tag is None:
+                self._tags.clear()
+            elif tag in self._tags:
+                self._tags.remove(tag)
+        self._wake()
+
+    @property
+    def tags(self):
+        """Tags currently in the field"""
+        with self._lock:
+            return list(self._tags)
+
+    def _wake(self):
+        if self._wake_w is not None:
+            os.write(self._wake_w, b'\x00')
+
+    def _run(self):
+        """Emulator thread main loop"""
+        while self._running:
+            timeout = None
+            if self._pending and self._pending[2] is not None:
+                timeout = max(self._pending[2] - time.monotonic(), 0)
+            readable, _, _ = select.select([self._master, self._wake_r], [], [], timeout)
+            if self._wake_r in readable:
+                os.read(self._wake_r, 1024)
+            if self._master in readable:
+                try:
+                    data = os.read(self._master, 1024)
+                except OSError:
+                    break
+                # Bytes sent at another rate than ours are noise, except for
+                # the ACK that may race with the host switching rates
+                if self._next_baudrate is None and self._host_baudrate() != self.baudrate:
+                    data = bytes(b ^ 0x5A for b in data)
+                if self.powered_down:
+                    self.powered_down = False
+                    continue
+                self._decoder.feed(data)
+                while True:
+                    frame = self._decoder.next_frame()
+                    if frame is None:
+                        break
+                    self._handle_frame(*frame)
+            self._check_pending()
+
+    def _host_baudrate(self):
+        """Baud rate the host has set on its side of the pty"""
+        try:
+            return _TERMIOS_SPEEDS.get(termios.tcgetattr(self._slave)[5], self.baudrate)
+        except termios.error:
+            return self.baudrate
+
+    def _write(self, frame):
+        """Write a frame to the host, fragmented if configured to"""
+        self.frames_written += 1
+        if self._host_baudrate() != self.baudrate:
+            frame = bytes(b ^ 0x5A for b in frame)
+        if not self.chunk_size:
+            os.write(self._master, frame)
+            return
+        for i in range(0, len(frame), self.chunk_size):
+            os.write(self._master, frame[i:i+self.chunk_size])
+            if self.byte_delay:
+                time.sleep(self.byte_delay)
+
+    def _respond(self, command, data):
+        """Send the response frame for `command`, subject to fault injection"""
+        if self.response_latency:
+            time.sleep(self.response_latency)
+        if self._random.random() < self.drop_response_rate:
+            return
+        frame = bytearray(len(data) + FRAME_OVERHEAD)
+        encode_command(frame, command + 1, data, tfi=PN532TOHOST)
+        # Above max_baudrate the link loses every other frame
+        unstable = self.max_baudrate and self.baudrate > self.max_baudrate
+        if self._random.random() < (0.5 if unstable else self.corrupt_rate):
+            frame[self._random.randrange(5, len(frame) - 1)] ^= 0x01
+        self._write(bytes(frame))
+
+    def _handle_frame(self, kind, data):
+        """Handle a frame from the host"""
+        if kind == FRAME_ACK:
+            # An ACK from the host aborts the command in progress, or
+            # confirms a baud rate change
+            self._pending = None
+            if self._next_baudrate is not None:
+                self.baudrate, self._next_baudrate = self._next_baudrate, None
+            return
+        if kind != FRAME_DATA or len(data) < 2 or data[0] != HOSTTOPN532:
+            self._write(_ERROR_FRAME)
+            return
+        command, params = data[1], data[2:]
+        self.commands[command] = self.commands.get(command, 0) + 1
+        # A new command aborts the one in progress
+        self._pending = None
+        self._next_baudrate = None
+        handler = self._handlers.get(command)
+        if self.ack_latency:
+            time.sleep(self.ack_latency)
+        if handler is None:
+            self._write(_ERROR_FRAME)
+            return
+        if self._random.random() < self.drop_ack_rate:
+            return
+        self._write(_ACK)
+        response = handler(self, command, params)
+        if response is not None:
+            self._respond(command, response)
+
+    def _check_pending(self):
+        """Answer a command that was waiting for a tag, if it can be now"""
+        if not self._pending:
+            return
+        command, handler, deadline = self._pending
+        response = handler(self, command, None)
+        if response is None and deadline is not None and time.monotonic() >= deadline:
+            response = bytes([0x00])    # gave up, no targets found
+        if response is not None:
+            self._pending = None
+            self._respond(command, response)
+
+    def _get_firmware_version(self, command, params):
+        return self.firmware
+
+    def _sam_configuration(self, command, params):
+        return b''
+
+    def _power_down(self, command, params):
+        # Asleep once the response is out
+        self.powered_down = True
+        self.power_downs += 1
+        return bytes([_STATUS_OK])
+
+    def _set_serial_baud_rate(self, command, params):
+        if not params or params[0] not in _BAUD_RATES:
+            return None
+        self._next_baudrate = _BAUD_RATES[params[0]]
+        return b''
+
+    def _rf_configuration(self, command, params):
+        if not params:
+            return None
+        self.rf_config[params[0]] = bytes(params[1:])
+        if params[0] == RF_CONFIG_MAX_RETRIES and len(params) == 4:
+            self.activation_retries = params[3]
+        return b''
+
+    def _in_list_passive_target(self, command, params):
+        if params is not None:
+            self._max_targets = max(1, min(params[0], 2))
+            self._list_deadline = None
+            if self.activation_retries != RF_RETRY_FOREVER:
+                self._list_deadline = (time.monotonic()
+                                       + (self.activation_retries + 1) * _ACTIVATION_ATTEMPT)
+        tags = self.tags[:self._max_targets]
+        if not tags:
+            # Keep trying until a tag shows up or the retries run out
+            self._pending = (command, PN532Emulator._in_list_passive_target, self._list_deadline)
+            return None
+        for tag in tags:
+            tag.authenticated = None
+        self._selected = tags
+        response = bytearray([len(tags)])
+        for number, tag in enumerate(tags, 1):
+            response += tag.target_data(number)
+        return bytes(response)
+
+    def _in_auto_poll(self, command, params):
+        if params is not None:
+            poll_nr, period, types = params[0], params[1], params[2:]
+            self._auto_poll_types = bytes(types)
+            deadline = None
+            if poll_nr != 0xFF:
+                deadline = time.monotonic() + poll_nr * period * AUTOPOLL_PERIOD_UNIT
+            self._auto_poll_deadline = deadline
+        target_type = next((t for t in self._auto_poll_types if t in _AUTOPOLL_ISO14443A), None)
+        tags = self.tags[:2] if target_type is not None else []
+        if not tags:
+            self._pending = (command, PN532Emulator._in_auto_poll, self._auto_poll_deadline)
+            return None
+        self._selected = tags
+        response = bytearray([len(tags)])
+        for number, tag in enumerate(tags, 1):
+            target_data = tag.target_data(number)
+            response += bytes([target_type, len(target_data)]) + target_data
+        return bytes(response)
+
+    def _in_data_exchange(self, command, params):
+        if len(params) < 2:
+            return bytes([_STATUS_INVAL])
+        number, tag_command, args = params[0], params[1], params[2:]
+        if not 1 <= number <= len(self._selected) or self._selected[number - 1] not in self.tags:
+            return bytes([_STATUS_TIMEOUT])
+        tag = self._selected[number - 1]
+        if tag_command in (MIFARE_CMD_AUTH_A, MIFARE_CMD_AUTH_B):
+            block, key = args[0], bytes(args[1:7])
+            sector = _sector(block)
+            expected = tag.keys.get(sector)
+            if expected is not None and expected != (tag_command, key):
+                tag.authenticated = None
+                self._selected = []
+                return bytes([_STATUS_MIFARE_AUTH])
+            tag.authenticated = sector
+            return bytes([_STATUS_OK])
+        if tag_command == MIFARE_CMD_READ:
+            if tag.is_classic and tag.authenticated != _sector(args[0]):
+                tag.authenticated = None
+                self._selected = []
+                return bytes([_STATUS_TIMEOUT])
+            unit = 16 if tag.is_classic else 4
+            start = args[0] * unit
+            data = tag.memory[start:start+16]
+            return bytes([_STATUS_OK]) + bytes(data).ljust(16, b'\x00')
+        if tag_command in (MIFARE_CMD_WRITE, MIFARE_ULTRALIGHT_CMD_WRITE):
+            unit = 16 if tag_command == MIFARE_CMD_WRITE else 4
+            start = args[0] * unit
+            tag.memory[start:start+unit] = bytes(args[1:1+unit])
+            return bytes([_STATUS_OK])
+        return bytes([_STATUS_INVAL])
+
+    def _in_communicate_thru(self, command, params):
+        # Goes to the current target, the first one selected
+        if not self._selected or self._selected[0] not in self.tags:
+            return bytes([_STATUS_TIMEOUT])
+        tag = self._selected[0]
+        if not params:
+            return bytes([_STATUS_INVAL])
+        tag_command, args = params[0], params[1:]
+        if tag_command == MIFARE_CMD_READ and len(args) == 1 and not tag.is_classic:
+            start = args[0] * 4
+            return bytes([_STATUS_OK]) + bytes(tag.memory[start:start+16]).ljust(16, b'\x00')
+        if (tag_command == NTAG_CMD_FAST_READ and len(args) == 2 and tag.fast_read
+                and args[0] <= args[1] < len(tag.memory) // 4):
+            return bytes([_STATUS_OK]) + bytes(tag.memory[args[0]*4:(args[1]+1)*4])
+        # The tag NAKs and halts, the PN532 reports a timeout
+        self._selected = []
+        return bytes([_STATUS_TIMEOUT])
+
+    _handlers = {
+        _COMMAND_GETFIRMWAREVERSION: _get_firmware_version,
+        _COMMAND_SAMCONFIGURATION: _sam_configuration,
+        _COMMAND_POWERDOWN: _power_down,
+        _COMMAND_RFCONFIGURATION: _rf_configuration,
+        _COMMAND_SETSERIALBAUDRATE: _set_serial_baud_rate,
+        _COMMAND_INLISTPASSIVETARGET: _in_list_passive_target,
+        _COMMAND_INAUTOPOLL: _in_auto_poll,
+        _COMMAND_INDATAEXCHANGE: _in_data_exchange,
+        _COMMAND_INCOMMUNICATETHRU: _in_communicate_thru,
+    }
+
+
+def main():
+    """Serve an emulated PN532 with a tag that comes and goes"""
+    import argparse
+    parser = argparse.ArgumentParser(description="PN532 emulator on a pseudo-terminal")
+    parser.add_argument("--uid", default="04112233445566", help="UID of the tag, in hex")
+    parser.add_argument("--present", type=float, default=2.0, help="Seconds the tag stays in the field")
+    parser.add_argument("--absent", type=float, default=5.0, help="Seconds the tag stays away")
+    parser.add_argument("--latency", type=float, default=0.0, help="Response latency in seconds")
+    args = parser.parse_args()
+
+    emulator = PN532Emulator(response_latency=args.latency)
+    print(f"PN532 emulator listening on {emulator.start()}", flush=True)
+    tag = Tag(bytes.fromhex(args.uid))
+    try:
+        while True:
+            time.sleep(args.absent)
+            print("Tag presented", flush=True)
+            emulator.present(tag)
+            time.sleep(args.present)
+            print("Tag removed", flush=True)
+            emulator.remove(tag)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        emulator.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+"""
+Encoding and decoding of PN532 normal information frames.
+
+Frames are laid out as:
+  - Preamble (0x00)
+  - Start code  (0x00, 0xFF)
+  - Length of TFI + data (1 byte)
+  - Length checksum
+  - TFI (0xD4 host to PN532, 0xD5 PN532 to host)
+  - Data (command code and parameters)
+  - Data checksum
+  - Postamble (0x00)
+
+The poll loop sends the same few frames over and over, so constant frames can
+be built once with precompile_command(), and everything else is encoded into a
+buffer that is reused between calls. Responses are checked in place and only
+the bytes the caller needs are copied out.
+"""
+
+import functools
+
+# pylint: disable=bad-whitespace
+PREAMBLE                       = 0x00
+STARTCODE1                     = 0x00
+STARTCODE2                     = 0xFF
+POSTAMBLE                      = 0x00
+
+HOSTTOPN532                    = 0xD4
+PN532TOHOST                    = 0xD5
+
+ERRORFRAME_TFI                 = 0x7F
+
+# Kinds of frames produced by FrameDecoder
+FRAME_ACK                      = 'ack'
+FRAME_NACK                     = 'nack'
+FRAME_ERROR                    = 'error'
+FRAME_DATA                     = 'data'
+
+_START_CODE                    = b'\x00\xFF'
+
+# Preamble, start code, LEN, LCS, TFI, command code, DCS and postamble
+FRAME_OVERHEAD                 = 9
+MAX_FRAME_SIZE                 = 255 + 7
+# pylint: enable=bad-whitespace
+
+
+def encode_command(out, command, params=b'', tfi=HOSTTOPN532):
+    """Encode a host to PN532 frame for `command` with `params` into the
+    bytearray `out` and return a memoryview of the encoded frame. `out` must
+    hold at least len(params) + FRAME_OVERHEAD bytes. Pass PN532TOHOST as
+    `tfi` to encode a response instead.
+    """
+    length = len(params) + 2
+    assert length < 255, 'Data must be array of 1 to 255 bytes.'
+    end = length + 7
+    out[0] = PREAMBLE
+    out[1] = STARTCODE1
+    out[2] = STARTCODE2
+    out[3] = length
+    out[4] = (~length + 1) & 0xFF
+    out[5] = tfi
+    out[6] = command & 0xFF
+    out[7:end-2] = params
+    # TFI, data and DCS add up to 0x00
+    out[end-2] = -(tfi + command + sum(params)) & 0xFF
+    out[end-1] = POSTAMBLE
+    return memoryview(out)[:end]
+
+
+@functools.lru_cache(maxsize=None)
+def precompile_command(command, *params):
+    """Return the complete frame for a command with constant parameters. The
+    result is cached, so the frame is only ever built once.
+    """
+    out = bytearray(len(params) + FRAME_OVERHEAD)
+    encode_command(out, command, bytes(params))
+    return bytes(out)
+
+
+class FrameEncoder:
+    """Encodes command frames into a single reusable buffer. The returned
+    memoryview is only valid until the next call to encode().
+    """
+    def __init__(self, size=MAX_FRAME_SIZE):
+        self._buffer = bytearray(size)
+
+    def encode(self, command, params=b''):
+        """Encode a command frame, see encode_command()"""
+        return encode_command(self._buffer, command, params)
+
+
+def frame_bounds(response):
+    """Locate the frame in `response` and verify its length and data
+    checksums. Returns the (start, end) offsets of the TFI and data bytes, so
+    callers can pick out just the bytes they need without intermediate copies.
+    Raises RuntimeError if the frame is malformed.
+    """
+    size = len(response)
+    # Swallow all the 0x00 values that preceed 0xFF.
+    offset = 0
+    while response[offset] == 0x00:
+        offset += 1
+        if offset >= size:
+            raise RuntimeError('Response frame preamble does not contain 0x00FF!')
+    if response[offset] != 0xFF:
+        raise RuntimeError('Response frame preamble does not contain 0x00FF!')
+    offset += 1
+    if offset + 1 >= size:
+        raise RuntimeError('Response contains no data!')
+    # Check length & length checksum match.
+    frame_len = response[offset]
+    if (frame_len + response[offset+1]) & 0xFF != 0:
+        raise RuntimeError('Response length checksum did not match length!')
+    offset += 2
+    end = offset + frame_len
+    if end >= size:
+        raise RuntimeError('Response frame is truncated!')
+    # Check frame checksum value matches bytes.
+    checksum = sum(response[offset:end+1]) & 0xFF
+    if checksum != 0:
+        raise RuntimeError('Response checksum did not match expected value: ', checksum)
+    return offset, end
+
+
+def decode_frame(response):
+    """Return the TFI and data bytes of the frame in `response`, see
+    frame_bounds().
+    """
+    start, end = frame_bounds(response)
+    return response[start:end]
+
+
+class FrameDecoder:
+    """Incremental decoder for frames coming from the PN532. Bytes are fed in
+    as they arrive, in chunks of any size, and complete frames come out once
+    all of their bytes are in and their checksums have been verified. Garbage
+    and corrupted frames are skipped by searching for the next start code, so
+    the decoder resynchronizes by itself.
+    """
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def __len__(self):
+        """Number of bytes buffered that are not part of a returned frame"""
+        return len(self._buffer)
+
+    @property
+    def in_frame(self):
+        """True if part of a frame has been received, as opposed to nothing or
+        just the postamble of the last frame"""
+        return _START_CODE in self._buffer
+
+    def reset(self):
+        """Drop everything buffered, e.g. before sending a new command"""
+        del self._buffer[:]
+
+    def feed(self, data):
+        """Add received bytes to the decoder"""
+        self._buffer += data
+
+    def next_frame(self):
+        """Return the next complete frame as a (kind, data) tuple, or None if
+        more bytes are needed. `kind` is one of FRAME_ACK, FRAME_NACK,
+        FRAME_ERROR or FRAME_DATA, and `data` holds the TFI and data bytes of
+        data frames (empty for the others).
+        """
+        buffer = self._buffer
+        while True:
+            # The preamble is optional, the start code is what marks a frame.
+            start = buffer.find(_START_CODE)
+            if start < 0:
+                # Keep a trailing 0x00, it may be the first half of a start code.
+                del buffer[:max(len(buffer) - 1, 0)]
+                return None
+            del buffer[:start]
+            if len(buffer) < 4:
+                return None
+            length, lcs = buffer[2], buffer[3]
+            if length == 0x00 and lcs == 0xFF:
+                del buffer[:4]
+                return (FRAME_ACK, b'')
+            if length == 0xFF and lcs == 0x00:
+                del buffer[:4]
+                return (FRAME_NACK, b'')
+            if length == 0xFF and lcs == 0xFF:
+                # Extended information frame
+                if len(buffer) < 7:
+                    return None
+                length = (buffer[4] << 8) | buffer[5]
+                if (buffer[4] + buffer[5] + buffer[6]) & 0xFF != 0:
+                    del buffer[:1]      # not a frame after all, resync
+                    continue
+                offset = 7
+            elif (length + lcs) & 0xFF != 0:
+                del buffer[:1]          # not a frame after all, resync
+                continue
+            else:
+                offset = 4
+            end = offset + length
+            if len(buffer) < end + 1:
+                return None             # wait for the rest of the frame
+            if sum(buffer[offset:end+1]) & 0xFF != 0:
+                del buffer[:1]          # corrupted, resync on the next start code
+                continue
+            data = bytes(buffer[offset:end])
+            del buffer[:end+1]
+            if length == 1 and data[0] == ERRORFRAME_TFI:
+                return (FRAME_ERROR, data)
+            return (FRAME_DATA, data)
@@ -29,23 +29,57 @@ This module will let you communicate with a PN532 RFID/NFC chip
 using I2C on the Raspberry Pi.
 """
 
+import ctypes
+import errno
 import fcntl
 import os
 import time
-from gpiozero import DigitalOutputDevice, DigitalInputDevice
-from .pn532 import PN532, BusyError
+from .pn532 import PN532, BusyError, WAKEUP_I2C, _gpio_input, _gpio_output
 
 # pylint: disable=bad-whitespace
 # PN532 address without R/W bit, i.e. (0x48 >> 1)
 I2C_ADDRESS                    = 0x24
 I2C_CHANNEL                    = 1
 
-# ctypes defines for i2c, see <linux/i2c-dev.h>
-I2C_SLAVE                      = 1795
+# ctypes defines for i2c, see <linux/i2c-dev.h> and <linux/i2c.h>
+I2C_SLAVE                      = 0x0703
+I2C_RDWR                       = 0x0707
+I2C_M_RD                       = 0x0001
+
+_I2C_READY                     = 0x01
+
+# Status polling backs off from the first to the last interval, in seconds
+_POLL_INTERVAL_MIN             = 0.0005
+_POLL_INTERVAL_MAX             = 0.005
+# Oscillator start up time after the PN532 is woken up, in seconds
+_T_OSC_START                   = 0.002
+# Low pulse on H_REQUEST that wakes the PN532, in seconds
+_T_REQ_PULSE                   = 0.001
+# pylint: enable=bad-whitespace
+
+
+class _I2CMsg(ctypes.Structure):
+    """struct i2c_msg"""
+    _fields_ = [
+        ('addr', ctypes.c_uint16),
+        ('flags', ctypes.c_uint16),
+        ('len', ctypes.c_uint16),
+        ('buf', ctypes.POINTER(ctypes.c_uint8)),
+    ]
+
+
+class _I2CRdwrData(ctypes.Structure):
+    """struct i2c_rdwr_ioctl_data"""
+    _fields_ = [
+        ('msgs', ctypes.POINTER(_I2CMsg)),
+        ('nmsgs', ctypes.c_uint32),
+    ]
 
 
 class I2CDevice:
-    """Implements I2C device on ioctl"""
+    """Implements I2C device on ioctl. Every read and write is a single
+    I2C_RDWR transaction, falling back to plain read()/write() on adapters
+    that do not support it."""
     def __init__(self, channel, addr):
         self.addr = addr
         self.i2c = os.open('/dev/i2c-%d' % channel, os.O_RDWR)
@@ -53,22 +87,60 @@ class I2CDevice:
             raise RuntimeError('i2c device does not exist')
         if fcntl.ioctl(self.i2c, I2C_SLAVE, addr) < 0:
             raise RuntimeError('i2c slave does not exist')
+        self._rdwr = True
+        # Reused for every transaction
+        self._msg = _I2CMsg(addr=addr)
+        self._ioctl_data = _I2CRdwrData(msgs=ctypes.pointer(self._msg), nmsgs=1)
+
+    def _transfer(self, flags, buf):
+        """Run a single message I2C_RDWR transaction on `buf`"""
+        self._msg.flags = flags
+        self._msg.len = len(buf)
+        self._msg.buf = (ctypes.c_uint8 * len(buf)).from_buffer(buf)
+        try:
+            fcntl.ioctl(self.i2c, I2C_RDWR, self._ioctl_data)
+        finally:
+            self._msg.buf = None    # release the buffer
 
     def write(self, buf):
-        """Wrapper method of os.write"""
+        """Write `buf` in one transaction"""
+        if self._rdwr:
+            try:
+                self._transfer(0, bytearray(buf))
+                return len(buf)
+            except OSError as err:
+                if err.errno not in (errno.ENOTTY, errno.EOPNOTSUPP, errno.EINVAL):
+                    raise
+                self._rdwr = False
         return os.write(self.i2c, buf)
 
     def read(self, count):
-        """Wrapper method of os.read"""
+        """Read `count` bytes in one transaction"""
+        if self._rdwr:
+            buf = bytearray(count)
+            try:
+                self._transfer(I2C_M_RD, buf)
+                return buf
+            except OSError as err:
+                if err.errno not in (errno.ENOTTY, errno.EOPNOTSUPP, errno.EINVAL):
+                    raise
+                self._rdwr = False
         return os.read(self.i2c, count)
 
+    def close(self):
+        """Close the I2C device"""
+        os.close(self.i2c)
+
 
 class PN532_I2C(PN532):
     """Driver for the PN532 connected over I2C."""
-    def __init__(self, irq=None, reset=None, req=None, debug=False):
-        """Create an instance of the PN532 class using I2C. Note that PN532
-        uses clock stretching. Optional IRQ pin (not used),
-        reset pin and debugging output.
+    _WAKEUP_SOURCE = WAKEUP_I2C
+
+    def __init__(self, irq=None, reset=None, req=None, debug=False,
+                 bus=I2C_CHANNEL, address=I2C_ADDRESS):
+        """Create an instance of the PN532 class using I2C on `bus` at
+        `address`. Note that PN532 uses clock stretching. Optional IRQ pin
+        (not used), reset pin and debugging output.
         """
         self.debug = debug
         self._irq = irq
@@ -78,19 +150,19 @@ class PN532_I2C(PN532):
         # On Raspberry Pi, you must also connect a pin to P32 "H_Request" for hardware
         # wakeup! this means we don't need to do the I2C clock-stretch thing
         self._gpio_init(irq=irq, req=req, reset=reset)
-        self._i2c = I2CDevice(I2C_CHANNEL, I2C_ADDRESS)
+        self._i2c = I2CDevice(bus, address)
         super().__init__(debug=debug, reset=reset)
 
     def _gpio_init(self, reset, irq=None, req=None):
         self._irq = irq
         self._req = req
         if reset:
-            self._reset_pin = DigitalOutputDevice(reset)
+            self._reset_pin = _gpio_output(reset)
             self._reset_pin.on()
         if irq:
-            self._irq_pin = DigitalInputDevice(irq)
+            self._irq_pin = _gpio_input(irq)
         if req:
-            self._req_pin = DigitalOutputDevice(req)
+            self._req_pin = _gpio_output(req)
             self._req_pin.on()
 
     def _reset(self, pin):
@@ -102,51 +174,69 @@ class PN532_I2C(PN532):
         self._reset_pin.on()
         time.sleep(0.1)
 
-    def _wakeup(self): # pylint: disable=no-self-use
-        """Send any special commands/data to wake up PN532"""
+    def _wakeup(self):
+        """Wake up the PN532 with a pulse on H_REQUEST, or else by addressing
+        it, and give it T_osc_start. The first command then waits for it with
+        _wait_ready()."""
         if self._req:
-            self._req_pin.on()
-            time.sleep(0.1)
             self._req_pin.off()
-            time.sleep(0.1)
+            time.sleep(_T_REQ_PULSE)
             self._req_pin.on()
-        time.sleep(0.5)
+        else:
+            try:
+                self._i2c.write(b'\x00')
+            except OSError:
+                pass    # it may not acknowledge the transfer that wakes it
+        time.sleep(_T_OSC_START)
+
+    def _resume(self):
+        """Wake the PN532 up from PowerDown, it wakes up on its address but
+        may not acknowledge that first transfer"""
+        self._powered_down = False
+        try:
+            self._i2c.write(b'\x00')
+        except OSError:
+            pass
+        time.sleep(_T_OSC_START)
 
     def _wait_ready(self, timeout=10):
         """Poll PN532 if status byte is ready, up to `timeout` seconds"""
-        time.sleep(0.01) # required after _wait_ready()
-        status = bytearray(1)
-        timestamp = time.monotonic()
-        while (time.monotonic() - timestamp) < timeout:
+        deadline = time.monotonic() + timeout
+        interval = _POLL_INTERVAL_MIN
+        while True:
             try:
-                status[0] = self._i2c.read(1)[0]
+                if self._i2c.read(1)[0] == _I2C_READY:
+                    return True  # No longer busy
             except OSError:
-                self._wakeup()
-                continue
-            if status == b'\x01':
-                return True  # No longer busy
-            time.sleep(0.005)  # lets ask again soon!
-        # Timed out!
-        return False
+                pass    # the PN532 does not answer while it wakes up
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False    # Timed out!
+            # Ask again soon, backing off while the PN532 is busy for longer
+            time.sleep(min(interval, remaining))
+            interval = min(interval * 2, _POLL_INTERVAL_MAX)
 
     def _read_data(self, count):
         """Read a specified count of bytes from the PN532."""
+        # The status byte and the frame come in the same read
         try:
-            status = self._i2c.read(1)[0]
-            if status != 0x01:             # not ready
-                raise BusyError
-            frame = bytes(self._i2c.read(count+1))
+            frame = self._i2c.read(count+1)
         except OSError as err:
             if self.debug:
                 print(err)
-            return
+            raise BusyError from err
+        if frame[0] != _I2C_READY:    # not ready
+            raise BusyError
 
         if self.debug:
             print("Reading: ", [hex(i) for i in frame[1:]])
-        else:
-            time.sleep(0.1)
-        return frame[1:]   # don't return the status byte
+        return bytes(frame[1:])   # don't return the status byte
 
     def _write_data(self, framebytes):
         """Write a specified count of bytes to the PN532"""
         self._i2c.write(framebytes)
+
+    def close(self):
+        """Release the I2C device and the GPIO pins"""
+        self._i2c.close()
+        super().close()
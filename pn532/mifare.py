@@ -0,0 +1,142 @@
+"""
+Sector level access to MIFARE Classic cards.
+
+MifareClassicReader authenticates once per sector and then reads all of the
+sector's data blocks. The key that opened a sector is remembered per card
+UID in a KeyCache, so later scans of a known card authenticate with a single
+exchange instead of trying the keys one by one:
+
+    reader = MifareClassicReader(pn532, keys=[b'\\xFF' * 6])
+    uid = pn532.read_passive_target()
+    data = reader.read_sector(uid, 1)
+"""
+
+from collections import OrderedDict
+
+from .pn532 import MIFARE_CMD_AUTH_A, MIFARE_CMD_AUTH_B, PN532Error
+
+# Keys commonly found on MIFARE Classic cards, tried in this order
+DEFAULT_KEYS = (
+    b'\xFF\xFF\xFF\xFF\xFF\xFF',   # factory default
+    b'\xA0\xA1\xA2\xA3\xA4\xA5',   # MAD sector key A
+    b'\xD3\xF7\xD3\xF7\xD3\xF7',   # NFC Forum sector key A
+    b'\x00\x00\x00\x00\x00\x00',
+)
+
+
+def sector_first_block(sector):
+    """First block of `sector`, sectors 32 and up (4K cards) have 16 blocks"""
+    return sector * 4 if sector < 32 else 128 + (sector - 32) * 16
+
+
+def sector_block_count(sector):
+    """Number of blocks in `sector`, including the sector trailer"""
+    return 4 if sector < 32 else 16
+
+
+class KeyCache:
+    """Least recently used cache of the (key type, key) that authenticated
+    each sector of a card, keyed by UID and sector.
+    """
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, uid, sector):
+        """The (key type, key) that last opened `sector`, or None"""
+        entry = self._entries.get((bytes(uid), sector))
+        if entry is not None:
+            self._entries.move_to_end((bytes(uid), sector))
+        return entry
+
+    def put(self, uid, sector, key_type, key):
+        """Remember that `key` of `key_type` opened `sector`"""
+        self._entries[(bytes(uid), sector)] = (key_type, bytes(key))
+        self._entries.move_to_end((bytes(uid), sector))
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def discard(self, uid, sector):
+        """Forget the key of `sector`, after it stopped working"""
+        self._entries.pop((bytes(uid), sector), None)
+
+
+class MifareClassicReader:
+    """Read MIFARE Classic cards a sector at a time"""
+
+    def __init__(self, pn532, keys=DEFAULT_KEYS, key_types=(MIFARE_CMD_AUTH_A, MIFARE_CMD_AUTH_B),
+                 cache=None):
+        """`keys` and `key_types` are the candidates tried, in order, on
+        sectors the cache knows nothing about.
+        """
+        self.pn532 = pn532
+        self.keys = [bytes(key) for key in keys]
+        self.key_types = tuple(key_types)
+        self.cache = cache if cache is not None else KeyCache()
+        # Authentication attempts made, successful or not
+        self.attempts = 0
+
+    def _candidates(self, uid, sector):
+        """Keys to try on `sector`: the cached one, then the key that opened
+        the previous sector of this card (cards often use one key
+        throughout), then all others.
+        """
+        seen = set()
+        cached = self.cache.get(uid, sector)
+        previous = self.cache.get(uid, sector - 1) if sector else None
+        for candidate in (cached, previous):
+            if candidate is not None and candidate not in seen:
+                seen.add(candidate)
+                yield candidate
+        for key_type in self.key_types:
+            for key in self.keys:
+                if (key_type, key) not in seen:
+                    yield key_type, key
+
+    def _reselect(self, uid):
+        """Select the card again, a failed authentication halts it"""
+        found = self.pn532.read_passive_target(timeout=0.5)
+        if found is None or bytes(found) != bytes(uid):
+            raise RuntimeError('Card left the field')
+
+    def authenticate(self, uid, sector):
+        """Authenticate `sector`, trying the cached key first. Returns the
+        (key type, key) that worked, or None if no key did.
+        """
+        block = sector_first_block(sector)
+        cached = self.cache.get(uid, sector)
+        for key_type, key in self._candidates(uid, sector):
+            self.attempts += 1
+            try:
+                self.pn532.mifare_classic_authenticate_block(uid, block, key_type, key)
+            except PN532Error:
+                if (key_type, key) == cached:
+                    self.cache.discard(uid, sector)
+                self._reselect(uid)
+                continue
+            self.cache.put(uid, sector, key_type, key)
+            return key_type, key
+        return None
+
+    def read_sector(self, uid, sector, trailer=False):
+        """Authenticate `sector` once and read its data blocks (and the
+        sector trailer with `trailer`). Returns the blocks' bytes, or None if
+        no key opened the sector.
+        """
+        if self.authenticate(uid, sector) is None:
+            return None
+        first = sector_first_block(sector)
+        count = sector_block_count(sector) - (0 if trailer else 1)
+        data = bytearray()
+        for block in range(first, first + count):
+            data += self.pn532.mifare_classic_read_block(block)
+        return bytes(data)
+
+    def read_sectors(self, uid, sectors):
+        """Read several sectors, returns a dict of sector to data (None for
+        sectors no key opened)
+        """
+        return {sector: self.read_sector(uid, sector) for sector in sectors}
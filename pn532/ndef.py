@@ -0,0 +1,244 @@
+"""
+NDEF messages on NFC Forum Type 2 tags (NTAG, MIFARE Ultralight).
+
+The tag's data area holds a sequence of TLV blocks, one of them the NDEF
+message, which in turn is a sequence of records. `read_ntag_message` reads
+only as much of the data area as the message needs, usually in a single
+FAST_READ, and `parse_message` decodes the records:
+
+    message = read_ntag_message(pn532)
+    for record in parse_message(message):
+        print(record.type, record.value)
+"""
+
+from . import pn532 as _pn532
+
+# pylint: disable=bad-whitespace
+_TLV_NULL                      = 0x00
+_TLV_NDEF_MESSAGE              = 0x03
+_TLV_TERMINATOR                = 0xFE
+
+_CC_MAGIC                      = 0xE1
+_CC_PAGE                       = 3
+_DATA_PAGE                     = 4
+# Pages 3 to 15 exist on every Type 2 tag, so the first read can't run past
+# the end of the tag. It covers the capability container and 48 bytes of
+# data, enough for a typical URI record.
+_FIRST_READ_PAGES              = 13
+
+TNF_EMPTY                      = 0x00
+TNF_WELL_KNOWN                 = 0x01
+TNF_MEDIA                      = 0x02
+TNF_ABSOLUTE_URI               = 0x03
+TNF_EXTERNAL                   = 0x04
+TNF_UNKNOWN                    = 0x05
+TNF_UNCHANGED                  = 0x06
+
+_FLAG_MB                       = 0x80
+_FLAG_ME                       = 0x40
+_FLAG_CF                       = 0x20
+_FLAG_SR                       = 0x10
+_FLAG_IL                       = 0x08
+# pylint: enable=bad-whitespace
+
+URI_PREFIXES = {
+    _pn532.NDEF_URIPREFIX_NONE: '',
+    _pn532.NDEF_URIPREFIX_HTTP_WWWDOT: 'http://www.',
+    _pn532.NDEF_URIPREFIX_HTTPS_WWWDOT: 'https://www.',
+    _pn532.NDEF_URIPREFIX_HTTP: 'http://',
+    _pn532.NDEF_URIPREFIX_HTTPS: 'https://',
+    _pn532.NDEF_URIPREFIX_TEL: 'tel:',
+    _pn532.NDEF_URIPREFIX_MAILTO: 'mailto:',
+    _pn532.NDEF_URIPREFIX_FTP_ANONAT: 'ftp://anonymous:anonymous@',
+    _pn532.NDEF_URIPREFIX_FTP_FTPDOT: 'ftp://ftp.',
+    _pn532.NDEF_URIPREFIX_FTPS: 'ftps://',
+    _pn532.NDEF_URIPREFIX_SFTP: 'sftp://',
+    _pn532.NDEF_URIPREFIX_SMB: 'smb://',
+    _pn532.NDEF_URIPREFIX_NFS: 'nfs://',
+    _pn532.NDEF_URIPREFIX_FTP: 'ftp://',
+    _pn532.NDEF_URIPREFIX_DAV: 'dav://',
+    _pn532.NDEF_URIPREFIX_NEWS: 'news:',
+    _pn532.NDEF_URIPREFIX_TELNET: 'telnet://',
+    _pn532.NDEF_URIPREFIX_IMAP: 'imap:',
+    _pn532.NDEF_URIPREFIX_RTSP: 'rtsp://',
+    _pn532.NDEF_URIPREFIX_URN: 'urn:',
+    _pn532.NDEF_URIPREFIX_POP: 'pop:',
+    _pn532.NDEF_URIPREFIX_SIP: 'sip:',
+    _pn532.NDEF_URIPREFIX_SIPS: 'sips:',
+    _pn532.NDEF_URIPREFIX_TFTP: 'tftp:',
+    _pn532.NDEF_URIPREFIX_BTSPP: 'btspp://',
+    _pn532.NDEF_URIPREFIX_BTL2CAP: 'btl2cap://',
+    _pn532.NDEF_URIPREFIX_BTGOEP: 'btgoep://',
+    _pn532.NDEF_URIPREFIX_TCPOBEX: 'tcpobex://',
+    _pn532.NDEF_URIPREFIX_IRDAOBEX: 'irdaobex://',
+    _pn532.NDEF_URIPREFIX_FILE: 'file://',
+    _pn532.NDEF_URIPREFIX_URN_EPC_ID: 'urn:epc:id:',
+    _pn532.NDEF_URIPREFIX_URN_EPC_TAG: 'urn:epc:tag:',
+    _pn532.NDEF_URIPREFIX_URN_EPC_PAT: 'urn:epc:pat:',
+    _pn532.NDEF_URIPREFIX_URN_EPC_RAW: 'urn:epc:raw:',
+    _pn532.NDEF_URIPREFIX_URN_EPC: 'urn:epc:',
+    _pn532.NDEF_URIPREFIX_URN_NFC: 'urn:nfc:',
+}
+
+
+class NdefError(ValueError):
+    """Malformed NDEF data"""
+
+
+class TlvParser:
+    """Incremental parser for the TLV blocks of a Type 2 tag data area.
+    Feed it the data area as it is read: `needed` is the number of bytes it
+    needs at least before it can go on (0 once it is done), and `message`
+    the NDEF message, or None if the tag has none.
+    """
+    def __init__(self):
+        self._buffer = bytearray()
+        self._offset = 0
+        self.needed = 1
+        self.message = None
+
+    @property
+    def done(self):
+        """Whether the NDEF message, or the end of the TLVs, was found"""
+        return self.needed == 0
+
+    def feed(self, data):
+        """Add the next bytes of the data area"""
+        self._buffer += data
+        self._parse()
+
+    def _parse(self):
+        buf = self._buffer
+        while self.needed:
+            offset = self._offset
+            if offset >= len(buf):
+                self.needed = offset + 1 - len(buf)
+                return
+            tag = buf[offset]
+            if tag == _TLV_NULL:
+                self._offset += 1
+                continue
+            if tag == _TLV_TERMINATOR:
+                self.needed = 0
+                return
+            if offset + 2 > len(buf):
+                self.needed = offset + 2 - len(buf)
+                return
+            length, header = buf[offset+1], 2
+            if length == 0xFF:
+                if offset + 4 > len(buf):
+                    self.needed = offset + 4 - len(buf)
+                    return
+                length, header = (buf[offset+2] << 8) | buf[offset+3], 4
+            end = offset + header + length
+            if end > len(buf):
+                self.needed = end - len(buf)
+                return
+            if tag == _TLV_NDEF_MESSAGE:
+                self.message = bytes(buf[offset+header:end])
+                self.needed = 0
+                return
+            self._offset = end
+
+
+class NdefRecord:
+    """A decoded NDEF record"""
+    __slots__ = ('tnf', 'type', 'id', 'payload')
+
+    def __init__(self, tnf, record_type=b'', record_id=b'', payload=b''):
+        self.tnf = tnf
+        self.type = bytes(record_type)
+        self.id = bytes(record_id)
+        self.payload = bytes(payload)
+
+    @property
+    def value(self):
+        """The URI of a URI record or the text of a text record, None for
+        other records
+        """
+        if self.tnf == TNF_WELL_KNOWN and self.type == b'U' and self.payload:
+            prefix = URI_PREFIXES.get(self.payload[0], '')
+            return prefix + self.payload[1:].decode('utf-8', 'replace')
+        if self.tnf == TNF_WELL_KNOWN and self.type == b'T' and self.payload:
+            status = self.payload[0]
+            encoding = 'utf-16' if status & 0x80 else 'utf-8'
+            return self.payload[1 + (status & 0x3F):].decode(encoding, 'replace')
+        if self.tnf == TNF_ABSOLUTE_URI:
+            return self.type.decode('utf-8', 'replace')
+        return None
+
+    def __repr__(self):
+        return 'NdefRecord(tnf={}, type={!r}, id={!r}, payload={!r})'.format(
+            self.tnf, self.type, self.id, self.payload)
+
+
+def parse_message(message):
+    """Decode the records of an NDEF message, yielding NdefRecord objects.
+    Chunked records are joined. Raises NdefError on malformed data.
+    """
+    offset = 0
+    chunked = None
+    while offset < len(message):
+        if offset + 2 > len(message):
+            raise NdefError('Truncated record header')
+        flags = message[offset]
+        type_length = message[offset+1]
+        offset += 2
+        if flags & _FLAG_SR:
+            payload_length = message[offset] if offset < len(message) else 0
+            offset += 1
+        else:
+            payload_length = int.from_bytes(message[offset:offset+4], 'big')
+            offset += 4
+        id_length = 0
+        if flags & _FLAG_IL:
+            id_length = message[offset] if offset < len(message) else 0
+            offset += 1
+        end = offset + type_length + id_length + payload_length
+        if end > len(message):
+            raise NdefError('Truncated record')
+        record_type = message[offset:offset+type_length]
+        offset += type_length
+        record_id = message[offset:offset+id_length]
+        offset += id_length
+        payload = message[offset:end]
+        offset = end
+
+        tnf = flags & 0x07
+        if chunked is not None:
+            if tnf != TNF_UNCHANGED:
+                raise NdefError('Chunk of a different record')
+            chunked.payload += payload
+            if not flags & _FLAG_CF:
+                record, chunked = chunked, None
+                yield record
+        elif flags & _FLAG_CF:
+            chunked = NdefRecord(tnf, record_type, record_id, payload)
+        else:
+            yield NdefRecord(tnf, record_type, record_id, payload)
+        if flags & _FLAG_ME:
+            break
+    if chunked is not None:
+        raise NdefError('Message ends inside a chunked record')
+
+
+def read_ntag_message(pn532):
+    """Read the NDEF message of the NTAG or MIFARE Ultralight selected by
+    `pn532`. Returns the message, or None if the tag is not NDEF formatted
+    or holds no NDEF message. The first read covers the capability
+    container and the start of the data area, further reads only fetch the
+    pages the message still needs.
+    """
+    data = pn532.ntag2xx_read_pages(_CC_PAGE, _FIRST_READ_PAGES)
+    if data[0] != _CC_MAGIC:
+        return None
+    pages = data[2] * 8 // 4
+    area = data[4:4 + pages*4]
+    parser = TlvParser()
+    parser.feed(area)
+    read = len(area) // 4
+    while parser.needed and read < pages:
+        count = min(-(-parser.needed // 4), pages - read)
+        parser.feed(pn532.ntag2xx_read_pages(_DATA_PAGE + read, count))
+        read += count
+    return parser.message
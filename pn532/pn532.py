@@ -32,6 +32,10 @@ This module will let you communicate with a PN532 NFC Hat using I2C, SPI or UART
 The main difference is the interfaces implements.
 """
 
+import time
+
+from .frame import FrameEncoder, FRAME_OVERHEAD, decode_frame, frame_bounds, precompile_command
+
 # pylint: disable=bad-whitespace
 _PREAMBLE                      = 0x00
 _STARTCODE1                    = 0x00
@@ -82,6 +86,36 @@ _WAKEUP                        = 0x55
 
 _MIFARE_ISO14443A              = 0x00
 
+# InAutoPoll target types
+AUTOPOLL_GENERIC_106KBPS       = 0x00
+AUTOPOLL_GENERIC_212KBPS       = 0x01
+AUTOPOLL_GENERIC_424KBPS       = 0x02
+AUTOPOLL_ISO14443_4B           = 0x03
+AUTOPOLL_JEWEL                 = 0x04
+AUTOPOLL_MIFARE                = 0x10
+AUTOPOLL_FELICA_212KBPS        = 0x11
+AUTOPOLL_FELICA_424KBPS        = 0x12
+AUTOPOLL_ISO14443_4A           = 0x20
+AUTOPOLL_ISO14443_4B_106KBPS   = 0x23
+AUTOPOLL_PERIOD_UNIT           = 0.15    # seconds per Period step
+
+# RFConfiguration items
+RF_CONFIG_FIELD                = 0x01
+RF_CONFIG_TIMINGS              = 0x02
+RF_CONFIG_MAX_RTY_COM          = 0x04
+RF_CONFIG_MAX_RETRIES          = 0x05
+RF_RETRY_FOREVER               = 0xFF    # MxRty value to retry until it works
+RF_TIMEOUT_UNIT                = 0.0001  # seconds, RF timeout n is 100us * 2**(n-1)
+
+# PowerDown wake up sources
+WAKEUP_INT0                    = 0x01
+WAKEUP_INT1                    = 0x02
+WAKEUP_RF                      = 0x08    # external RF field, not passive tags
+WAKEUP_HSU                     = 0x10
+WAKEUP_SPI                     = 0x20
+WAKEUP_GPIO                    = 0x40
+WAKEUP_I2C                     = 0x80
+
 # Mifare Commands
 MIFARE_CMD_AUTH_A                   = 0x60
 MIFARE_CMD_AUTH_B                   = 0x61
@@ -92,6 +126,11 @@ MIFARE_CMD_DECREMENT                = 0xC0
 MIFARE_CMD_INCREMENT                = 0xC1
 MIFARE_CMD_STORE                    = 0xC2
 MIFARE_ULTRALIGHT_CMD_WRITE         = 0xA2
+NTAG_CMD_FAST_READ                  = 0x3A
+
+# Most pages one FAST_READ can return through InCommunicateThru, so that the
+# response (status byte and 4 bytes per page) fits in a normal information frame
+NTAG_FAST_READ_MAX_PAGES            = 60
 
 # Prefixes for NDEF Records (to identify record type)
 NDEF_URIPREFIX_NONE                 = 0x00
@@ -135,6 +174,9 @@ _GPIO_VALIDATIONBIT            = 0x80
 
 _ACK                           = b'\x00\x00\xFF\x00\xFF\x00'
 _FRAME_START                   = b'\x00\x00\xFF'
+
+# A PN532 that is already awake answers GetFirmwareVersion within a few ms
+WARM_START_TIMEOUT             = 0.05
 # pylint: enable=bad-whitespace
 
 PN532_ERRORS = {
@@ -168,6 +210,44 @@ PN532_ERRORS = {
     0x2e: 'PN532 ERROR NONAD',
 }
 
+def _gpio_output(pin):
+    """gpiozero output device on `pin`. gpiozero is imported on first use,
+    so setups without reset, IRQ or chip select pins don't load it."""
+    from gpiozero import DigitalOutputDevice  # pylint: disable=import-outside-toplevel
+    return DigitalOutputDevice(pin)
+
+def _gpio_input(pin):
+    """gpiozero input device on `pin`, see _gpio_output()"""
+    from gpiozero import DigitalInputDevice  # pylint: disable=import-outside-toplevel
+    return DigitalInputDevice(pin)
+
+def rf_timeout(seconds):
+    """RF timeout setting n of RFConfiguration, the shortest one of
+    100us * 2**(n-1) lasting at least `seconds`, 0 for no timeout."""
+    if not seconds:
+        return 0x00
+    n = 1
+    while n < 0x10 and RF_TIMEOUT_UNIT * 2 ** (n - 1) < seconds:
+        n += 1
+    return n
+
+def _parse_targets(response):
+    """(uid, sens_res, sel_res) of each card in an InListPassiveTarget response"""
+    targets = []
+    offset = 1
+    for _ in range(response[0]):
+        # Tg, SENS_RES (2), SEL_RES, NFCID length, NFCID, [ATS]
+        sens_res = bytes(response[offset+1:offset+3])
+        sel_res = response[offset+3]
+        uid_length = response[offset+4]
+        uid = bytes(response[offset+5:offset+5+uid_length])
+        offset += 5 + uid_length
+        if sel_res & 0x20:
+            # ISO14443-4 compliant card, skip the ATS (its length byte counts itself)
+            offset += response[offset]
+        targets.append((uid, sens_res, sel_res))
+    return targets
+
 class PN532Error(Exception):
     """PN532 error code"""
     def __init__(self, err):
@@ -179,26 +259,137 @@ class BusyError(Exception):
     """Base class for exceptions in this module."""
     pass
 
+# pylint: disable=bad-whitespace
+# Outcomes of a command, as reported to command hooks
+OUTCOME_OK                     = 'ok'
+OUTCOME_NO_ACK                 = 'no_ack'       # the PN532 did not acknowledge the command
+OUTCOME_TIMEOUT                = 'timeout'      # no ACK or response within the timeout
+OUTCOME_BUSY                   = 'busy'         # incomplete response (BusyError)
+OUTCOME_PN532_ERROR            = 'pn532_error'  # the PN532 answered with an error status
+OUTCOME_ERROR                  = 'error'        # malformed response or I/O error
+# pylint: enable=bad-whitespace
+
+# InListPassiveTarget frames for 1 and 2 MiFare cards, indexed by the number
+# of cards. Built once here, so polling never encodes a frame.
+_INLIST_MIFARE_FRAMES = (None,
+                         precompile_command(_COMMAND_INLISTPASSIVETARGET, 1, _MIFARE_ISO14443A),
+                         precompile_command(_COMMAND_INLISTPASSIVETARGET, 2, _MIFARE_ISO14443A))
+
+# Commands whose response starts with a status byte, see PN532_ERRORS
+_STATUS_COMMANDS = (_COMMAND_POWERDOWN, _COMMAND_INDATAEXCHANGE, _COMMAND_INCOMMUNICATETHRU)
+
+class CommandTiming:
+    """Timing of a single command, passed to the hooks registered with
+    PN532.add_hook(). Times are in seconds:
+      - write: sending the command frame
+      - ack_wait: waiting for and reading the ACK
+      - response_wait: waiting for and reading the response
+    `bytes_written` and `bytes_read` count the frame bytes (ACK included) on
+    the wire. `outcome` is one of the OUTCOME_* values, `error` holds the
+    PN532 error code for OUTCOME_PN532_ERROR and the exception otherwise.
+    """
+    __slots__ = ('command', 'write', 'ack_wait', 'response_wait',
+                 'bytes_written', 'bytes_read', 'outcome', 'error')
+
+    def __init__(self, command):
+        self.command = command
+        self.write = 0.0
+        self.ack_wait = 0.0
+        self.response_wait = 0.0
+        self.bytes_written = 0
+        self.bytes_read = 0
+        self.outcome = OUTCOME_OK
+        self.error = None
+
+    @property
+    def total(self):
+        """Total time spent on the command"""
+        return self.write + self.ack_wait + self.response_wait
+
+    @property
+    def acknowledged(self):
+        """Whether the PN532 acknowledged the command. A PN532 that stops
+        doing so is wedged or gone, rather than waiting for a card."""
+        return self.bytes_read > 0
+
+    def __repr__(self):
+        return ('CommandTiming(command=0x{:02X}, outcome={}, write={:.6f}, ack_wait={:.6f}, '
+                'response_wait={:.6f}, bytes_written={}, bytes_read={})').format(
+                    self.command, self.outcome, self.write, self.ack_wait,
+                    self.response_wait, self.bytes_written, self.bytes_read)
+
 
 class PN532:
     """PN532 driver base, must be extended for I2C/SPI/UART interfacing"""
 
+    # Command hooks, see add_hook()
+    _hooks = ()
+    # Commands the PN532 never acknowledged (no ACK within the timeout, or
+    # the frame could not be written). A PN532 that stops acknowledging is
+    # wedged or gone, rather than waiting for a card.
+    missed_acks = 0
+    # Interface the PN532 wakes up on from PowerDown, see power_down()
+    _WAKEUP_SOURCE = 0
+    _powered_down = False
+    # (CommandTiming, time acknowledged) of the pending InListPassiveTarget,
+    # see listen_for_passive_targets()
+    _listen = None
+
     def __init__(self, *, debug=False, reset=None):
-        """Create an instance of the PN532 class
+        """Create an instance of the PN532 class. A PN532 that already
+        answers a firmware probe (warm start, e.g. after a restart of the
+        host program) is neither reset nor woken up. The firmware version is
+        kept in `firmware_version`, and the time taken by each step of the
+        start up in `startup_timings`.
         """
         self.debug = debug
+        self._encoder = FrameEncoder()
+        self.firmware_version = None
+        self.startup_timings = []
+
+        if self._timed('probe', self._warm_start):
+            if debug:
+                print("Warm start")
+            self._timed('sam', self.SAM_configuration)
+            return
         if reset:
             if debug:
                 print("Resetting")
-            self._reset(reset)
-
+            self._timed('reset', self._reset, reset)
+        self._timed('wakeup', self._wakeup)
+        # SAMConfiguration must be the first command after a wakeup
         try:
-            self._wakeup()
-            self.get_firmware_version() # first time often fails, try 2ce
-            return
+            self._timed('sam', self.SAM_configuration)
+            self._timed('firmware', self._read_firmware_version)
         except (BusyError, RuntimeError):
-            pass
-        self.get_firmware_version()
+            # first time often fails, try 2ce
+            self._timed('sam', self.SAM_configuration)
+            self._timed('firmware', self._read_firmware_version)
+
+    def _timed(self, step, function, *args):
+        """Run a start up step, recording how long it took"""
+        start = time.monotonic()
+        try:
+            return function(*args)
+        finally:
+            self.startup_timings.append((step, time.monotonic() - start))
+
+    def _warm_start(self):
+        """Probe for a PN532 that is already awake. Returns True, with the
+        firmware version read, if it answered.
+        """
+        try:
+            response = self.call_function(_COMMAND_GETFIRMWAREVERSION, 4,
+                                          timeout=WARM_START_TIMEOUT)
+        except (BusyError, RuntimeError, PN532Error, OSError):
+            return False
+        if response is None:
+            return False
+        self.firmware_version = tuple(response)
+        return True
+
+    def _read_firmware_version(self):
+        self.firmware_version = self.get_firmware_version()
 
     def _gpio_init(self, **kwargs):
         # Hardware GPIO init
@@ -227,33 +418,24 @@ class PN532:
         # Send special command to wake up
         raise NotImplementedError
 
+    def close(self):
+        """Release the GPIO pins, subclasses also close their device"""
+        for name in ('_reset_pin', '_irq_pin', '_req_pin'):
+            pin = getattr(self, name, None)
+            if pin is not None:
+                pin.close()
+
     def _write_frame(self, data):
         """Write a frame to the PN532 with the specified data bytearray."""
         assert data is not None and 1 < len(data) < 255, 'Data must be array of 1 to 255 bytes.'
-        # Build frame to send as:
-        # - Preamble (0x00)
-        # - Start code  (0x00, 0xFF)
-        # - Command length (1 byte)
-        # - Command length checksum
-        # - Command bytes
-        # - Checksum
-        # - Postamble (0x00)
-        length = len(data)
-        frame = bytearray(length+7)
-        frame[0] = _PREAMBLE
-        frame[1] = _STARTCODE1
-        frame[2] = _STARTCODE2
-        checksum = sum(frame[0:3])
-        frame[3] = length & 0xFF
-        frame[4] = (~length + 1) & 0xFF
-        frame[5:-2] = data
-        checksum += sum(data)
-        frame[-2] = ~checksum & 0xFF
-        frame[-1] = _POSTAMBLE
-        # Send frame.
+        assert data[0] == _HOSTTOPN532, 'Data must start with the host to PN532 TFI.'
+        self._send_frame(self._encoder.encode(data[1], data[2:]))
+
+    def _send_frame(self, frame):
+        """Write an already encoded frame to the PN532."""
         if self.debug:
             print('Write frame: ', [hex(i) for i in frame])
-        self._write_data(bytes(frame))
+        self._write_data(frame)
 
     def _read_frame(self, length):
         """Read a response frame from the PN532 of at most length bytes in size.
@@ -265,28 +447,18 @@ class PN532:
         response = self._read_data(length+7)
         if self.debug:
             print('Read frame:', [hex(i) for i in response])
+        return decode_frame(response)
 
-        # Swallow all the 0x00 values that preceed 0xFF.
-        offset = 0
-        while response[offset] == 0x00:
-            offset += 1
-            if offset >= len(response):
-                raise RuntimeError('Response frame preamble does not contain 0x00FF!')
-        if response[offset] != 0xFF:
-            raise RuntimeError('Response frame preamble does not contain 0x00FF!')
-        offset += 1
-        if offset >= len(response):
-            raise RuntimeError('Response contains no data!')
-        # Check length & length checksum match.
-        frame_len = response[offset]
-        if (frame_len + response[offset+1]) & 0xFF != 0:
-            raise RuntimeError('Response length checksum did not match length!')
-        # Check frame checksum value matches bytes.
-        checksum = sum(response[offset+2:offset+2+frame_len+1]) & 0xFF
-        if checksum != 0:
-            raise RuntimeError('Response checksum did not match expected value: ', checksum)
-        # Return frame data.
-        return response[offset+2:offset+2+frame_len]
+    def add_hook(self, hook):
+        """Register `hook` to be called with a CommandTiming after every
+        command sent with call_function() or call_frame(). Hooks run on the
+        thread that sent the command, and exceptions they raise are ignored.
+        """
+        self._hooks = tuple(self._hooks) + (hook,)
+
+    def remove_hook(self, hook):
+        """Unregister a hook registered with add_hook()"""
+        self._hooks = tuple(h for h in self._hooks if h is not hook)
 
     def call_function(self, command, response_length=0, params=None, timeout=1):
         """Send specified command to the PN532 and expect up to response_length
@@ -297,33 +469,113 @@ class PN532:
         response is available within the timeout.
         """
         # Build frame data with command and parameters.
-        if params is None:
-            params = []
-        data = bytearray(2+len(params))
-        data[0] = _HOSTTOPN532
-        data[1] = command & 0xFF
-        for i, val in enumerate(params):
-            data[2+i] = val
+        frame = self._encoder.encode(command, b'' if params is None else params)
+        return self.call_frame(command, frame, response_length, timeout)
+
+    def call_frame(self, command, frame, response_length=0, timeout=1):
+        """Same as call_function, but send an already encoded command frame,
+        like one built once with precompile_command().
+        """
+        if self._powered_down:
+            self._resume()
+        if self._listen is not None:
+            self.cancel_listen()
+        if self._hooks:
+            return self._call_frame_timed(command, frame, response_length, timeout)
         # Send frame and wait for response.
         try:
-            self._write_frame(data)
+            self._send_frame(frame)
         except OSError:
+            self.missed_acks += 1
             self._wakeup()
             return None
         if not self._wait_ready(timeout):
+            self.missed_acks += 1
             return None
         # Verify ACK response and wait to be ready for function response.
-        if not _ACK == self._read_data(len(_ACK)):
+        if not self._read_ack():
             raise RuntimeError('Did not receive expected ACK from PN532!')
         if not self._wait_ready(timeout):
             return None
         # Read response bytes.
-        response = self._read_frame(response_length+2)
+        return self._read_response(command, response_length)
+
+    def _call_frame_timed(self, command, frame, response_length, timeout):
+        """call_frame() measuring each step for the command hooks"""
+        timing = CommandTiming(command)
+        clock = time.perf_counter
+        start = clock()
+        try:
+            try:
+                self._send_frame(frame)
+            except OSError as err:
+                timing.write = clock() - start
+                timing.outcome, timing.error = OUTCOME_ERROR, err
+                self.missed_acks += 1
+                self._wakeup()
+                return None
+            timing.bytes_written = len(frame)
+            sent = clock()
+            timing.write = sent - start
+            if not self._wait_ready(timeout):
+                timing.ack_wait = clock() - sent
+                timing.outcome = OUTCOME_TIMEOUT
+                self.missed_acks += 1
+                return None
+            if not self._read_ack():
+                timing.ack_wait = clock() - sent
+                timing.outcome = OUTCOME_NO_ACK
+                raise RuntimeError('Did not receive expected ACK from PN532!')
+            acked = clock()
+            timing.ack_wait = acked - sent
+            timing.bytes_read = len(_ACK)
+            if not self._wait_ready(timeout):
+                timing.response_wait = clock() - acked
+                timing.outcome = OUTCOME_TIMEOUT
+                return None
+            try:
+                response = self._read_response(command, response_length)
+            except BusyError as err:
+                timing.outcome, timing.error = OUTCOME_BUSY, err
+                raise
+            except Exception as err:
+                timing.outcome, timing.error = OUTCOME_ERROR, err
+                raise
+            finally:
+                timing.response_wait = clock() - acked
+            timing.bytes_read += len(response) + FRAME_OVERHEAD
+            if command in _STATUS_COMMANDS and response and response[0] & 0x3F:
+                timing.outcome, timing.error = OUTCOME_PN532_ERROR, response[0] & 0x3F
+            return response
+        finally:
+            self._run_hooks(timing)
+
+    def _run_hooks(self, timing):
+        """Pass the timing of a finished command to the command hooks"""
+        for hook in self._hooks:
+            try:
+                hook(timing)
+            except Exception as err:  # pylint: disable=broad-except
+                if self.debug:
+                    print('Command hook failed: ', err)
+
+    def _read_ack(self):
+        """Read the ACK frame, returns True if it was received."""
+        return _ACK == self._read_data(len(_ACK))
+
+    def _read_response(self, command, response_length):
+        """Read the response frame for `command` with up to response_length
+        bytes of data and return the data.
+        """
+        response = self._read_data(response_length+2+7)
+        if self.debug:
+            print('Read frame:', [hex(i) for i in response])
+        start, end = frame_bounds(response)
         # Check that response is for the called function.
-        if not (response[0] == _PN532TOHOST and response[1] == (command+1)):
+        if not (response[start] == _PN532TOHOST and response[start+1] == (command+1)):
             raise RuntimeError('Received unexpected command response!')
-        # Return response data.
-        return response[2:]
+        # Return response data, copied out of the read buffer only once.
+        return response[start+2:end]
 
     def get_firmware_version(self):
         """Call PN532 GetFirmwareVersion function and return a tuple with the IC,
@@ -344,6 +596,63 @@ class PN532:
         # check the command was executed as expected.
         self.call_function(_COMMAND_SAMCONFIGURATION, params=[0x01, 0x14, 0x01])
 
+    def power_down(self, wakeup_enable=None):
+        """Put the PN532 into PowerDown mode, where it draws a few uA with
+        the RF field off. It wakes up on the sources in `wakeup_enable` (the
+        WAKEUP_* flags, by default the host interface in use), and the next
+        command wakes it up automatically. Note that WAKEUP_RF only reacts to
+        an external RF field, like a phone, passive tags can't wake it up.
+        """
+        if wakeup_enable is None:
+            wakeup_enable = self._WAKEUP_SOURCE
+        response = self.call_function(_COMMAND_POWERDOWN, params=[wakeup_enable],
+                                      response_length=1)
+        if response is None:
+            raise BusyError('No response to PowerDown')
+        if response[0] & 0x3F:
+            raise PN532Error(response[0] & 0x3F)
+        self._powered_down = True
+
+    def _resume(self):
+        """Wake the PN532 up from PowerDown before the next command"""
+        self._powered_down = False
+        self._wakeup()
+
+    def rf_configuration(self, cfg_item, data, timeout=1):
+        """Call PN532 RFConfiguration for `cfg_item` (one of the RF_CONFIG_*
+        items) with its configuration data.
+        """
+        params = bytearray([cfg_item])
+        params.extend(data)
+        response = self.call_function(_COMMAND_RFCONFIGURATION, params=params, timeout=timeout)
+        if response is None:
+            raise BusyError('No response to RFConfiguration')
+
+    def set_rf_field(self, on=True, auto_rfca=False):
+        """Switch the RF field on or off, with or without RF collision
+        avoidance (for peer to peer) when it is switched on.
+        """
+        self.rf_configuration(RF_CONFIG_FIELD, [(0x02 if auto_rfca else 0) | (0x01 if on else 0)])
+
+    def set_rf_timings(self, atr_res_timeout=0.1024, retry_timeout=0.0512):
+        """Set how long the PN532 waits for an ATR_RES, and for a target's
+        answer before retrying (the InCommunicateThru timeout), in seconds.
+        They are rounded up to the nearest 100us * 2**(n-1) step the chip
+        supports, the defaults are the chip's own.
+        """
+        self.rf_configuration(RF_CONFIG_TIMINGS, [0x00, rf_timeout(atr_res_timeout),
+                                                  rf_timeout(retry_timeout)])
+
+    def set_max_retries(self, passive_activation=RF_RETRY_FOREVER, atr=RF_RETRY_FOREVER, psl=0x01):
+        """Set how many times the PN532 retries activating a passive target
+        (InListPassiveTarget), sending ATR_REQ and PSL_REQ. RF_RETRY_FOREVER
+        retries until it works. The defaults are the chip's own: the chip
+        keeps looking for a card until one shows up, and with a lower
+        `passive_activation` InListPassiveTarget answers that there is no
+        card after that many retries.
+        """
+        self.rf_configuration(RF_CONFIG_MAX_RETRIES, [atr, psl, passive_activation])
+
     def read_passive_target(self, card_baud=_MIFARE_ISO14443A, timeout=1):
         """Wait for a MiFare card to be available and return its UID when found.
         Will wait up to timeout seconds and return None if no card is found,
@@ -351,15 +660,21 @@ class PN532:
         """
         # Send passive read command for 1 card.  Expect at most a 7 byte UUID.
         try:
-            response = self.call_function(_COMMAND_INLISTPASSIVETARGET,
-                                          params=[0x01, card_baud],
-                                          response_length=19,
-                                          timeout=timeout)
+            if card_baud == _MIFARE_ISO14443A:
+                frame = _INLIST_MIFARE_FRAMES[1]
+            else:
+                frame = precompile_command(_COMMAND_INLISTPASSIVETARGET, 0x01, card_baud)
+            response = self.call_frame(_COMMAND_INLISTPASSIVETARGET, frame,
+                                       response_length=19,
+                                       timeout=timeout)
         except BusyError:
             return None # no card found!
         # If no response is available return None to indicate no card is present.
         if response is None:
             return None
+        # The chip ran out of activation retries, see set_max_retries().
+        if response[0] == 0x00:
+            return None
         # Check only 1 card with up to a 7 byte UID is present.
         if response[0] != 0x01:
             raise RuntimeError('More than one card detected!')
@@ -368,6 +683,160 @@ class PN532:
         # Return UID of card.
         return response[6:6+response[5]]
 
+    def read_passive_targets(self, card_baud=_MIFARE_ISO14443A, max_targets=2, timeout=1):
+        """Wait for up to `max_targets` (1 or 2) MiFare cards and list them all
+        with a single InListPassiveTarget exchange. Will wait up to timeout
+        seconds and return an empty list if no card is found, otherwise a list
+        of (uid, sens_res, sel_res) tuples, one per card found.
+        """
+        assert 1 <= max_targets <= 2, 'The PN532 can list at most 2 targets at once.'
+        try:
+            if card_baud == _MIFARE_ISO14443A:
+                frame = _INLIST_MIFARE_FRAMES[max_targets]
+            else:
+                frame = precompile_command(_COMMAND_INLISTPASSIVETARGET, max_targets, card_baud)
+            response = self.call_frame(_COMMAND_INLISTPASSIVETARGET, frame,
+                                       response_length=96,
+                                       timeout=timeout)
+        except BusyError:
+            return [] # no card found!
+        if response is None:
+            return []
+        return _parse_targets(response)
+
+    def listen_for_passive_targets(self, card_baud=_MIFARE_ISO14443A, max_targets=2, timeout=1):
+        """Send InListPassiveTarget for up to `max_targets` (1 or 2) MiFare
+        cards without waiting for a card. The PN532 keeps trying to activate
+        one, as often as set with set_max_retries(), and answers once it
+        finds one: collect the answer with get_passive_targets(). Any other
+        command aborts the listen.
+        Returns True once the PN532 acknowledged the command, or False if it
+        did not answer within timeout seconds.
+        """
+        assert 1 <= max_targets <= 2, 'The PN532 can list at most 2 targets at once.'
+        if self._powered_down:
+            self._resume()
+        if self._listen is not None:
+            self.cancel_listen()
+        if card_baud == _MIFARE_ISO14443A:
+            frame = _INLIST_MIFARE_FRAMES[max_targets]
+        else:
+            frame = precompile_command(_COMMAND_INLISTPASSIVETARGET, max_targets, card_baud)
+        timing = CommandTiming(_COMMAND_INLISTPASSIVETARGET)
+        clock = time.perf_counter
+        start = clock()
+        try:
+            self._send_frame(frame)
+        except OSError as err:
+            timing.write = clock() - start
+            timing.outcome, timing.error = OUTCOME_ERROR, err
+            self.missed_acks += 1
+            self._wakeup()
+            self._run_hooks(timing)
+            return False
+        timing.bytes_written = len(frame)
+        sent = clock()
+        timing.write = sent - start
+        if not self._wait_ready(timeout):
+            timing.ack_wait = clock() - sent
+            timing.outcome = OUTCOME_TIMEOUT
+            self.missed_acks += 1
+            self._run_hooks(timing)
+            return False
+        if not self._read_ack():
+            timing.ack_wait = clock() - sent
+            timing.outcome = OUTCOME_NO_ACK
+            self._run_hooks(timing)
+            raise RuntimeError('Did not receive expected ACK from PN532!')
+        acked = clock()
+        timing.ack_wait = acked - sent
+        timing.bytes_read = len(_ACK)
+        self._listen = (timing, acked)
+        return True
+
+    @property
+    def listening(self):
+        """Whether an InListPassiveTarget sent by listen_for_passive_targets()
+        is still waiting for a card"""
+        return self._listen is not None
+
+    def get_passive_targets(self, timeout=1):
+        """Wait up to timeout seconds for the answer to the pending
+        listen_for_passive_targets(). Returns None if no card showed up in
+        that time, and the PN532 keeps listening. Otherwise the listen is
+        over and a list of (uid, sens_res, sel_res) tuples is returned, which
+        is empty if the chip ran out of activation retries.
+        """
+        if self._listen is None:
+            raise RuntimeError('Not listening for passive targets!')
+        if not self._wait_ready(timeout):
+            return None
+        timing, acked = self._listen
+        self._listen = None
+        try:
+            response = self._read_response(_COMMAND_INLISTPASSIVETARGET, 96)
+        except BusyError as err:
+            timing.outcome, timing.error = OUTCOME_BUSY, err
+            return []
+        except Exception as err:
+            timing.outcome, timing.error = OUTCOME_ERROR, err
+            raise
+        finally:
+            timing.response_wait = time.perf_counter() - acked
+            self._run_hooks(timing)
+        timing.bytes_read += len(response) + FRAME_OVERHEAD
+        return _parse_targets(response)
+
+    def cancel_listen(self):
+        """Abort the pending listen_for_passive_targets(), if any"""
+        if self._listen is None:
+            return
+        timing, acked = self._listen
+        self._listen = None
+        # An ACK frame aborts the command in progress
+        self._write_data(_ACK)
+        timing.response_wait = time.perf_counter() - acked
+        timing.outcome = OUTCOME_TIMEOUT
+        self._run_hooks(timing)
+
+    def auto_poll(self, poll_nr=0xFF, period=1, types=(AUTOPOLL_MIFARE,), timeout=None):
+        """Let the PN532 poll for targets on its own with InAutoPoll. The chip
+        polls each of `types` in turn, waits `period` * 150ms and repeats,
+        `poll_nr` times (0xFF means forever). The host is only woken up when a
+        target is found or the polling rounds are exhausted.
+        Returns a list of (target type, target data) tuples, which is empty if
+        the chip gave up without finding anything. If no response arrives
+        within `timeout` seconds the command is aborted and None is returned.
+        """
+        assert 1 <= len(types) <= 15, 'Between 1 and 15 target types must be given.'
+        assert 0x01 <= period <= 0x0F, 'Period must be between 1 and 15.'
+        if timeout is None:
+            if poll_nr == 0xFF:
+                raise ValueError('A timeout is required when polling forever!')
+            # Leave a little headroom on top of the chip's own polling window.
+            timeout = poll_nr * period * AUTOPOLL_PERIOD_UNIT + 0.5
+        params = bytearray([poll_nr & 0xFF, period & 0x0F])
+        params.extend(types)
+        try:
+            response = self.call_function(_COMMAND_INAUTOPOLL,
+                                          params=params,
+                                          response_length=64,
+                                          timeout=timeout)
+        except BusyError:
+            response = None
+        if response is None:
+            # Still polling, send an ACK frame to abort the command.
+            self._write_data(_ACK)
+            return None
+        targets = []
+        offset = 1
+        for _ in range(response[0]):
+            target_type = response[offset]
+            length = response[offset+1]
+            targets.append((target_type, bytes(response[offset+2:offset+2+length])))
+            offset += 2 + length
+        return targets
+
     def mifare_classic_authenticate_block(self, uid, block_number, key_number, key):   # pylint: disable=invalid-name
         """Authenticate specified block number for a MiFare classic card.  Uid
         should be a byte array with the UID of the card, block number should be
@@ -460,6 +929,59 @@ class PN532:
         """
         return self.mifare_classic_read_block(block_number)[0:4] # only 4 bytes per page
 
+    def in_communicate_thru(self, data, response_length=0, timeout=1):
+        """Send raw `data` to the selected target with InCommunicateThru and
+        return its answer (the PN532 takes care of the CRC). Raises PN532Error
+        if the target did not answer properly, and BusyError if the PN532
+        did not respond in time.
+        """
+        response = self.call_function(_COMMAND_INCOMMUNICATETHRU,
+                                      params=data,
+                                      response_length=response_length+1,
+                                      timeout=timeout)
+        if response is None:
+            raise BusyError('No response to InCommunicateThru')
+        if response[0] & 0x3F:
+            raise PN532Error(response[0] & 0x3F)
+        return response[1:]
+
+    def ntag2xx_fast_read(self, start_page, end_page):
+        """Read pages `start_page` to `end_page` (inclusive) of an NTAG with a
+        single FAST_READ, see NTAG_FAST_READ_MAX_PAGES.
+        """
+        count = end_page - start_page + 1
+        assert 1 <= count <= NTAG_FAST_READ_MAX_PAGES, 'Too many pages for one FAST_READ!'
+        return self.in_communicate_thru(
+            bytes([NTAG_CMD_FAST_READ, start_page & 0xFF, end_page & 0xFF]),
+            response_length=4*count)
+
+    def ntag2xx_read_pages(self, start_page, count):
+        """Read `count` pages from an NTAG or MIFARE Ultralight, starting at
+        `start_page`, in as few exchanges as possible. Uses FAST_READ, and
+        falls back to READ (4 pages per exchange) on tags that do not
+        support it. Returns 4*count bytes.
+        """
+        data = bytearray()
+        page = start_page
+        end = start_page + count
+        fast = True
+        while page < end:
+            if fast:
+                last = min(page + NTAG_FAST_READ_MAX_PAGES, end) - 1
+                try:
+                    data += self.ntag2xx_fast_read(page, last)
+                    page = last + 1
+                    continue
+                except PN532Error:
+                    # Not an NTAG, the tag NAKed FAST_READ and is halted now
+                    fast = False
+                    if self.read_passive_target(timeout=0.1) is None:
+                        raise
+            block = self.mifare_classic_read_block(page)
+            data += block[:4*(end - page)]
+            page += 4
+        return bytes(data)
+
     def read_gpio(self, pin=None):
         """Read the state of the PN532's GPIO pins.
         :params pin: <str> specified the pin to read
@@ -32,8 +32,7 @@ using SPI on the Raspberry Pi.
 
 import time
 import spidev
-from gpiozero import DigitalOutputDevice, DigitalInputDevice
-from .pn532 import PN532
+from .pn532 import PN532, WAKEUP_SPI, _gpio_input, _gpio_output
 
 # pylint: disable=bad-whitespace
 _SPI_STATREAD                  = 0x02
@@ -41,82 +40,111 @@ _SPI_DATAWRITE                 = 0x01
 _SPI_DATAREAD                  = 0x03
 _SPI_READY                     = 0x01
 
+SPI_BUS                        = 0
+SPI_DEVICE                     = 0
+SPI_MAX_SPEED_HZ               = 1000000    # the PN532 goes up to 5MHz
+
+# Status polling backs off from the first to the last interval, in seconds
+_POLL_INTERVAL_MIN             = 0.0005
+_POLL_INTERVAL_MAX             = 0.005
+# Oscillator start up time after chip select wakes the PN532, in seconds
+_T_OSC_START                   = 0.002
+# pylint: enable=bad-whitespace
+
+# The PN532 sends and expects bytes LSB first, but most SPI controllers are
+# MSB only, so every byte is bit reversed on the way in and out. This table
+# does it for a whole buffer at once with bytes.translate().
+_REVERSE = bytes(int('{:08b}'.format(i)[::-1], 2) for i in range(256))
+
+_STATREAD_LSB = _REVERSE[_SPI_STATREAD]
+_DATAWRITE_LSB = _REVERSE[_SPI_DATAWRITE]
+_DATAREAD_LSB = _REVERSE[_SPI_DATAREAD]
+_READY_LSB = _REVERSE[_SPI_READY]
+
 
 class SPIDevice:
-    """Implements SPI device on spidev"""
-    def __init__(self, cs=None):
-        self.spi = spidev.SpiDev(0, 0)
+    """Implements SPI device on spidev. With `cs`, chip select is driven from
+    that GPIO pin instead of the controller's own chip select line."""
+    def __init__(self, cs=None, bus=SPI_BUS, device=SPI_DEVICE, max_speed_hz=SPI_MAX_SPEED_HZ):
+        self.spi = spidev.SpiDev(bus, device)
         self._cs = cs
         if cs:
-            self._cs_pin = DigitalOutputDevice(cs)
+            self._cs_pin = _gpio_output(cs)
             self._cs_pin.on()
-        self.spi.max_speed_hz = 1000000
+        self.spi.max_speed_hz = max_speed_hz
         self.spi.mode = 0b10    # CPOL=1 & CPHA=0
 
-    def writebytes(self, buf):
+    def select(self):
+        """Assert chip select, e.g. to wake up the PN532"""
         if self._cs:
             self._cs_pin.off()
-            time.sleep(0.001)
-        ret = self.spi.writebytes(list(buf))
+
+    def deselect(self):
+        """Release chip select"""
         if self._cs:
-            time.sleep(0.001)
             self._cs_pin.on()
-        return ret
+
+    def writebytes(self, buf):
+        """Write `buf` in a single transaction"""
+        self.select()
+        try:
+            return self.spi.writebytes(list(buf))
+        finally:
+            self.deselect()
 
     def readbytes(self, count):
-        if self._cs:
-            self._cs_pin.off()
-            time.sleep(0.001)
-        ret = bytearray(self.spi.readbytes(count))
-        if self._cs:
-            time.sleep(0.001)
-            self._cs_pin.on()
-        return ret
+        """Read `count` bytes in a single transaction"""
+        self.select()
+        try:
+            return bytearray(self.spi.readbytes(count))
+        finally:
+            self.deselect()
 
     def xfer(self, buf):
+        """Full duplex transfer of `buf` in a single transaction, chip select
+        is held active for the whole buffer"""
+        self.select()
+        try:
+            return bytes(self.spi.xfer2(buf))
+        finally:
+            self.deselect()
+
+    def close(self):
+        """Close the SPI device"""
+        self.spi.close()
         if self._cs:
-            self._cs_pin.off()
-            time.sleep(0.001)
-        buf = bytearray(self.spi.xfer(buf))
-        if self._cs:
-            time.sleep(0.001)
-            self._cs_pin.on()
-        return buf
+            self._cs_pin.close()
 
 
 def reverse_bit(num):
     """Turn an LSB byte to an MSB byte, and vice versa. Used for SPI as
     it is LSB for the PN532, but 99% of SPI implementations are MSB only!"""
-    result = 0
-    for _ in range(8):
-        result <<= 1
-        result += (num & 1)
-        num >>= 1
-    return result
+    return _REVERSE[num]
 
 
 class PN532_SPI(PN532):
-    """Driver for the PN532 connected over SPI. Pass in a hardware SPI device
-    & chip select digitalInOut pin. Optional IRQ pin (not used), reset pin and
-    debugging output."""
-    def __init__(self, cs=None, irq=None, reset=None, debug=False):
+    """Driver for the PN532 connected over SPI. Pass in the chip select pin
+    (or None to use the controller's own chip select), the SPI bus, device
+    and clock. Optional IRQ pin (not used), reset pin and debugging output."""
+    _WAKEUP_SOURCE = WAKEUP_SPI
+
+    def __init__(self, cs=None, irq=None, reset=None, debug=False,
+                 bus=SPI_BUS, device=SPI_DEVICE, max_speed_hz=SPI_MAX_SPEED_HZ):
         """Create an instance of the PN532 class using SPI"""
         self.debug = debug
         self._gpio_init(cs=cs, irq=irq, reset=reset)
-        self._spi = SPIDevice(cs)
+        # The SPI device owns the chip select pin
+        self._spi = SPIDevice(cs, bus=bus, device=device, max_speed_hz=max_speed_hz)
         super().__init__(debug=debug, reset=reset)
 
     def _gpio_init(self, reset=None, cs=None, irq=None):
         self._cs = cs
         self._irq = irq
         if reset:
-            self._reset_pin = DigitalOutputDevice(reset)
+            self._reset_pin = _gpio_output(reset)
             self._reset_pin.on()
-        if cs:
-            self._cs_pin = DigitalOutputDevice(cs)
-            self._cs_pin.on()
         if irq:
-            self._irq_pin = DigitalInputDevice(irq)
+            self._irq_pin = _gpio_input(irq)
 
     def _reset(self, pin):
         """Perform a hardware reset toggle"""
@@ -128,48 +156,51 @@ class PN532_SPI(PN532):
         time.sleep(0.1)
 
     def _wakeup(self):
-        """Send any special commands/data to wake up PN532"""
-        time.sleep(1)
-        if self._cs:
-            self._cs_pin.off()
-        time.sleep(0.002)   # T_osc_start
-        self._spi.writebytes(bytearray([0x00])) #pylint: disable=no-member
-        time.sleep(1)
+        """Wake up the PN532 by holding chip select low for T_osc_start. The
+        first command then waits for it with _wait_ready()."""
+        self._spi.select()
+        time.sleep(_T_OSC_START)
+        self._spi.writebytes(b'\x00') #pylint: disable=no-member
+
+    def _resume(self):
+        """Wake the PN532 up from PowerDown, asserting chip select does it"""
+        self._powered_down = False
+        self._spi.writebytes(b'\x00')
+        time.sleep(_T_OSC_START)
 
     def _wait_ready(self, timeout=1):
         """Poll PN532 if status byte is ready, up to `timeout` seconds"""
-        status = bytearray([reverse_bit(_SPI_STATREAD), 0])
-        timestamp = time.monotonic()
-        while (time.monotonic() - timestamp) < timeout:
-            time.sleep(0.01)   # required
-            status = self._spi.xfer(status) #pylint: disable=no-member
-            if reverse_bit(status[1]) == _SPI_READY:  # LSB data is read in MSB
+        status = bytes([_STATREAD_LSB, 0])
+        deadline = time.monotonic() + timeout
+        interval = _POLL_INTERVAL_MIN
+        while True:
+            if self._spi.xfer(status)[1] == _READY_LSB:  # LSB data is read in MSB
                 return True      # Not busy anymore!
-            else:
-                time.sleep(0.005)  # pause a bit till we ask again
-        # We timed out!
-        return False
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False     # We timed out!
+            # Ask again soon, backing off while the PN532 is busy for longer
+            time.sleep(min(interval, remaining))
+            interval = min(interval * 2, _POLL_INTERVAL_MAX)
 
     def _read_data(self, count):
         """Read a specified count of bytes from the PN532."""
-        # Build a read request frame.
-        frame = bytearray(count+1)
-        # Add the SPI data read signal byte, but LSB'ify it
-        frame[0] = reverse_bit(_SPI_DATAREAD)
-        time.sleep(0.005)   # required
-        frame = self._spi.xfer(frame) #pylint: disable=no-member
-        for i, val in enumerate(frame):
-            frame[i] = reverse_bit(val) # turn LSB data to MSB
+        # Data read signal byte, LSB'ified, then clock out `count` bytes
+        frame = self._spi.xfer(bytes([_DATAREAD_LSB]) + bytes(count)) #pylint: disable=no-member
+        frame = frame[1:].translate(_REVERSE)   # turn LSB data to MSB
         if self.debug:
-            print("Reading: ", [hex(i) for i in frame[1:]])
-        return frame[1:]
+            print("Reading: ", [hex(i) for i in frame])
+        return frame
 
     def _write_data(self, framebytes):
         """Write a specified count of bytes to the PN532"""
-        # start by making a frame with data write in front,
-        # then rest of bytes, and LSBify it
-        rev_frame = [reverse_bit(x) for x in bytes([_SPI_DATAWRITE]) + framebytes]
+        # Data write signal byte, then the frame, all LSB'ified
+        rev_frame = bytes([_DATAWRITE_LSB]) + bytes(framebytes).translate(_REVERSE)
         if self.debug:
             print("Writing: ", [hex(i) for i in rev_frame])
-        time.sleep(0.02)   # required
-        self._spi.writebytes(bytes(rev_frame))
+        self._spi.xfer(rev_frame)
+
+    def close(self):
+        """Release the SPI device and the GPIO pins"""
+        self._spi.close()
+        super().close()
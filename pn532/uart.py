@@ -30,21 +30,41 @@ using UART (ttyS0) on the Raspberry Pi.
 """
 
 
+import select
 import time
 import serial
-from gpiozero import DigitalOutputDevice, DigitalInputDevice
-from .pn532 import PN532, BusyError
+from .pn532 import (PN532, BusyError, WAKEUP_HSU, _ACK, _PN532TOHOST,
+                    _COMMAND_GETFIRMWAREVERSION, _COMMAND_SETSERIALBAUDRATE,
+                    _gpio_input, _gpio_output)
+from .frame import FrameDecoder, FRAME_ACK, FRAME_NACK, FRAME_DATA, FRAME_ERROR, MAX_FRAME_SIZE
 
 
 # pylint: disable=bad-whitespace
 DEV_SERIAL          = '/dev/ttyS0'
 BAUD_RATE           = 115200
+READ_TIMEOUT        = 0.1
+
+# SetSerialBaudRate codes, the PN532 always starts at BAUD_RATE
+BAUD_RATES          = {
+    9600: 0x00,
+    19200: 0x01,
+    38400: 0x02,
+    57600: 0x03,
+    115200: 0x04,
+    230400: 0x05,
+    460800: 0x06,
+    921600: 0x07,
+}
+# Firmware probes that must all pass before a new baud rate is trusted
+BAUD_RATE_PROBES    = 5
 
 
 class PN532_UART(PN532):
     """Driver for the PN532 connected over UART. Pass in a hardware UART device.
     Optional IRQ pin (not used), reset pin and debugging output. 
     """
+    _WAKEUP_SOURCE = WAKEUP_HSU
+
     def __init__(self, dev=DEV_SERIAL, baudrate=BAUD_RATE,
                 irq=None, reset=None, debug=False):
         """Create an instance of the PN532 class using UART
@@ -52,22 +72,125 @@ class PN532_UART(PN532):
         1.  disable serial login shell
         2.  enable serial port hardware
         using 'sudo raspi-config' --> 'Interfacing Options' --> 'Serial'
-        """
 
+        The PN532 starts at 115200 baud. With a higher `baudrate` (up to
+        921600) it is switched over with SetSerialBaudRate once it answers,
+        and left at 115200 if the faster link turns out to be unreliable.
+        """
+        if baudrate not in BAUD_RATES:
+            raise ValueError('Unsupported baud rate: {0}'.format(baudrate))
         self.debug = debug
         self._gpio_init(irq=irq, reset=reset)
-        self._uart = serial.Serial(dev, baudrate)
+        self._uart = serial.Serial(dev, BAUD_RATE, timeout=0)
         if not self._uart.is_open:
             raise RuntimeError('cannot open {0}'.format(dev))
+        self._set_low_latency()
+        self._set_host_baudrate(BAUD_RATE)
+        self._decoder = FrameDecoder()
+        self._poller = select.poll()
+        self._poller.register(self._uart.fileno(), select.POLLIN | select.POLLPRI)
+        self._target_baudrate = baudrate
         super().__init__(debug=debug, reset=reset)
+        if baudrate != self._uart.baudrate:
+            self._timed('baudrate', self.set_baudrate, baudrate)
+
+    @property
+    def baudrate(self):
+        """Baud rate the link currently runs at"""
+        return self._uart.baudrate
+
+    def _set_host_baudrate(self, baudrate):
+        """Switch the host side of the link to `baudrate`"""
+        self._uart.baudrate = baudrate
+        # Worst case time on the wire for a full frame, on top of READ_TIMEOUT
+        self._frame_time = MAX_FRAME_SIZE * 10 / baudrate
+
+    def _probe(self, probes=BAUD_RATE_PROBES):
+        """Check that the link works by reading the firmware version
+        `probes` times in a row"""
+        for _ in range(probes):
+            try:
+                if self.call_function(_COMMAND_GETFIRMWAREVERSION, 4, timeout=0.1) is None:
+                    return False
+            except (BusyError, RuntimeError):
+                return False
+        return True
+
+    def _switch_baudrate(self, baudrate, force=False):
+        """Ask the PN532 to switch to `baudrate` and follow it. With `force`
+        the host follows even if the response got lost, since the PN532 may
+        well have received the command."""
+        try:
+            response = self.call_function(_COMMAND_SETSERIALBAUDRATE,
+                                          params=[BAUD_RATES[baudrate]], timeout=0.1)
+        except (BusyError, RuntimeError):
+            if not force:
+                raise
+            response = None
+        if response is None and not force:
+            return False
+        # The PN532 switches once the host acknowledges the response
+        self._uart.write(_ACK)
+        self._uart.flush()
+        time.sleep(0.005)
+        self._set_host_baudrate(baudrate)
+        return True
+
+    def set_baudrate(self, baudrate):
+        """Switch the link to `baudrate`, verified with firmware probes.
+        Falls back to the current rate if the PN532 cannot be reached
+        reliably at the new one. Returns True if the link runs at `baudrate`.
+        """
+        if baudrate not in BAUD_RATES:
+            raise ValueError('Unsupported baud rate: {0}'.format(baudrate))
+        previous = self._uart.baudrate
+        if baudrate == previous:
+            return True
+        try:
+            if self._switch_baudrate(baudrate) and self._probe():
+                if self.debug:
+                    print("Switched to {0} baud".format(baudrate))
+                return True
+        except (BusyError, RuntimeError):
+            pass
+
+        if self.debug:
+            print("Falling back to {0} baud".format(previous))
+        # The PN532 either stayed at the old rate, or switched and the link
+        # is flaky. Try the old rate first, then talk it back down.
+        self._set_host_baudrate(previous)
+        if self._probe(1):
+            return False
+        for _ in range(BAUD_RATE_PROBES):
+            self._set_host_baudrate(baudrate)
+            self._switch_baudrate(previous, force=True)
+            if self._probe(1):
+                return False
+        # Last resort, a reset always brings the PN532 back to BAUD_RATE
+        self._set_host_baudrate(BAUD_RATE)
+        if getattr(self, '_reset_pin', None) is None:
+            raise RuntimeError('Lost the PN532 while switching baud rates')
+        self._reset(self._reset_pin)
+        self._wakeup()
+        return False
+
+    def _set_low_latency(self):
+        """Ask the tty driver to push received bytes to us immediately
+        instead of batching them up (ASYNC_LOW_LATENCY). Not every UART
+        driver supports this, so failures are not fatal."""
+        try:
+            self._uart.set_low_latency_mode(True)
+        except (AttributeError, NotImplementedError, ValueError, OSError) as err:
+            if self.debug:
+                print("Low latency mode not available: ", err)
 
     def _gpio_init(self, reset=None, irq=None):
         self._irq = irq
         if reset:
-            self._reset_pin = DigitalOutputDevice(reset)
+            self._reset_pin = _gpio_output(reset)
             self._reset_pin.on()
         if irq:
-            self._irq_pin = DigitalInputDevice(irq)
+            self._irq_pin = _gpio_input(irq)
 
     def _reset(self, pin):
         """Perform a hardware reset toggle"""
@@ -78,34 +201,102 @@ class PN532_UART(PN532):
         self._reset_pin.on()
         time.sleep(0.1)
 
+    def _warm_start(self):
+        """Probe for an awake PN532, first at the target baud rate, which it
+        keeps from an earlier session until it is reset, then at BAUD_RATE"""
+        if self._target_baudrate != BAUD_RATE:
+            self._set_host_baudrate(self._target_baudrate)
+            if super()._warm_start():
+                return True
+            self._set_host_baudrate(BAUD_RATE)
+        return super()._warm_start()
+
     def _wakeup(self):
         """Send any special commands/data to wake up PN532"""
+        # The preamble wakes the PN532 up, the first command after it must be
+        # SAMConfiguration, which __init__ sends right away
         self._uart.write(b'\x55\x55\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00') # wake up!
-        self.SAM_configuration()
+        self._uart.flush()
+
+    def _resume(self):
+        """Wake the PN532 up from PowerDown with the preamble"""
+        self._powered_down = False
+        self._wakeup()
+        time.sleep(0.002)   # T_osc_start
+
+    def close(self):
+        """Release the serial port and the GPIO pins"""
+        self._uart.close()
+        super().close()
+
+    def _poll(self, timeout):
+        """Block on the serial port until data is readable, up to `timeout`
+        seconds. Returns True as soon as the first byte is available."""
+        if self._uart.in_waiting:
+            return True
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            # poll() takes milliseconds, round up so we never spin on 0
+            if self._poller.poll(int(remaining * 1000) + 1):
+                return True
 
     def _wait_ready(self, timeout=0.001):
         """Wait for response frame, up to `timeout` seconds"""
-        timestamp = time.monotonic()
-        while (time.monotonic() - timestamp) < timeout:
-            if self._uart.in_waiting:
+        # Part of the response may already sit in the decoder, read along with the ACK
+        return self._decoder.in_frame or self._poll(timeout)
+
+    def _read_stream_frame(self):
+        """Feed bytes to the frame decoder as they arrive until it produces a
+        complete frame. Returns (kind, data) or None if the frame did not
+        complete in time."""
+        deadline = time.monotonic() + READ_TIMEOUT + self._frame_time
+        while True:
+            frame = self._decoder.next_frame()
+            if frame is not None:
+                return frame
+            waiting = self._uart.in_waiting
+            if waiting:
+                chunk = self._uart.read(waiting)
+                if self.debug:
+                    print("Reading: ", [hex(i) for i in chunk])
+                self._decoder.feed(chunk)
+                continue
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not self._poll(remaining):
+                return None
+
+    def _read_ack(self):
+        """Read the ACK frame, returns True if it was received."""
+        while True:
+            frame = self._read_stream_frame()
+            if frame is None:
+                return False
+            kind, _ = frame
+            if kind == FRAME_ACK:
                 return True
-            else:
-                time.sleep(0.05)  # lets ask again soon!
-        # Timed out!
-        return False
+            if kind == FRAME_NACK:
+                return False
+            # A late response to an earlier command, skip it
 
-    def _read_data(self, count):
-        """Read a specified count of bytes from the PN532."""
-        frame = self._uart.read(min(self._uart.in_waiting, count))
-        if not frame:
-            raise BusyError("No data read from PN532")
-        if self.debug:
-            print("Reading: ", [hex(i) for i in frame])
-        else:
-            time.sleep(0.005)
-        return frame
+    def _read_response(self, command, response_length):
+        """Read the response frame for `command` and return its data."""
+        frame = self._read_stream_frame()
+        if frame is None:
+            raise BusyError("Incomplete response from PN532")
+        kind, data = frame
+        if kind == FRAME_ERROR:
+            raise RuntimeError('PN532 reported a syntax error in the command!')
+        # Check that response is for the called function.
+        if kind != FRAME_DATA or len(data) < 2 or \
+                not (data[0] == _PN532TOHOST and data[1] == (command+1)):
+            raise RuntimeError('Received unexpected command response!')
+        return data[2:]
 
     def _write_data(self, framebytes):
         """Write a specified count of bytes to the PN532"""
         self._uart.read(self._uart.in_waiting)    # clear FIFO queue of UART
+        self._decoder.reset()
         self._uart.write(framebytes)
@@ -6,7 +6,13 @@
 # Get config values
 CONFIG_PATH=/data/options.json
 DEVICE=$(bashio::config 'device')
+BAUDRATE=$(bashio::config 'baudrate')
 SCAN_INTERVAL=$(bashio::config 'scan_interval')
+READ_MODE=$(bashio::config 'read_mode')
+ADAPTIVE_POLLING=$(bashio::config 'adaptive_polling')
+POWER_DOWN=$(bashio::config 'power_down')
+HA_TRANSPORT=$(bashio::config 'ha_transport')
+NDEF_MODE=$(bashio::config 'ndef_mode')
 LOG_LEVEL=$(bashio::config 'log_level')
 
 # Convert log level to Python format
@@ -34,15 +40,28 @@ esac
 # Create runtime config
 cat > /tmp/spotty_config.yaml << EOF
 device: ${DEVICE}
+baudrate: ${BAUDRATE}
 scan_interval: ${SCAN_INTERVAL}
+read_mode: ${READ_MODE}
+adaptive_polling: ${ADAPTIVE_POLLING}
+power_down: ${POWER_DOWN}
 log_level: ${PYTHON_LOG_LEVEL}
 # No token needed - using Home Assistant API access
 ha_url: http://supervisor/core
+ha_transport: ${HA_TRANSPORT}
+ndef_mode: "${NDEF_MODE}"
+# Keep undelivered events in the add-on's persistent storage
+outbox_path: /data/spotty_outbox.db
 EOF
 
 bashio::log.info "Starting Spotty NFC Bridge..."
 bashio::log.info "Device: ${DEVICE}"
+bashio::log.info "Baud rate: ${BAUDRATE}"
 bashio::log.info "Scan interval: ${SCAN_INTERVAL}"
+bashio::log.info "Read mode: ${READ_MODE}"
+bashio::log.info "Adaptive polling: ${ADAPTIVE_POLLING}"
+bashio::log.info "Home Assistant transport: ${HA_TRANSPORT}"
+bashio::log.info "NDEF mode: ${NDEF_MODE}"
 bashio::log.info "Log level: ${LOG_LEVEL}"
 
 # Activate virtual environment and run the application
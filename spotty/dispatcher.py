@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Dispatcher module for delivering tag events to Home Assistant off the reader loop
+"""
+
+import logging
+import queue
+import threading
+import time
+
+from . import metrics
+
+logger = logging.getLogger("spotty.dispatcher")
+
+# What to do with a new event when the queue is full
+OVERFLOW_DROP_OLDEST = "drop_oldest"
+OVERFLOW_DROP_NEWEST = "drop_newest"
+OVERFLOW_POLICIES = (OVERFLOW_DROP_OLDEST, OVERFLOW_DROP_NEWEST)
+
+# Queued in place of an event to tell the sender thread to exit
+_STOP = object()
+
+class EventDispatcher:
+    """Bounded queue of tag events drained by a dedicated sender thread
+
+    The reader loop only ever calls submit(), which never blocks. A slow or
+    unreachable Home Assistant therefore delays delivery, but not polling.
+    """
+
+    def __init__(self, send, maxsize=32, overflow=OVERFLOW_DROP_OLDEST, replayer=None):
+        """Initialize the dispatcher
+
+        `send` is called with the tag id and device id from the sender thread
+        and should return True when the event was delivered. Events that could not be
+        delivered are stored in the outbox of `replayer` if one is given.
+        """
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {overflow}")
+        self._send = send
+        self.replayer = replayer
+        self._queue = queue.Queue(maxsize)
+        self.overflow = overflow
+        self._lock = threading.Lock()
+        self._thread = None
+
+        # Metrics
+        self.enqueued = 0
+        self.dropped = 0
+        self.sent = 0
+        self.failed = 0
+        self.stored = 0
+        self.max_depth = 0
+        metrics.DISPATCH_QUEUE_DEPTH.set_function(lambda: self.depth)
+
+    @property
+    def depth(self):
+        """Number of events waiting to be sent"""
+        return self._queue.qsize()
+
+    def start(self):
+        """Start the sender thread"""
+        self._thread = threading.Thread(target=self._run, name="spotty-dispatcher", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        """Ask the sender thread to finish the queued events and exit"""
+        if not self._thread:
+            return
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            logger.warning(f"Dispatch queue still full, dropping {self.depth} pending events")
+        self._thread.join(timeout)
+        self._thread = None
+
+    def submit(self, tag_id, device_id=None, event_data=None):
+        """Queue a tag_scanned event for delivery, without blocking
+
+        `event_data` is added to the event. Safe to call from several reader
+        threads. Returns False if the event was dropped because the queue is
+        full.
+        """
+        item = (tag_id, device_id, event_data, time.monotonic())
+        with self._lock:
+            try:
+                self._queue.put_nowait(item)
+            except queue.Full:
+                self.dropped += 1
+                metrics.DISPATCH_DROPPED.inc()
+                if self.overflow == OVERFLOW_DROP_NEWEST:
+                    logger.warning(f"Dispatch queue full, dropping event for {tag_id}")
+                    return False
+                try:
+                    oldest, _, _, _ = self._queue.get_nowait()
+                    logger.warning(f"Dispatch queue full, dropping event for {oldest}")
+                except queue.Empty:
+                    pass
+                self._queue.put_nowait(item)
+            self.enqueued += 1
+            self.max_depth = max(self.max_depth, self._queue.qsize())
+        return True
+
+    def stats(self):
+        """Return a snapshot of the dispatcher metrics"""
+        return {
+            "depth": self.depth,
+            "max_depth": self.max_depth,
+            "enqueued": self.enqueued,
+            "dropped": self.dropped,
+            "sent": self.sent,
+            "failed": self.failed,
+            "stored": self.stored,
+        }
+
+    def _run(self):
+        """Sender thread main loop"""
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+            tag_id, device_id, event_data, queued_at = item
+            if self.replayer and self.replayer.pending:
+                # Older events are still waiting to be replayed, queue up behind them
+                self._store(tag_id, device_id, event_data, queued_at)
+                continue
+
+            logger.debug(f"Dispatching event for {tag_id} after {time.monotonic() - queued_at:.3f}s in queue")
+            try:
+                if event_data:
+                    success = self._send(tag_id, device_id, event_data=event_data)
+                else:
+                    success = self._send(tag_id, device_id)
+            except Exception as e:
+                logger.error(f"Error dispatching event for {tag_id}: {e}")
+                success = False
+
+            if success:
+                self.sent += 1
+            else:
+                self.failed += 1
+                logger.error(f"Failed to send tag scan event for {tag_id} to Home Assistant")
+                if self.replayer:
+                    self._store(tag_id, device_id, event_data, queued_at)
+
+    def _store(self, tag_id, device_id, event_data, queued_at):
+        """Hand an event over to the outbox for a later replay"""
+        # Keep the time of the scan, not the time it was stored
+        created = time.time() - (time.monotonic() - queued_at)
+        try:
+            payload = {"tag_id": tag_id, "device_id": device_id}
+            if event_data:
+                payload["event_data"] = event_data
+            self.replayer.store(payload, created=created)
+        except Exception as e:
+            logger.error(f"Error storing event for {tag_id} in outbox: {e}")
+            return
+        self.stored += 1
@@ -7,19 +7,29 @@ import logging
 import requests
 import json
 import os
+import time
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from . import metrics
 
 logger = logging.getLogger("spotty.ha_client")
 
 class HomeAssistantClient:
     """Client for interacting with the Home Assistant API"""
     
-    def __init__(self, base_url, token=None, device_id="spotty_nfc_reader"):
+    def __init__(self, base_url, token=None, device_id="spotty_nfc_reader",
+                 timeout=10, retries=3, backoff_factor=0.3, pool_size=4):
         """Initialize the Home Assistant client
         
         When running as a Home Assistant add-on, no token is needed as we can use
         the Supervisor API which provides access to Home Assistant.
+        
+        All requests go through one pooled session, so the TCP connection to
+        Home Assistant is kept alive and reused between events.
         """
         self.device_id = device_id
+        self.timeout = timeout
         
         # Check if running as a Home Assistant add-on by looking for SUPERVISOR_TOKEN
         supervisor_token = os.environ.get('SUPERVISOR_TOKEN') or os.environ.get('HASSIO_TOKEN')
@@ -52,14 +62,49 @@ class HomeAssistantClient:
             # This might work for local unsecured Home Assistant instances
             logger.warning("No authentication token available, attempting to connect without authentication")
             self.headers = {"Content-Type": "application/json"}
+        
+        self.session = self._create_session(retries, backoff_factor, pool_size)
+        self._tag_scanned_url = f"{self.base_url}/api/events/tag_scanned"
+    
+    def _create_session(self, retries, backoff_factor, pool_size):
+        """Create the pooled keep-alive session used for all requests"""
+        session = requests.Session()
+        # Headers never change, so set them once instead of on every request
+        session.headers.update(self.headers)
+        
+        # Only retry POSTs when the request never reached Home Assistant
+        # (connect errors). A gateway error from the Supervisor proxy can come
+        # back after Core already fired the event, so only GETs are retried on
+        # those, and an event is never fired twice.
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=0,
+            status=retries,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset(["GET"]),
+            backoff_factor=backoff_factor,
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+    
+    def close(self):
+        """Close the pooled connections"""
+        self.session.close()
     
     def test_connection(self):
-        """Test the connection to Home Assistant"""
+        """Test the connection to Home Assistant
+        
+        This also opens the first pooled connection, so the first tag scan
+        does not pay the connection setup cost.
+        """
         try:
-            response = requests.get(
+            response = self.session.get(
                 f"{self.base_url}/api/",
-                headers=self.headers,
-                timeout=10
+                timeout=self.timeout
             )
             
             if response.status_code == 200:
@@ -73,30 +118,36 @@ class HomeAssistantClient:
             logger.error(f"Error connecting to Home Assistant: {e}")
             return False
     
-    def tag_scanned(self, tag_id):
+    def tag_scanned(self, tag_id, device_id=None, event_data=None):
         """Send a tag_scanned event to Home Assistant
         
         This will trigger any automations associated with the tag.
+        `device_id` overrides the client's device id, to tell readers apart,
+        and `event_data` is added to the event.
         """
+        start = time.monotonic()
         try:
             # Prepare the event data
             data = {
                 "tag_id": tag_id,
-                "device_id": self.device_id
+                "device_id": device_id or self.device_id
             }
+            if event_data:
+                data.update(event_data)
             
             # Send the event
-            response = requests.post(
-                f"{self.base_url}/api/events/tag_scanned",
-                headers=self.headers,
+            response = self.session.post(
+                self._tag_scanned_url,
                 json=data,  # Use json parameter instead of data for proper JSON encoding
-                timeout=10
+                timeout=self.timeout
             )
+            metrics.TAG_SCANNED_DURATION.observe(time.monotonic() - start, "rest")
             
             if response.status_code == 200:
                 logger.info(f"Successfully sent tag_scanned event for {tag_id}")
                 return True
             else:
+                metrics.TAG_SCANNED_FAILURES.inc("rest", str(response.status_code))
                 # Log more details about the error
                 try:
                     error_details = response.json()
@@ -107,6 +158,7 @@ class HomeAssistantClient:
                 
         except Exception as e:
             logger.error(f"Error sending tag_scanned event: {e}")
+            metrics.TAG_SCANNED_FAILURES.inc("rest", "error")
             return False
     
     def call_service(self, domain, service, service_data=None):
@@ -116,11 +168,10 @@ class HomeAssistantClient:
             data = service_data or {}
             
             # Call the service
-            response = requests.post(
+            response = self.session.post(
                 f"{self.base_url}/api/services/{domain}/{service}",
-                headers=self.headers,
                 data=json.dumps(data),
-                timeout=10
+                timeout=self.timeout
             )
             
             if response.status_code == 200:
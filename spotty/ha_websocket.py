@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+"""
+Home Assistant WebSocket API client for firing events over a single connection
+"""
+
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+import websocket
+
+from . import metrics
+
+logger = logging.getLogger("spotty.ha_websocket")
+
+# WebSocket API endpoint when running as an add-on
+SUPERVISOR_WEBSOCKET_URL = "ws://supervisor/core/websocket"
+
+def websocket_url(base_url):
+    """Derive the WebSocket API URL from a Home Assistant base URL"""
+    base_url = base_url.rstrip('/')
+    if base_url.startswith("https://"):
+        base_url = "wss://" + base_url[len("https://"):]
+    elif base_url.startswith("http://"):
+        base_url = "ws://" + base_url[len("http://"):]
+    return f"{base_url}/api/websocket"
+
+class HomeAssistantWebSocketClient:
+    """Client for firing events through the Home Assistant WebSocket API
+
+    A background thread holds one authenticated connection open and
+    reconnects with backoff whenever it drops. Messages are matched to their
+    results by id, so several events can be in flight on the socket at once.
+    It offers the same interface as HomeAssistantClient.
+    """
+
+    def __init__(self, base_url, token=None, device_id="spotty_nfc_reader",
+                 timeout=10, reconnect_delay=1, max_reconnect_delay=30, url=None):
+        """Initialize the Home Assistant WebSocket client
+
+        `url` overrides the WebSocket endpoint derived from `base_url`.
+        """
+        self.device_id = device_id
+        self.timeout = timeout
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+
+        # Check if running as a Home Assistant add-on by looking for SUPERVISOR_TOKEN
+        supervisor_token = os.environ.get('SUPERVISOR_TOKEN') or os.environ.get('HASSIO_TOKEN')
+        self.is_addon = supervisor_token is not None
+
+        if url:
+            self.url = url
+        elif self.is_addon:
+            self.url = SUPERVISOR_WEBSOCKET_URL
+        else:
+            self.url = websocket_url(base_url)
+        self.token = supervisor_token if self.is_addon else token
+        if not self.token:
+            logger.warning("No authentication token available, the WebSocket API will reject the connection")
+
+        self._ws = None
+        self._thread = None
+        self._closed = threading.Event()
+        self._connected = threading.Event()
+        self._send_lock = threading.Lock()
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    def start(self):
+        """Start the connection thread, if it is not running yet"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._closed.clear()
+        self._thread = threading.Thread(target=self._run, name="spotty-ha-websocket", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """Close the connection and stop reconnecting"""
+        self._closed.set()
+        ws = self._ws
+        if ws:
+            # The receive thread is blocked in recv(), so send the close frame
+            # without waiting for the reply and wake the thread up.
+            try:
+                ws.send_close()
+            except Exception:
+                pass
+            ws.abort()
+        if self._thread:
+            self._thread.join(self.timeout)
+            self._thread = None
+
+    def _connect(self):
+        """Open and authenticate a new WebSocket connection"""
+        ws = websocket.create_connection(self.url, timeout=self.timeout, enable_multithread=True)
+        try:
+            message = json.loads(ws.recv())
+            if message.get("type") != "auth_required":
+                raise ConnectionError(f"Unexpected message from Home Assistant: {message}")
+            ws.send(json.dumps({"type": "auth", "access_token": self.token}))
+            message = json.loads(ws.recv())
+            if message.get("type") != "auth_ok":
+                raise ConnectionError(f"Authentication failed: {message.get('message', message)}")
+        except Exception:
+            ws.close()
+            raise
+        # Results can take arbitrarily long, the receive loop blocks until the next message
+        ws.settimeout(None)
+        return ws
+
+    def _run(self):
+        """Keep a connection open and dispatch results until closed"""
+        delay = self.reconnect_delay
+        while not self._closed.is_set():
+            try:
+                ws = self._connect()
+            except Exception as e:
+                logger.error(f"Error connecting to Home Assistant WebSocket API: {e}")
+                self._closed.wait(delay)
+                delay = min(delay * 2, self.max_reconnect_delay)
+                continue
+
+            logger.info(f"Connected to Home Assistant WebSocket API at {self.url}")
+            delay = self.reconnect_delay
+            self._ws = ws
+            self._connected.set()
+            try:
+                self._receive(ws)
+            except Exception as e:
+                if not self._closed.is_set():
+                    logger.warning(f"Home Assistant WebSocket connection lost: {e}")
+            finally:
+                self._connected.clear()
+                self._ws = None
+                ws.shutdown()
+                self._fail_pending(ConnectionError("WebSocket connection lost"))
+
+    def _receive(self, ws):
+        """Resolve pending requests as their results arrive"""
+        while not self._closed.is_set():
+            raw = ws.recv()
+            if not raw:
+                raise ConnectionError("Connection closed by Home Assistant")
+            message = json.loads(raw)
+            with self._pending_lock:
+                future = self._pending.pop(message.get("id"), None)
+            if future:
+                future.set_result(message)
+
+    def _fail_pending(self, error):
+        """Fail every request still waiting for a result"""
+        with self._pending_lock:
+            pending, self._pending = self._pending, {}
+        for future in pending.values():
+            future.set_exception(error)
+
+    def send(self, message):
+        """Send a command and return a Future for its result message
+
+        Does not wait for the result, so several commands can be pipelined.
+        """
+        self.start()
+        if not self._connected.wait(self.timeout):
+            raise ConnectionError("Not connected to Home Assistant WebSocket API")
+        future = Future()
+        # Ids have to increase on a connection, so take one and send under the lock
+        with self._send_lock:
+            ws = self._ws
+            if ws is None:
+                raise ConnectionError("Not connected to Home Assistant WebSocket API")
+            message_id = next(self._ids)
+            with self._pending_lock:
+                self._pending[message_id] = future
+            try:
+                ws.send(json.dumps(dict(message, id=message_id)))
+            except Exception:
+                with self._pending_lock:
+                    self._pending.pop(message_id, None)
+                raise
+        return future
+
+    def _wait(self, future):
+        """Wait for the result of a command sent with send()"""
+        try:
+            return future.result(self.timeout)
+        except FutureTimeoutError:
+            with self._pending_lock:
+                for message_id, pending in list(self._pending.items()):
+                    if pending is future:
+                        del self._pending[message_id]
+            raise TimeoutError("Timed out waiting for Home Assistant")
+
+    def _call(self, message):
+        """Send a command and wait for its result message"""
+        return self._wait(self.send(message))
+
+    def fire_event(self, event_type, event_data=None):
+        """Fire an event and return a Future for its result"""
+        return self.send({
+            "type": "fire_event",
+            "event_type": event_type,
+            "event_data": event_data or {}
+        })
+
+    def test_connection(self):
+        """Test the connection to Home Assistant"""
+        try:
+            response = self._call({"type": "ping"})
+            if response.get("type") == "pong":
+                logger.info("Successfully connected to Home Assistant")
+                return True
+            else:
+                logger.error(f"Failed to connect to Home Assistant: {response}")
+                return False
+
+        except Exception as e:
+            logger.error(f"Error connecting to Home Assistant: {e}")
+            return False
+
+    def tag_scanned(self, tag_id, device_id=None, event_data=None):
+        """Send a tag_scanned event to Home Assistant
+
+        This will trigger any automations associated with the tag.
+        `device_id` overrides the client's device id, to tell readers apart,
+        and `event_data` is added to the event.
+        """
+        start = time.monotonic()
+        try:
+            data = {
+                "tag_id": tag_id,
+                "device_id": device_id or self.device_id
+            }
+            if event_data:
+                data.update(event_data)
+            future = self.fire_event("tag_scanned", data)
+            response = self._wait(future)
+            metrics.TAG_SCANNED_DURATION.observe(time.monotonic() - start, "websocket")
+
+            if response.get("success"):
+                logger.info(f"Successfully sent tag_scanned event for {tag_id}")
+                return True
+            else:
+                error = response.get("error") or {}
+                metrics.TAG_SCANNED_FAILURES.inc("websocket", error.get("code", "error"))
+                logger.error(f"Failed to send tag_scanned event: {response.get('error')}")
+                return False
+
+        except Exception as e:
+            logger.error(f"Error sending tag_scanned event: {e}")
+            metrics.TAG_SCANNED_FAILURES.inc("websocket", "error")
+            return False
+
+    def call_service(self, domain, service, service_data=None):
+        """Call a service in Home Assistant"""
+        try:
+            response = self._call({
+                "type": "call_service",
+                "domain": domain,
+                "service": service,
+                "service_data": service_data or {}
+            })
+
+            if response.get("success"):
+                logger.debug(f"Successfully called service {domain}.{service}")
+                return True
+            else:
+                logger.error(f"Failed to call service {domain}.{service}: {response.get('error')}")
+                return False
+
+        except Exception as e:
+            logger.error(f"Error calling service {domain}.{service}: {e}")
+            return False
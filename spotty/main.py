@@ -8,12 +8,20 @@ import logging
 import os
 import signal
 import sys
+import threading
 import time
 import yaml
 import requests
 import json
-from .nfc_reader import PN532Reader
+from .nfc_reader import PN532Reader, ndef_event_data, ndef_tag_id
 from .ha_client import HomeAssistantClient
+from .ha_websocket import HomeAssistantWebSocketClient
+from .dispatcher import EventDispatcher
+from .outbox import Outbox, OutboxReplayer
+from .rules import RulesTable
+from .scheduler import PollScheduler
+from .supervisor import STATE_OK, ReaderSupervisor
+from . import metrics
 
 # Configure logging
 logging.basicConfig(
@@ -28,12 +36,75 @@ logger = logging.getLogger("spotty")
 # Default configuration
 DEFAULT_CONFIG = {
     "device": "/dev/ttyAMA0",
+    "transport": "uart",
+    "baudrate": 115200,
+    "device_id": "spotty_nfc_reader",
+    "readers": None,
     "ha_url": "http://supervisor/core",
+    "ha_transport": "rest",
     "scan_interval": 0.5,
+    "adaptive_polling": False,
+    "active_window": 30,
+    "idle_interval": 2.0,
+    "power_down": False,
+    "read_mode": "poll",
+    "auto_poll_period": 1,
+    "auto_poll_types": [0x10],
+    "max_targets": 2,
+    "activation_retries": None,
+    "listen_refresh": None,
+    "ndef_mode": "off",
+    "spi_bus": 0,
+    "spi_device": 0,
+    "spi_speed_hz": 1000000,
+    "spi_cs_pin": None,
+    "i2c_bus": 1,
+    "i2c_address": 0x24,
+    "reset_pin": None,
+    "http_timeout": 10,
+    "http_retries": 3,
+    "http_backoff": 0.3,
+    "dispatch_queue_size": 32,
+    "dispatch_overflow": "drop_oldest",
+    "outbox_path": None,
+    "outbox_max_events": 1000,
+    "outbox_max_age": 300,
+    "outbox_batch_size": 20,
+    "reader_failure_threshold": 3,
+    "reader_backoff": 1.0,
+    "reader_max_backoff": 60.0,
+    "metrics_port": None,
+    "rules_path": None,
     "log_level": "INFO",
     "token_file": "/config/spotty_token.txt"
 }
 
+# Settings that can be given per reader, they default to the top-level values
+READER_SETTINGS = (
+    "device",
+    "transport",
+    "baudrate",
+    "device_id",
+    "scan_interval",
+    "adaptive_polling",
+    "active_window",
+    "idle_interval",
+    "power_down",
+    "read_mode",
+    "auto_poll_period",
+    "auto_poll_types",
+    "max_targets",
+    "activation_retries",
+    "listen_refresh",
+    "spi_bus",
+    "spi_device",
+    "spi_speed_hz",
+    "spi_cs_pin",
+    "i2c_bus",
+    "i2c_address",
+    "reset_pin",
+)
+
 class SpottyService:
     """Main service class for Spotty NFC bridge"""
     
@@ -57,8 +128,15 @@ class SpottyService:
         logger.setLevel(log_level)
         
         # Initialize components
-        self.nfc_reader = None
+        self.nfc_readers = []
+        self.supervisors = []
+        # Poll scheduler of each supervised reader, None for a fixed rate
+        self.schedulers = []
         self.ha_client = None
+        self.dispatcher = None
+        self.replayer = None
+        self.rules = None
+        self.metrics_server = None
         
         # Setup signal handlers
         signal.signal(signal.SIGINT, self.handle_signal)
@@ -72,24 +150,116 @@ class SpottyService:
     def initialize(self):
         """Initialize components"""
         try:
-            # Initialize NFC reader
-            logger.info(f"Initializing NFC reader on {self.config['device']}")
-            self.nfc_reader = PN532Reader(self.config["device"])
+            # Serve metrics first, so reader initialization failures show up too
+            if self.config["metrics_port"]:
+                self.metrics_server = metrics.MetricsServer(self.config["metrics_port"])
+                self.metrics_server.start()
+            
+            # Initialize NFC readers
+            for reader_config in self._reader_configs():
+                logger.info(f"Initializing NFC reader {reader_config['device_id']} on {reader_config['device']}")
+                try:
+                    reader = PN532Reader(
+                        reader_config["device"],
+                        baudrate=reader_config["baudrate"],
+                        timeout=reader_config["scan_interval"],
+                        mode=reader_config["read_mode"],
+                        auto_poll_period=reader_config["auto_poll_period"],
+                        auto_poll_types=reader_config["auto_poll_types"],
+                        transport=reader_config["transport"],
+                        device_id=reader_config["device_id"],
+                        max_targets=reader_config["max_targets"],
+                        activation_retries=reader_config["activation_retries"],
+                        # Notice a PN532 that stopped answering within about
+                        # twice the time the supervisor takes to give up on it
+                        listen_refresh=(reader_config["listen_refresh"]
+                                        or reader_config["scan_interval"]
+                                        * self.config["reader_failure_threshold"]),
+                        command_metrics=bool(self.config["metrics_port"]),
+                        spi_bus=reader_config["spi_bus"],
+                        spi_device=reader_config["spi_device"],
+                        spi_speed_hz=reader_config["spi_speed_hz"],
+                        spi_cs_pin=reader_config["spi_cs_pin"],
+                        i2c_bus=reader_config["i2c_bus"],
+                        i2c_address=reader_config["i2c_address"],
+                        reset_pin=reader_config["reset_pin"],
+                        connect=False
+                    )
+                except ValueError as e:
+                    logger.error(f"Skipping NFC reader {reader_config['device_id']}: {e}")
+                    continue
+                supervisor = ReaderSupervisor(
+                    reader,
+                    failure_threshold=self.config["reader_failure_threshold"],
+                    backoff=self.config["reader_backoff"],
+                    max_backoff=self.config["reader_max_backoff"]
+                )
+                # A reader that does not come up yet is retried by its
+                # supervisor, like one that stopped working
+                supervisor.start()
+                self.nfc_readers.append(reader)
+                self.supervisors.append(supervisor)
+                self.schedulers.append(PollScheduler(
+                    active_window=reader_config["active_window"],
+                    idle_interval=reader_config["idle_interval"],
+                    min_interval=reader_config["scan_interval"],
+                    power_down=bool(reader_config["power_down"])
+                ) if reader_config["adaptive_polling"] else None)
+            
+            if not self.nfc_readers:
+                logger.error("No NFC reader is configured")
+                return False
             
             # Initialize Home Assistant client
             logger.info(f"Connecting to Home Assistant at {self.config['ha_url']}")
             
             # When running as an add-on, no token is needed
             token = self._get_token()
-            self.ha_client = HomeAssistantClient(
-                self.config["ha_url"], 
-                token
-            )
+            if self.config["ha_transport"] == "websocket":
+                self.ha_client = HomeAssistantWebSocketClient(
+                    self.config["ha_url"],
+                    token,
+                    timeout=self.config["http_timeout"]
+                )
+            else:
+                self.ha_client = HomeAssistantClient(
+                    self.config["ha_url"], 
+                    token,
+                    timeout=self.config["http_timeout"],
+                    retries=self.config["http_retries"],
+                    backoff_factor=self.config["http_backoff"]
+                )
             
-            # Test Home Assistant connection
+            # Test Home Assistant connection, this also warms up the connection pool
             if not self.ha_client.test_connection():
                 logger.error("Failed to connect to Home Assistant. Check URL and token.")
                 return False
+            
+            # Keep events that could not be delivered on disk and replay them
+            # once Home Assistant is reachable again
+            if self.config["outbox_path"]:
+                logger.info(f"Storing undelivered events in {self.config['outbox_path']}")
+                self.replayer = OutboxReplayer(
+                    Outbox(self.config["outbox_path"], max_events=self.config["outbox_max_events"]),
+                    self.ha_client.tag_scanned,
+                    batch_size=self.config["outbox_batch_size"],
+                    max_age=self.config["outbox_max_age"]
+                )
+                self.replayer.start()
+            
+            # Deliver events from a background thread so a slow Home Assistant
+            # never holds up polling
+            self.dispatcher = EventDispatcher(
+                self.ha_client.tag_scanned,
+                maxsize=self.config["dispatch_queue_size"],
+                overflow=self.config["dispatch_overflow"],
+                replayer=self.replayer
+            )
+            self.dispatcher.start()
+            
+            # Tags with a local rule call their services directly
+            if self.config["rules_path"]:
+                self.rules = RulesTable(self.config["rules_path"], self.ha_client.call_service)
                 
             return True
             
@@ -97,6 +267,22 @@ class SpottyService:
             logger.error(f"Initialization error: {e}")
             return False
     
+    def _reader_configs(self):
+        """Return the settings of every configured reader
+        
+        Without a `readers` list, a single reader is built from the top-level
+        settings.
+        """
+        defaults = {key: self.config[key] for key in READER_SETTINGS}
+        readers = self.config.get("readers") or [{}]
+        configs = []
+        for index, reader in enumerate(readers):
+            reader_config = dict(defaults, **reader)
+            if len(readers) > 1 and "device_id" not in reader:
+                reader_config["device_id"] = f"{defaults['device_id']}_{index + 1}"
+            configs.append(reader_config)
+        return configs
+    
     def _get_token(self):
         """Get the Home Assistant long-lived access token"""
         # Check if running as a Home Assistant add-on by looking for SUPERVISOR_TOKEN
@@ -132,42 +318,124 @@ class SpottyService:
             logger.error("Failed to initialize. Exiting.")
             return 1
         
-        logger.info("Spotty NFC bridge started")
+        logger.info(f"Spotty NFC bridge started with {len(self.nfc_readers)} reader(s)")
         self.running = True
         
+        # Poll every reader on its own thread, they all feed the same dispatcher
+        threads = []
+        for supervisor, scheduler in zip(self.supervisors, self.schedulers):
+            thread = threading.Thread(
+                target=self._poll_reader,
+                args=(supervisor, scheduler),
+                name=f"spotty-reader-{supervisor.reader.device_id}",
+                daemon=True
+            )
+            thread.start()
+            threads.append(thread)
+        
+        try:
+            while self.running:
+                if not any(thread.is_alive() for thread in threads):
+                    logger.error("All NFC readers stopped")
+                    return 1
+                time.sleep(0.5)
+                
+        finally:
+            self.running = False
+            for thread in threads:
+                thread.join(5)
+            
+            # Cleanup
+            for supervisor in self.supervisors:
+                logger.info(f"Reader {supervisor.reader.device_id} health: {supervisor.health()}")
+            for reader in self.nfc_readers:
+                reader.cleanup()
+            
+            if self.dispatcher:
+                self.dispatcher.stop()
+                logger.info(f"Dispatch stats: {self.dispatcher.stats()}")
+            
+            if self.rules:
+                self.rules.close()
+            
+            if self.replayer:
+                self.replayer.stop()
+                self.replayer.outbox.close()
+            
+            if self.ha_client:
+                self.ha_client.close()
+            
+            if self.metrics_server:
+                self.metrics_server.stop()
+            
+            logger.info("Spotty NFC bridge stopped")
+        
+        return 0
+    
+    def _poll_reader(self, supervisor, scheduler=None):
+        """Poll one NFC reader until the service stops
+        
+        With a `scheduler`, the reader waits between poll cycles once it has
+        been idle for a while, with the PN532 in PowerDown if configured.
+        """
+        reader = supervisor.reader
+        # YAML reads a bare off as False
+        ndef_mode = self.config["ndef_mode"] or "off"
         try:
             while self.running:
-                # Read NFC tag
-                uid = self.nfc_reader.read_tag(timeout=self.config["scan_interval"])
+                # Read NFC tags, stacked tags are all listed in one exchange.
+                # The supervisor re-initializes the reader if it keeps failing.
+                uids = supervisor.read_tags()
                 
-                if uid:
+                records = None
+                if ndef_mode != "off" and len(uids) == 1:
+                    records = reader.read_ndef()
+                
+                for uid in uids:
                     tag_id = "_".join([hex(i) for i in uid])
                     formatted_tag_id = f"nfc_{tag_id}"
-                    logger.info(f"Tag detected: {tag_id}")
+                    logger.info(f"Tag detected on {reader.device_id}: {tag_id}")
                     
-                    # Send the tag_scanned event to Home Assistant
-                    # This will trigger any automations associated with the tag
-                    event_success = self.ha_client.tag_scanned(formatted_tag_id)
+                    event_data = None
+                    if records and ndef_mode == "tag_id":
+                        formatted_tag_id = ndef_tag_id(records) or formatted_tag_id
+                        logger.info(f"Using NDEF tag id {formatted_tag_id}")
+                    elif records and ndef_mode == "event_data":
+                        event_data = ndef_event_data(records)
                     
-                    if event_success:
-                        logger.info(f"Tag scan event for {tag_id} sent to Home Assistant")
-                    else:
-                        logger.error(f"Failed to send tag scan event for {tag_id} to Home Assistant")
+                    rule = self.rules.lookup(formatted_tag_id) if self.rules else None
+                    if rule:
+                        self.rules.run(rule)
+                        if not rule.fire_event:
+                            continue
                     
+                    # Queue the tag_scanned event for Home Assistant
+                    # This will trigger any automations associated with the tag
+                    self.dispatcher.submit(formatted_tag_id, reader.device_id, event_data)
+                
+                if uids:
                     # Prevent multiple reads of the same tag
                     time.sleep(2)
                 
+                delay = scheduler.next_delay(bool(uids)) if scheduler else 0
+                if delay > 0 and supervisor.state == STATE_OK:
+                    self._idle(reader, delay, scheduler.power_down)
+                
         except Exception as e:
-            logger.error(f"Error in main loop: {e}")
-            return 1
-        finally:
-            # Cleanup
-            if self.nfc_reader:
-                self.nfc_reader.cleanup()
-            
-            logger.info("Spotty NFC bridge stopped")
-        
-        return 0
+            logger.error(f"Error polling NFC reader {reader.device_id}: {e}")
+
+    def _idle(self, reader, delay, power_down=False):
+        """Wait `delay` seconds between poll cycles, with the PN532 in
+        PowerDown if `power_down`. The next poll wakes it up again.
+        """
+        if power_down:
+            reader.power_down()
+        end = time.monotonic() + delay
+        while self.running:
+            remaining = end - time.monotonic()
+            if remaining <= 0:
+                break
+            time.sleep(min(remaining, 0.5))
 
 def main():
     """Main entry point"""
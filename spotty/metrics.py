@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+"""
+Metrics module for exposing reader and dispatch metrics in the Prometheus text format
+"""
+
+import bisect
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger("spotty.metrics")
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Default histogram buckets in seconds, from a fast PN532 exchange up to HTTP timeouts
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _escape(value):
+    """Escape a label value"""
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+class _Metric:
+    """Base class for metrics with an optional set of labels
+
+    Label values are passed positionally, in the order of `labelnames`. Every
+    update is a dictionary lookup and an addition under a lock, which keeps
+    them cheap enough for the poll loop.
+    """
+
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {labels}")
+        return labels
+
+    def _samples(self):
+        """Yield (suffix, label string, value) for every sample"""
+        raise NotImplementedError
+
+    def render(self):
+        """Render the metric in the Prometheus text format"""
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            samples = list(self._samples())
+        for suffix, labels, value in samples:
+            lines.append(f"{self.name}{suffix}{labels} {_format_value(value)}")
+        return "\n".join(lines)
+
+class Counter(_Metric):
+    """Monotonically increasing count"""
+
+    type = "counter"
+
+    def inc(self, *labels, amount=1):
+        """Increase the count for the given label values"""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, *labels):
+        """Current count for the given label values"""
+        return self._values.get(labels, 0)
+
+    def _samples(self):
+        for key, value in self._values.items():
+            yield "_total", _format_labels(self.labelnames, key), value
+
+class Gauge(_Metric):
+    """Value that can go up and down, or be read from a callback when scraped"""
+
+    type = "gauge"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._functions = {}
+
+    def set(self, value, *labels):
+        """Set the value for the given label values"""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def set_function(self, function, *labels):
+        """Read the value from `function` whenever the metric is scraped"""
+        key = self._key(labels)
+        with self._lock:
+            self._functions[key] = function
+
+    def get(self, *labels):
+        """Current value for the given label values"""
+        if labels in self._functions:
+            return self._functions[labels]()
+        return self._values.get(labels, 0)
+
+    def _samples(self):
+        for key, value in self._values.items():
+            yield "", _format_labels(self.labelnames, key), value
+        for key, function in self._functions.items():
+            try:
+                value = function()
+            except Exception as e:
+                logger.debug(f"Error reading gauge {self.name}: {e}")
+                continue
+            yield "", _format_labels(self.labelnames, key), value
+
+class Histogram(_Metric):
+    """Distribution of observed values, counted in buckets"""
+
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *labels):
+        """Record an observation for the given label values"""
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per bucket counts (the last one is +Inf), then the sum
+                state = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            state[index] += 1
+            state[-1] += value
+
+    def count(self, *labels):
+        """Number of observations for the given label values"""
+        state = self._values.get(labels)
+        return sum(state[:-1]) if state else 0
+
+    def _samples(self):
+        for key, state in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), state):
+                cumulative += count
+                le = f'le="{_format_value(float(bound))}"'
+                yield "_bucket", _format_labels(self.labelnames, key, le), cumulative
+            labels = _format_labels(self.labelnames, key)
+            yield "_sum", labels, state[-1]
+            yield "_count", labels, cumulative
+
+class Registry:
+    """Collection of metrics that are rendered together"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                if type(existing) is not type(metric) or existing.labelnames != metric.labelnames:
+                    raise ValueError(f"Metric {metric.name} is already registered differently")
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        """Create (or return the already registered) counter"""
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        """Create (or return the already registered) gauge"""
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        """Create (or return the already registered) histogram"""
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        """Render all metrics in the Prometheus text format"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+# Registry the rest of Spotty reports to
+REGISTRY = Registry()
+
+POLL_CYCLES = REGISTRY.counter(
+    "spotty_poll_cycles", "Poll cycles run by a reader", ("reader",))
+POLL_DURATION = REGISTRY.histogram(
+    "spotty_pn532_poll_seconds",
+    "Round trip of the PN532 poll command (InListPassiveTarget or InAutoPoll), "
+    "including the time the PN532 waited for a tag",
+    ("reader", "command"))
+TAGS_DETECTED = REGISTRY.counter(
+    "spotty_tags_detected", "Tags detected by a reader", ("reader",))
+PN532_ERRORS = REGISTRY.counter(
+    "spotty_pn532_errors", "Errors reported by the PN532, by error code", ("reader", "code", "error"))
+PN532_COMMANDS = REGISTRY.counter(
+    "spotty_pn532_commands", "PN532 commands sent, by command code and outcome",
+    ("reader", "command", "outcome"))
+PN532_COMMAND_DURATION = REGISTRY.histogram(
+    "spotty_pn532_command_seconds",
+    "Time spent in each step of a PN532 command (write, ack_wait, response_wait)",
+    ("reader", "command", "step"),
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0))
+PN532_BYTES = REGISTRY.counter(
+    "spotty_pn532_bytes", "Frame bytes exchanged with the PN532", ("reader", "direction"))
+READER_ERRORS = REGISTRY.counter(
+    "spotty_reader_errors", "Failed poll cycles, by exception type", ("reader", "type"))
+READER_INITIALIZATIONS = REGISTRY.counter(
+    "spotty_reader_initializations", "PN532 reader initializations", ("reader", "result"))
+READER_UP = REGISTRY.gauge(
+    "spotty_reader_up", "Whether a reader is usable (0 while waiting to re-initialize it)",
+    ("reader",))
+READER_CONSECUTIVE_FAILURES = REGISTRY.gauge(
+    "spotty_reader_consecutive_failures", "Failed poll cycles of a reader since the last good one",
+    ("reader",))
+TAG_SCANNED_DURATION = REGISTRY.histogram(
+    "spotty_tag_scanned_seconds", "Time taken to deliver a tag_scanned event to Home Assistant",
+    ("transport",))
+TAG_SCANNED_FAILURES = REGISTRY.counter(
+    "spotty_tag_scanned_failures",
+    "tag_scanned events Home Assistant did not accept, by HTTP status code "
+    "(or error when the request failed)",
+    ("transport", "status"))
+DISPATCH_QUEUE_DEPTH = REGISTRY.gauge(
+    "spotty_dispatch_queue_depth", "Tag events waiting to be sent")
+DISPATCH_DROPPED = REGISTRY.counter(
+    "spotty_dispatch_dropped", "Tag events dropped because the dispatch queue was full")
+RULE_ACTIONS = REGISTRY.counter(
+    "spotty_rule_actions", "Service calls made by local rules, by service and result",
+    ("service", "result"))
+RULE_DURATION = REGISTRY.histogram(
+    "spotty_rule_seconds", "Time taken to run all actions of a local rule")
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    """Serves the registry on /metrics"""
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        payload = self.server.registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} - {format % args}")
+
+class MetricsServer:
+    """HTTP server exposing a registry for Prometheus to scrape"""
+
+    def __init__(self, port, host="", registry=REGISTRY):
+        self.port = port
+        self.host = host
+        self.registry = registry
+        self._server = None
+        self._thread = None
+
+    def start(self):
+        """Start serving on a background thread"""
+        self._server = ThreadingHTTPServer((self.host, self.port), _MetricsHandler)
+        self._server.daemon_threads = True
+        self._server.registry = self.registry
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        name="spotty-metrics", daemon=True)
+        self._thread.start()
+        logger.info(f"Serving metrics on port {self._server.server_address[1]}")
+
+    def stop(self):
+        """Stop serving"""
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        if self._thread:
+            self._thread.join(5)
+            self._thread = None
@@ -4,71 +4,349 @@ NFC Reader module for interfacing with PN532 hardware
 """
 
 import logging
+import math
 import time
 
-# Use mock GPIO pins to avoid hardware access issues
-from gpiozero import Device
-from gpiozero.pins.mock import MockFactory
+# Transport drivers are imported on demand by get_transport(), so only the
+# one in use (and its dependencies) gets loaded
+from pn532 import TRANSPORTS as _DRIVERS, get_transport
+from pn532.ndef import NdefError, parse_message, read_ntag_message
+from pn532.pn532 import (AUTOPOLL_GENERIC_106KBPS, AUTOPOLL_ISO14443_4A,
+                         AUTOPOLL_MIFARE, AUTOPOLL_PERIOD_UNIT, OUTCOME_PN532_ERROR,
+                         PN532_ERRORS, RF_RETRY_FOREVER, PN532Error)
 
-# Set the pin factory to mock before importing pn532
-Device.pin_factory = MockFactory()
-
-# Now import the PN532 library
-from pn532 import PN532_UART
+from . import metrics
 
 logger = logging.getLogger("spotty.nfc_reader")
 
+# Reader modes
+MODE_POLL = "poll"          # host issues InListPassiveTarget every cycle
+MODE_AUTOPOLL = "autopoll"  # PN532 polls by itself with InAutoPoll
+MODE_LISTEN = "listen"      # one InListPassiveTarget stays pending until a tag shows up
+
+# Seconds a listen stays pending before it is sent again, by default. A PN532
+# that went away looks like an empty field while listening, the ACK of the
+# new command shows it is still there.
+LISTEN_REFRESH = 2.0
+
+# Supported ways of wiring the PN532
+TRANSPORTS = tuple(_DRIVERS)
+
+# InAutoPoll target types whose target data carries an ISO14443A UID
+_ISO14443A_TYPES = (AUTOPOLL_GENERIC_106KBPS, AUTOPOLL_MIFARE, AUTOPOLL_ISO14443_4A)
+
+# SEL_RES of NFC Forum Type 2 tags (NTAG, MIFARE Ultralight)
+_SEL_RES_TYPE2 = 0x00
+
+# URI the Home Assistant companion apps write to tags, followed by the tag id
+HA_TAG_URL = "https://www.home-assistant.io/tag/"
+
+class NoAckError(Exception):
+    """The PN532 did not acknowledge a command"""
+
+def ndef_tag_id(records):
+    """Tag id taken from the first URI or text record, None if there is none
+    
+    Tags written by the Home Assistant companion apps give their own tag id.
+    """
+    for record in records:
+        value = record.value
+        if value:
+            return value[len(HA_TAG_URL):] if value.startswith(HA_TAG_URL) else value
+    return None
+
+def ndef_event_data(records):
+    """Event data describing the NDEF records of a tag"""
+    return {"ndef": [
+        {"type": record.type.decode("utf-8", "replace"), "value": record.value}
+        if record.value is not None else
+        {"type": record.type.decode("utf-8", "replace"), "payload": record.payload.hex()}
+        for record in records
+    ]}
+
 class PN532Reader:
-    """Class for interfacing with PN532 NFC reader via UART"""
+    """Class for interfacing with PN532 NFC reader via UART, I2C or SPI"""
     
-    def __init__(self, port, baudrate=115200, timeout=1):
-        """Initialize the PN532 reader"""
+    def __init__(self, port, baudrate=115200, timeout=1, mode=MODE_POLL,
+                 auto_poll_period=1, auto_poll_types=None, transport="uart",
+                 device_id=None, max_targets=2, command_metrics=False,
+                 spi_bus=0, spi_device=0, spi_speed_hz=1000000, spi_cs_pin=None,
+                 i2c_bus=1, i2c_address=0x24, reset_pin=None, activation_retries=None,
+                 listen_refresh=LISTEN_REFRESH, connect=True):
+        """Initialize the PN532 reader
+        
+        `port` is the serial device and is only used by the UART transport,
+        which switches the link to `baudrate` (up to 921600) once the PN532
+        answers, or stays at 115200 if the faster link is unreliable.
+        The SPI transport uses `spi_bus`, `spi_device` and `spi_speed_hz`, and
+        drives chip select from GPIO `spi_cs_pin` (None for the controller's
+        own chip select). The I2C transport talks to `i2c_address` on
+        /dev/i2c-`i2c_bus`. With `reset_pin`, the PN532's RSTPDN line is driven
+        from that GPIO pin to reset a chip that doesn't answer at startup.
+        GPIO pins are only claimed (and gpiozero imported) when configured.
+        `timeout` is how long read_tag() waits for a tag by default.
+        Up to `max_targets` (1 or 2) stacked tags are listed in one exchange.
+        `device_id` identifies the reader in the events sent to Home Assistant.
+        With `command_metrics`, every PN532 command is timed step by step and
+        reported to the metrics registry. With `connect` False the PN532 is
+        left alone until reinitialize() is called.
+        
+        In autopoll mode the PN532 polls for `auto_poll_types` by itself every
+        `auto_poll_period` * 150ms and only answers once a tag shows up or the
+        read timeout has been covered.
+        
+        In listen mode a single InListPassiveTarget is left pending across
+        poll cycles, the PN532 keeps retrying the activation by itself and
+        the host only waits up to `timeout` for its answer each cycle, so
+        there are no gaps between polls. `activation_retries` sets the
+        PN532's MxRtyPassiveActivation (0xFF to retry until a tag shows up,
+        the default in listen mode), None leaves the chip's setting alone.
+        The pending listen is sent again every `listen_refresh` seconds, and
+        its ACK shows the PN532 still answers. Once one goes unacknowledged,
+        every following poll cycle sends it again and fails until the PN532
+        answers.
+        """
+        if mode not in (MODE_POLL, MODE_AUTOPOLL, MODE_LISTEN):
+            raise ValueError(f"Unknown reader mode: {mode}")
+        if transport not in TRANSPORTS:
+            raise ValueError(f"Unknown transport: {transport}")
         self.port = port
+        self.baudrate = baudrate
+        self.transport = transport
+        self.timeout = timeout
+        self.max_targets = max_targets
+        self.device_id = device_id
+        self.mode = mode
+        self.auto_poll_period = auto_poll_period
+        self.auto_poll_types = tuple(auto_poll_types or (AUTOPOLL_MIFARE,))
+        self.command_metrics = command_metrics
+        self.spi_bus = spi_bus
+        self.spi_device = spi_device
+        self.spi_speed_hz = spi_speed_hz
+        self.spi_cs_pin = spi_cs_pin
+        self.i2c_bus = i2c_bus
+        self.i2c_address = i2c_address
+        self.reset_pin = reset_pin
+        if activation_retries is None and mode == MODE_LISTEN:
+            activation_retries = RF_RETRY_FOREVER
+        self.activation_retries = activation_retries
+        self.listen_refresh = listen_refresh
         self.pn532 = None
+        # SEL_RES of the targets found by the last poll
+        self._sel_res = []
+        # When the pending listen was sent, in listen mode
+        self._listen_sent = 0.0
+        # Error of the last poll cycle, None if it went fine
+        self.error = None
+        # Label of this reader in the metrics
+        self._metrics_label = device_id or port
+        self._poll_command = "InAutoPoll" if mode == MODE_AUTOPOLL else "InListPassiveTarget"
         
-        self._initialize()
+        if connect:
+            self._initialize()
     
     def _initialize(self):
         """Initialize the PN532 reader"""
         try:
-            # Initialize the PN532 using UART
-            logger.info(f"Initializing PN532 on {self.port}")
-            # Use the same parameters as the example code
-            self.pn532 = PN532_UART(self.port, debug=False, reset=20)
+            start = time.monotonic()
+            driver = get_transport(self.transport)
+            if self.transport == "i2c":
+                logger.info(f"Initializing PN532 on I2C bus {self.i2c_bus} at {hex(self.i2c_address)}")
+                self.pn532 = driver(debug=False, reset=self.reset_pin,
+                                    bus=self.i2c_bus, address=self.i2c_address)
+            elif self.transport == "spi":
+                logger.info(f"Initializing PN532 on SPI bus {self.spi_bus}, device {self.spi_device}")
+                self.pn532 = driver(debug=False, reset=self.reset_pin, cs=self.spi_cs_pin,
+                                    bus=self.spi_bus, device=self.spi_device,
+                                    max_speed_hz=self.spi_speed_hz)
+            else:
+                logger.info(f"Initializing PN532 on {self.port}")
+                self.pn532 = driver(self.port, baudrate=self.baudrate, debug=False,
+                                    reset=self.reset_pin)
+                if self.pn532.baudrate != self.baudrate:
+                    logger.warning(f"Could not switch {self.port} to {self.baudrate} baud, "
+                                   f"staying at {self.pn532.baudrate}")
             
-            # Get firmware version to check connection
-            ic, ver, rev, support = self.pn532.get_firmware_version()
-            logger.info(f"Found PN532 with firmware version: {ver}.{rev}")
+            if self.command_metrics:
+                self.pn532.add_hook(self._record_command)
+            # Set every time, a warm started PN532 keeps its RF settings
+            if self.activation_retries is not None:
+                self.pn532.set_max_retries(passive_activation=self.activation_retries)
             
-            # Configure PN532 to communicate with MiFare cards
-            self.pn532.SAM_configuration()
-            logger.info("PN532 configured for reading")
+            # The driver checked the connection and configured the PN532 to
+            # read MiFare cards while starting up
+            ic, ver, rev, support = self.pn532.firmware_version
+            logger.info(f"Found PN532 with firmware version: {ver}.{rev}")
+            steps = ", ".join(f"{step} {seconds * 1000:.1f}ms"
+                              for step, seconds in self.pn532.startup_timings)
+            logger.info(f"PN532 ready in {(time.monotonic() - start) * 1000:.1f}ms ({steps})")
+            metrics.READER_INITIALIZATIONS.inc(self._metrics_label, "success")
                 
         except Exception as e:
             logger.error(f"Error initializing PN532: {e}")
+            metrics.READER_INITIALIZATIONS.inc(self._metrics_label, "failure")
             raise
     
-    def read_tag(self, timeout=0.5):
+    def reinitialize(self):
+        """Close the driver and initialize the PN532 again, raises if that fails"""
+        self._close()
+        self._initialize()
+    
+    def _close(self):
+        if self.pn532 is None:
+            return
+        try:
+            self.pn532.close()
+        except Exception as e:
+            logger.debug(f"Error closing PN532 driver: {e}")
+        self.pn532 = None
+    
+    def _record_command(self, timing):
+        """PN532 command hook feeding the command metrics"""
+        label = self._metrics_label
+        command = f"0x{timing.command:02x}"
+        metrics.PN532_COMMANDS.inc(label, command, timing.outcome)
+        metrics.PN532_COMMAND_DURATION.observe(timing.write, label, command, "write")
+        metrics.PN532_COMMAND_DURATION.observe(timing.ack_wait, label, command, "ack_wait")
+        if timing.response_wait:
+            metrics.PN532_COMMAND_DURATION.observe(timing.response_wait, label, command, "response_wait")
+        metrics.PN532_BYTES.inc(label, "out", amount=timing.bytes_written)
+        metrics.PN532_BYTES.inc(label, "in", amount=timing.bytes_read)
+        if timing.outcome == OUTCOME_PN532_ERROR:
+            metrics.PN532_ERRORS.inc(label, hex(timing.error),
+                                     PN532_ERRORS.get(timing.error, "PN532 ERROR UNKNOWN"))
+    
+    def _count_pn532_error(self, e):
+        """Count a PN532Error, unless _record_command has counted it already"""
+        if not self.command_metrics:
+            metrics.PN532_ERRORS.inc(self._metrics_label, hex(e.err), e.errmsg)
+    
+    def read_tag(self, timeout=None):
         """Read a passive target (ISO14443A card/tag)"""
+        uids = self.read_tags(timeout)
+        return uids[0] if uids else None
+    
+    def read_tags(self, timeout=None):
+        """Read all passive targets in the field, returns a list of UIDs"""
+        if timeout is None:
+            timeout = self.timeout
+        label = self._metrics_label
+        metrics.POLL_CYCLES.inc(label)
+        self.error = None
+        # The driver reports a poll the PN532 never acknowledged like one
+        # without a tag, only its missed ACK count tells them apart
+        missed_acks = self.pn532.missed_acks
         try:
-            # Check if a card is available to read
-            uid = self.pn532.read_passive_target(timeout=timeout)
+            # Check if cards are available to read
+            start = time.monotonic()
+            if self.mode == MODE_AUTOPOLL:
+                uids = self._auto_poll(timeout)
+            elif self.mode == MODE_LISTEN:
+                uids = self._listen(timeout)
+            else:
+                targets = self.pn532.read_passive_targets(max_targets=self.max_targets,
+                                                          timeout=timeout)
+                uids = [uid for uid, sens_res, sel_res in targets]
+                self._sel_res = [sel_res for uid, sens_res, sel_res in targets]
+            metrics.POLL_DURATION.observe(time.monotonic() - start, label, self._poll_command)
+            if self.pn532.missed_acks != missed_acks:
+                self.error = NoAckError(f"PN532 did not acknowledge {self._poll_command}")
             
-            # Return None if no card is available
-            if uid is None:
-                return None
-                
-            logger.debug(f"Found card with UID: {[hex(i) for i in uid]}")
-            return uid
+            if uids:
+                metrics.TAGS_DETECTED.inc(label, amount=len(uids))
+            for uid in uids:
+                logger.debug(f"Found card with UID: {[hex(i) for i in uid]}")
+            return uids
             
+        except PN532Error as e:
+            logger.error(f"Error reading tag: {e.errmsg}")
+            self._count_pn532_error(e)
+            self.error = e
+            return []
         except Exception as e:
             logger.error(f"Error reading tag: {e}")
+            metrics.READER_ERRORS.inc(label, type(e).__name__)
+            self.error = e
+            return []
+    
+    def _auto_poll(self, timeout):
+        """Let the PN532 poll on its own for roughly `timeout` seconds"""
+        # Ask for enough polling rounds to cover the timeout, so the chip
+        # finishes by itself and we never have to abort the command.
+        poll_nr = math.ceil(timeout / (self.auto_poll_period * AUTOPOLL_PERIOD_UNIT))
+        poll_nr = max(1, min(poll_nr, 0xFE))
+        targets = self.pn532.auto_poll(poll_nr=poll_nr,
+                                       period=self.auto_poll_period,
+                                       types=self.auto_poll_types)
+        uids = []
+        self._sel_res = []
+        for target_type, data in targets or ():
+            if target_type in _ISO14443A_TYPES:
+                # Tg, SENS_RES (2), SEL_RES, NFCID length, NFCID
+                uids.append(data[5:5+data[4]])
+                self._sel_res.append(data[3])
+            else:
+                logger.debug(f"Ignoring target of type {hex(target_type)}")
+        return uids
+    
+    def _listen(self, timeout):
+        """Wait up to `timeout` seconds for the pending InListPassiveTarget
+        to find tags, sending a new one if none is pending"""
+        if self.pn532.listening and time.monotonic() - self._listen_sent >= self.listen_refresh:
+            self.pn532.cancel_listen()
+        if not self.pn532.listening:
+            self._listen_sent = time.monotonic()
+            if not self.pn532.listen_for_passive_targets(max_targets=self.max_targets,
+                                                         timeout=timeout):
+                return []
+        targets = self.pn532.get_passive_targets(timeout)
+        if targets is None:
+            # Still listening, the next cycle picks up from here
+            return []
+        self._sel_res = [sel_res for uid, sens_res, sel_res in targets]
+        return [uid for uid, sens_res, sel_res in targets]
+    
+    def read_ndef(self):
+        """Read the NDEF records of the tag found by the last poll
+        
+        Only works for a single NTAG or MIFARE Ultralight tag in the field.
+        Returns a list of NdefRecord objects, or None if the tag could not be
+        read or holds no NDEF message.
+        """
+        if self._sel_res != [_SEL_RES_TYPE2]:
             return None
+        try:
+            message = read_ntag_message(self.pn532)
+            if message is None:
+                return None
+            return list(parse_message(message))
+        except NdefError as e:
+            logger.warning(f"Invalid NDEF message on tag: {e}")
+        except PN532Error as e:
+            logger.warning(f"Error reading NDEF message: {e.errmsg}")
+            self._count_pn532_error(e)
+        except Exception as e:
+            logger.warning(f"Error reading NDEF message: {e}")
+            metrics.READER_ERRORS.inc(self._metrics_label, type(e).__name__)
+        return None
+    
+    def power_down(self):
+        """Put the PN532 into PowerDown until the next poll, which wakes it
+        up again. Returns whether it went to sleep.
+        """
+        try:
+            self.pn532.power_down()
+            return True
+        except PN532Error as e:
+            logger.warning(f"Error powering down PN532: {e.errmsg}")
+            self._count_pn532_error(e)
+        except Exception as e:
+            logger.warning(f"Error powering down PN532: {e}")
+            metrics.READER_ERRORS.inc(self._metrics_label, type(e).__name__)
+        return False
     
     def cleanup(self):
         """Clean up resources"""
-        # The pn532 library doesn't have a specific cleanup method
-        # but we could add one if needed in the future
-        self.pn532 = None
+        self._close()
         logger.info("PN532 reader cleaned up")
 
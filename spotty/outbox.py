@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+Outbox module for keeping undelivered events on disk until Home Assistant is back
+"""
+
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger("spotty.outbox")
+
+class Outbox:
+    """Crash-safe append-only queue of events, stored in SQLite
+
+    The database runs in WAL mode with synchronous=NORMAL, so appends only
+    write to the WAL and are not fsynced one by one. sync() checkpoints the WAL
+    (one fsync for everything written since the last call) and is called
+    periodically by the replayer, which keeps SD card wear down.
+    """
+
+    def __init__(self, path, max_events=1000):
+        """Open or create the outbox database at `path`
+
+        At most `max_events` are kept, the oldest ones are dropped first.
+        """
+        self.path = path
+        self.max_events = max_events
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        # Truncate the WAL back to this size after checkpoints
+        self._conn.execute("PRAGMA journal_size_limit=1048576")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS events ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "created REAL NOT NULL, "
+            "payload TEXT NOT NULL)"
+        )
+        self._count = self._conn.execute("SELECT COUNT(*) FROM events").fetchone()[0]
+        if self._count:
+            logger.info(f"Outbox {path} has {self._count} undelivered events")
+
+    def __len__(self):
+        return self._count
+
+    def append(self, payload, created=None):
+        """Store an event payload (a dict of tag_scanned arguments)"""
+        created = time.time() if created is None else created
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO events (created, payload) VALUES (?, ?)",
+                (created, json.dumps(payload))
+            )
+            self._count += 1
+            if self._count > self.max_events:
+                overflow = self._count - self.max_events
+                self._conn.execute(
+                    "DELETE FROM events WHERE id IN "
+                    "(SELECT id FROM events ORDER BY id LIMIT ?)",
+                    (overflow,)
+                )
+                self._count -= overflow
+                logger.warning(f"Outbox full, dropped {overflow} oldest events")
+            self._dirty = True
+
+    def peek(self, limit):
+        """Return up to `limit` of the oldest events as (id, created, payload)"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, created, payload FROM events ORDER BY id LIMIT ?",
+                (limit,)
+            ).fetchall()
+        return [(event_id, created, json.loads(payload)) for event_id, created, payload in rows]
+
+    def remove(self, ids):
+        """Remove delivered (or expired) events"""
+        if not ids:
+            return
+        with self._lock:
+            cursor = self._conn.execute(
+                f"DELETE FROM events WHERE id IN ({','.join('?' * len(ids))})",
+                list(ids)
+            )
+            self._count -= cursor.rowcount
+            self._dirty = True
+
+    def sync(self):
+        """Flush everything written since the last sync to disk"""
+        with self._lock:
+            if not self._dirty:
+                return
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            self._dirty = False
+
+    def close(self):
+        """Sync and close the database"""
+        self.sync()
+        with self._lock:
+            self._conn.close()
+
+class OutboxReplayer:
+    """Background thread that drains the outbox in order once delivery works again"""
+
+    def __init__(self, outbox, send, batch_size=20, max_age=300,
+                 sync_interval=1.0, retry_interval=1.0, max_retry_interval=60.0):
+        """Initialize the replayer
+
+        `send` is called with the stored payload as keyword arguments and should
+        return True when the event was delivered. Events older than `max_age`
+        seconds are dropped instead of replayed, since a tag scan from long ago
+        should not suddenly trigger an automation.
+        """
+        self.outbox = outbox
+        self._send = send
+        self.batch_size = batch_size
+        self.max_age = max_age
+        self.sync_interval = sync_interval
+        self.retry_interval = retry_interval
+        self.max_retry_interval = max_retry_interval
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+        # Metrics
+        self.replayed = 0
+        self.expired = 0
+
+    def start(self):
+        """Start the replayer thread"""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="spotty-outbox", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        """Stop the replayer thread and sync the outbox"""
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+        self.outbox.sync()
+
+    @property
+    def pending(self):
+        """Number of events waiting to be replayed"""
+        return len(self.outbox)
+
+    def store(self, payload, created=None):
+        """Store an undelivered event and wake up the replayer"""
+        self.outbox.append(payload, created=created)
+        self._wake.set()
+
+    def _run(self):
+        """Replayer thread main loop"""
+        delay = self.retry_interval
+        while not self._stop.is_set():
+            self._wake.wait(self.sync_interval)
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            self.outbox.sync()
+            if self._drain():
+                delay = self.retry_interval
+            else:
+                # Home Assistant is still unreachable, back off
+                self._stop.wait(delay)
+                delay = min(delay * 2, self.max_retry_interval)
+
+    def _drain(self):
+        """Send stored events in order, returns False if a delivery failed"""
+        while not self._stop.is_set():
+            batch = self.outbox.peek(self.batch_size)
+            if not batch:
+                return True
+            done = []
+            try:
+                for event_id, created, payload in batch:
+                    if time.time() - created > self.max_age:
+                        logger.warning(f"Dropping expired event from outbox: {payload}")
+                        self.expired += 1
+                    else:
+                        try:
+                            success = self._send(**payload)
+                        except Exception as e:
+                            logger.error(f"Error replaying event {payload}: {e}")
+                            success = False
+                        if not success:
+                            return False
+                        self.replayed += 1
+                    done.append(event_id)
+            finally:
+                self.outbox.remove(done)
+        return True
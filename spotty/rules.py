@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+Rules module for running Home Assistant service calls straight from a tag scan
+
+A rules file maps tag ids to actions, in the same shape as the actions of a
+Home Assistant automation:
+
+    nfc_0x4_0x11_0x22_0x33_0x44_0x55_0x66:
+      fire_event: false
+      actions:
+        - service: media_player.select_source
+          target:
+            entity_id: media_player.spotify
+          data:
+            source: Moode Spotify
+        - parallel:
+            - service: media_player.play_media
+              ...
+            - service: light.turn_on
+              ...
+
+Actions run one after the other and stop at the first failure; the actions
+of a `parallel` group (each one a single action or a `sequence` of them)
+run at the same time. With `fire_event: false` the tag_scanned event is not
+sent for the tag. The file is reloaded when it changes.
+"""
+
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import yaml
+
+from . import metrics
+
+logger = logging.getLogger("spotty.rules")
+
+# Seconds between checks of the rules file for changes
+CHECK_INTERVAL = 1.0
+
+class RuleError(ValueError):
+    """Invalid rules file"""
+
+class ServiceAction:
+    """Call of a Home Assistant service"""
+
+    def __init__(self, domain, service, service_data):
+        self.domain = domain
+        self.service = service
+        self.service_data = service_data
+
+    @property
+    def name(self):
+        return f"{self.domain}.{self.service}"
+
+class ParallelAction:
+    """Sequences of actions that run at the same time"""
+
+    def __init__(self, branches):
+        self.branches = branches
+
+class Rule:
+    """Actions to run for a tag, and whether to still send tag_scanned"""
+
+    def __init__(self, tag_id, actions, fire_event=True):
+        self.tag_id = tag_id
+        self.actions = actions
+        self.fire_event = fire_event
+
+def _parse_sequence(actions, where):
+    if isinstance(actions, dict):
+        actions = [actions]
+    if not isinstance(actions, list):
+        raise RuleError(f"{where}: expected a list of actions")
+    return [_parse_action(action, f"{where}[{index}]") for index, action in enumerate(actions)]
+
+def _parse_action(action, where):
+    if not isinstance(action, dict):
+        raise RuleError(f"{where}: expected an action")
+    if "parallel" in action:
+        branches = action["parallel"]
+        if not isinstance(branches, list):
+            raise RuleError(f"{where}: parallel expects a list")
+        return ParallelAction([
+            _parse_sequence(branch.get("sequence", branch) if isinstance(branch, dict) else branch,
+                            f"{where}.parallel[{index}]")
+            for index, branch in enumerate(branches)
+        ])
+    if "sequence" in action:
+        # A sequence on its own behaves like a parallel group with one branch
+        return ParallelAction([_parse_sequence(action["sequence"], f"{where}.sequence")])
+    # Home Assistant calls it "action" since 2024.8, "service" before
+    name = action.get("action") or action.get("service")
+    if not isinstance(name, str) or name.count(".") != 1:
+        raise RuleError(f"{where}: expected a service like domain.service")
+    domain, service = name.split(".")
+    service_data = dict(action.get("data") or {})
+    # The REST API takes the target in the service data
+    service_data.update(action.get("target") or {})
+    return ServiceAction(domain, service, service_data)
+
+def parse_rules(config):
+    """Build a dict of tag id to Rule from the parsed rules file"""
+    if config is None:
+        return {}
+    if not isinstance(config, dict):
+        raise RuleError("Rules file must map tag ids to rules")
+    rules = {}
+    for tag_id, rule in config.items():
+        tag_id = str(tag_id)
+        if isinstance(rule, dict) and "actions" in rule:
+            actions = _parse_sequence(rule["actions"], tag_id)
+            fire_event = bool(rule.get("fire_event", True))
+        else:
+            actions = _parse_sequence(rule, tag_id)
+            fire_event = True
+        rules[tag_id] = Rule(tag_id, actions, fire_event)
+    return rules
+
+class RulesTable:
+    """Rules loaded from a YAML file and swapped out when the file changes"""
+
+    def __init__(self, path, call_service, max_workers=4):
+        """`call_service(domain, service, service_data)` runs the service
+        calls, and returns whether they succeeded. Rules run on a pool of
+        `max_workers` threads, so scans never wait for them.
+        """
+        self.path = path
+        self._call_service = call_service
+        self._rules = {}
+        self._mtime = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers,
+                                            thread_name_prefix="spotty-rules")
+        self.reload()
+
+    def __len__(self):
+        return len(self._rules)
+
+    def reload(self):
+        """Load the rules file, keeping the current rules if it is invalid"""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError as e:
+            logger.error(f"Cannot read rules file {self.path}: {e}")
+            return False
+        try:
+            with open(self.path, "r") as f:
+                rules = parse_rules(yaml.safe_load(f))
+        except Exception as e:
+            logger.error(f"Error loading rules from {self.path}, keeping the previous rules: {e}")
+            self._mtime = mtime
+            return False
+        # Replacing the dict is atomic, lookups never see a half loaded table
+        self._rules = rules
+        self._mtime = mtime
+        logger.info(f"Loaded {len(rules)} rules from {self.path}")
+        return True
+
+    def _check(self):
+        """Reload the rules if the file changed, at most every CHECK_INTERVAL"""
+        now = time.monotonic()
+        if now - self._checked < CHECK_INTERVAL:
+            return
+        with self._lock:
+            if now - self._checked < CHECK_INTERVAL:
+                return
+            self._checked = now
+            try:
+                mtime = os.stat(self.path).st_mtime_ns
+            except OSError:
+                return
+            if mtime != self._mtime:
+                self.reload()
+
+    def lookup(self, tag_id):
+        """The rule for `tag_id`, or None"""
+        self._check()
+        return self._rules.get(tag_id)
+
+    def run(self, rule):
+        """Run the actions of `rule` in the background, returns a future
+        telling whether all of them succeeded
+        """
+        return self._executor.submit(self._run_rule, rule)
+
+    def close(self):
+        """Wait for running rules to finish"""
+        self._executor.shutdown(wait=True)
+
+    def _run_rule(self, rule):
+        start = time.monotonic()
+        success = self._run_sequence(rule.actions)
+        metrics.RULE_DURATION.observe(time.monotonic() - start)
+        if success:
+            logger.info(f"Ran rule for {rule.tag_id} in {time.monotonic() - start:.3f}s")
+        else:
+            logger.error(f"Rule for {rule.tag_id} failed")
+        return success
+
+    def _run_sequence(self, actions):
+        for action in actions:
+            if isinstance(action, ParallelAction):
+                success = self._run_parallel(action.branches)
+            else:
+                success = self._run_service(action)
+            if not success:
+                return False
+        return True
+
+    def _run_parallel(self, branches):
+        # Branches get threads of their own rather than pool workers, so
+        # nested groups can't starve the pool. The first one runs here.
+        results = [False] * len(branches)
+        def run_branch(index):
+            try:
+                results[index] = self._run_sequence(branches[index])
+            except Exception as e:
+                logger.error(f"Error running actions: {e}")
+        threads = [threading.Thread(target=run_branch, args=(index,), daemon=True)
+                   for index in range(1, len(branches))]
+        for thread in threads:
+            thread.start()
+        if branches:
+            run_branch(0)
+        for thread in threads:
+            thread.join()
+        return all(results)
+
+    def _run_service(self, action):
+        try:
+            success = self._call_service(action.domain, action.service, action.service_data)
+        except Exception as e:
+            logger.error(f"Error calling {action.name}: {e}")
+            success = False
+        metrics.RULE_ACTIONS.inc(action.name, "success" if success else "failure")
+        return success
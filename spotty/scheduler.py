@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Scheduler module for adapting the poll rate of a reader to how busy it is
+"""
+
+import logging
+import time
+
+logger = logging.getLogger("spotty.scheduler")
+
+class PollScheduler:
+    """Decides how long a reader waits between poll cycles
+
+    For `active_window` seconds after a tag was last seen the reader polls
+    back to back, as it does without a scheduler. After that the wait
+    between cycles starts at `min_interval` and doubles every idle cycle, up
+    to `idle_interval`, so a reader nobody uses polls once every
+    `idle_interval` seconds instead of continuously. A tag found in any cycle resets the schedule.
+    With `power_down`, the PN532 is put into PowerDown for those waits.
+    """
+
+    def __init__(self, active_window=30.0, idle_interval=2.0, min_interval=0.1,
+                 power_down=False):
+        self.active_window = active_window
+        self.idle_interval = idle_interval
+        self.min_interval = min(min_interval, idle_interval)
+        self.power_down = power_down
+        self.last_activity = time.monotonic()
+        self._delay = 0.0
+
+    @property
+    def idle(self):
+        """Whether the active window has run out"""
+        return time.monotonic() - self.last_activity >= self.active_window
+
+    def activity(self):
+        """Record that a tag was seen, going back to polling back to back"""
+        self.last_activity = time.monotonic()
+        if self._delay:
+            logger.debug("Tag seen, polling at full rate")
+        self._delay = 0.0
+
+    def next_delay(self, found):
+        """Seconds to wait before the next poll cycle, after a cycle that
+        found tags or not
+        """
+        if found:
+            self.activity()
+            return 0.0
+        if not self.idle:
+            return 0.0
+        if not self._delay:
+            logger.debug(f"No tag for {self.active_window}s, backing off to "
+                         f"a poll every {self.idle_interval}s")
+            self._delay = self.min_interval
+        else:
+            self._delay = min(self._delay * 2, self.idle_interval)
+        return self._delay
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Supervisor module for recovering PN532 readers that stop working
+"""
+
+import logging
+import time
+
+from . import metrics
+
+logger = logging.getLogger("spotty.supervisor")
+
+# Reader states
+STATE_OK = "ok"            # last poll cycle went fine
+STATE_FAILING = "failing"  # poll cycles are failing, not yet re-initialized
+STATE_DOWN = "down"        # re-initialization failed, waiting to try again
+
+class ReaderSupervisor:
+    """Polls a PN532Reader and re-initializes it when it keeps failing
+
+    A poll cycle fails when the reader reports an error for it, including
+    commands the PN532 never acknowledged. After `failure_threshold`
+    consecutive failures the driver is closed and initialized again in
+    place. Further attempts wait `backoff` seconds, doubling up to
+    `max_backoff`, until a poll cycle succeeds again. A reader that does not
+    come up in start() is down from the beginning and recovered the same way.
+    """
+
+    def __init__(self, reader, failure_threshold=3, backoff=1.0, max_backoff=60.0):
+        self.reader = reader
+        self.failure_threshold = failure_threshold
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.state = STATE_OK
+        self.consecutive_failures = 0
+        self.failures = 0
+        self.recoveries = 0
+        # Failed poll cycles by error class
+        self.errors = {}
+        self.last_error = None
+        self.last_success = time.monotonic()
+        self._delay = backoff
+        self._next_attempt = 0.0
+
+        label = reader.device_id or reader.port
+        metrics.READER_UP.set_function(lambda: 0 if self.state == STATE_DOWN else 1, label)
+        metrics.READER_CONSECUTIVE_FAILURES.set_function(lambda: self.consecutive_failures, label)
+
+    def start(self):
+        """Initialize the reader, returns whether that worked
+
+        A reader that fails to initialize goes down, and read_tags() tries
+        again after the backoff.
+        """
+        try:
+            self.reader.reinitialize()
+        except Exception as e:
+            self.consecutive_failures += 1
+            self.failures += 1
+            self._count_error(e)
+            self._go_down(e)
+            logger.error(f"Reader {self.reader.device_id} did not start, "
+                         f"retrying in {self._next_attempt - time.monotonic():.1f}s: {e}")
+            return False
+        self.last_success = time.monotonic()
+        return True
+
+    def read_tags(self):
+        """Run one poll cycle, returns the UIDs found
+
+        While the reader is down this waits for the next recovery attempt (at
+        most one read timeout, so the caller can still stop) and returns no tags.
+        """
+        if self.state == STATE_DOWN:
+            remaining = self._next_attempt - time.monotonic()
+            if remaining > 0:
+                time.sleep(min(remaining, self.reader.timeout))
+                return []
+            self._recover()
+            return []
+
+        uids = self.reader.read_tags()
+        error = self.reader.error
+        if error is None:
+            if self.state != STATE_OK:
+                logger.info(f"Reader {self.reader.device_id} is working again")
+            self.state = STATE_OK
+            self.consecutive_failures = 0
+            self.last_success = time.monotonic()
+            self._delay = self.backoff
+            return uids
+
+        self.consecutive_failures += 1
+        self.failures += 1
+        self._count_error(error)
+        self.state = STATE_FAILING
+        if self.consecutive_failures >= self.failure_threshold:
+            if time.monotonic() >= self._next_attempt:
+                self._recover()
+            else:
+                self.state = STATE_DOWN
+        return uids
+
+    def _recover(self):
+        """Re-initialize the reader, and schedule the next attempt"""
+        logger.warning(f"Re-initializing reader {self.reader.device_id} after "
+                       f"{self.consecutive_failures} consecutive failures ({self.last_error})")
+        start = time.monotonic()
+        try:
+            self.reader.reinitialize()
+        except Exception as e:
+            self._go_down(e)
+            logger.error(f"Re-initializing reader {self.reader.device_id} failed, "
+                         f"retrying in {self._next_attempt - time.monotonic():.1f}s: {e}")
+            return
+        self._next_attempt = time.monotonic() + self._delay
+        self._delay = min(self._delay * 2, self.max_backoff)
+        self.recoveries += 1
+        # Give the fresh driver a full set of poll cycles before trying again
+        self.consecutive_failures = 0
+        self.state = STATE_FAILING
+        logger.info(f"Re-initialized reader {self.reader.device_id} in "
+                    f"{time.monotonic() - start:.3f}s")
+
+    def _count_error(self, error):
+        """Record a failure with `error`"""
+        error_class = type(error).__name__
+        self.errors[error_class] = self.errors.get(error_class, 0) + 1
+        self.last_error = f"{error_class}: {error}"
+
+    def _go_down(self, error):
+        """Take the reader down after a failed initialization, until the
+        next attempt is due"""
+        # Back off from the end of the attempt, a cold start takes a while
+        self._next_attempt = time.monotonic() + self._delay
+        self._delay = min(self._delay * 2, self.max_backoff)
+        self.state = STATE_DOWN
+        self.last_error = f"{type(error).__name__}: {error}"
+
+    def health(self):
+        """Return a snapshot of the reader health"""
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "failures": self.failures,
+            "recoveries": self.recoveries,
+            "errors": dict(self.errors),
+            "last_error": self.last_error,
+            "seconds_since_success": round(time.monotonic() - self.last_success, 3),
+        }